@@ -0,0 +1,183 @@
+"""
+Time-bucketed min/mean/max of a device's sensor readings for /api/sensor/aggregate.
+
+Buckets are computed by Mongo ($dateTrunc, MongoDB 5.0+) when possible, with a
+streaming pure-Python fallback. LTTB downsampling caps the number of points
+returned for charting.
+"""
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from pymongo.errors import OperationFailure
+
+from logs import get_logger
+
+SENSOR_FIELDS = ["temperature", "humidity", "ph", "ec", "N", "P", "K", "moisture"]
+BUCKET_SECONDS = {"minute": 60, "hour": 3600, "day": 86400}
+# Range used when ?start= is not given
+DEFAULT_SPANS = {"minute": timedelta(days=1), "hour": timedelta(days=7), "day": timedelta(days=90)}
+MAX_AGGREGATE_BUCKETS = int(os.environ.get("MAX_AGGREGATE_BUCKETS", 5000))
+# "auto" tries Mongo first, "mongo" or "python" force one path
+AGGREGATE_BACKEND = os.environ.get("AGGREGATE_BACKEND", "auto")
+
+EPOCH = datetime(1970, 1, 1)
+
+log = get_logger("aggregates")
+
+# Set once Mongo rejects the pipeline (e.g. a server older than 5.0), so later
+# requests go straight to the fallback
+_mongo_unsupported = False
+
+
+def bucket_start(timestamp, bucket):
+    """Floor a naive timestamp to its bucket, the same way $dateTrunc does in UTC"""
+    width = BUCKET_SECONDS[bucket]
+    seconds = int((timestamp - EPOCH).total_seconds() // width) * width
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def mongo_buckets(collection, device_id, start, end, bucket, fields):
+    """Aggregate server-side; returns a list of bucket rows sorted by time"""
+    group = {"_id": {"$dateTrunc": {"date": "$timestamp", "unit": bucket}}, "count": {"$sum": 1}}
+    for field in fields:
+        group[f"{field}__min"] = {"$min": f"${field}"}
+        group[f"{field}__mean"] = {"$avg": f"${field}"}
+        group[f"{field}__max"] = {"$max": f"${field}"}
+    pipeline = [
+        {"$match": {"device_id": device_id, "timestamp": {"$gte": start, "$lt": end}}},
+        {"$group": group},
+        {"$sort": {"_id": 1}},
+    ]
+    rows = []
+    for result in collection.aggregate(pipeline, allowDiskUse=True):
+        row = {"timestamp": result["_id"], "count": result["count"]}
+        for field in fields:
+            row[field] = (result[f"{field}__min"], result[f"{field}__mean"], result[f"{field}__max"])
+        rows.append(row)
+    return rows
+
+
+def python_buckets(collection, device_id, start, end, bucket, fields, batch_size=5000):
+    """Aggregate by streaming the raw readings; memory grows with buckets, not readings"""
+    projection = {field: 1 for field in fields}
+    projection.update({"timestamp": 1, "_id": 0})
+    cursor = collection.find({"device_id": device_id, "timestamp": {"$gte": start, "$lt": end}},
+                             projection, batch_size=batch_size)
+    return summarize(cursor, bucket, fields)
+
+
+def summarize(docs, bucket, fields):
+    """Bucket rows, sorted by time, for an iterable of readings in any order"""
+    buckets = {}  # bucket start -> [count, {field: [min, sum, max, n]}]
+    for doc in docs:
+        key = bucket_start(doc["timestamp"], bucket)
+        acc = buckets.get(key)
+        if acc is None:
+            acc = buckets[key] = [0, {}]
+        acc[0] += 1
+        for field in fields:
+            value = doc.get(field)
+            if value is None:
+                continue
+            stats = acc[1].get(field)
+            if stats is None:
+                acc[1][field] = [value, value, value, 1]
+            else:
+                if value < stats[0]:
+                    stats[0] = value
+                if value > stats[2]:
+                    stats[2] = value
+                stats[1] += value
+                stats[3] += 1
+    rows = []
+    for key in sorted(buckets):
+        count, field_stats = buckets[key]
+        row = {"timestamp": key, "count": count}
+        for field in fields:
+            stats = field_stats.get(field)
+            row[field] = (stats[0], stats[1] / stats[3], stats[2]) if stats else (None, None, None)
+        rows.append(row)
+    return rows
+
+
+def aggregate_buckets(collection, device_id, start, end, bucket, fields):
+    """Returns (rows, source) where source is "mongo" or "python" """
+    global _mongo_unsupported
+    if AGGREGATE_BACKEND == "mongo" or (AGGREGATE_BACKEND == "auto" and not _mongo_unsupported):
+        try:
+            return mongo_buckets(collection, device_id, start, end, bucket, fields), "mongo"
+        except Exception as e:
+            if AGGREGATE_BACKEND == "mongo":
+                raise
+            # The server rejected the pipeline itself: do not try it again
+            if isinstance(e, OperationFailure):
+                _mongo_unsupported = True
+            log.warning("Mongo aggregation unavailable, using Python fallback", error=str(e))
+    return python_buckets(collection, device_id, start, end, bucket, fields), "python"
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: indices of at most threshold points of (x, y)
+    that keep the visual shape of the series. First and last points are always kept,
+    except that a threshold of 1 keeps only the first.
+    """
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.asarray([0, n - 1][:max(threshold, 0)], dtype=int)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if np.isnan(y).any():
+        y = np.where(np.isnan(y), np.nanmean(y) if not np.isnan(y).all() else 0.0, y)
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected.append(a)
+    selected.append(n - 1)
+    return np.asarray(selected)
+
+
+def downsample(rows, max_points, field):
+    """Keep at most max_points rows, chosen by LTTB on the field's mean"""
+    if not max_points or len(rows) <= max_points:
+        return rows
+    x = [(row["timestamp"] - EPOCH).total_seconds() for row in rows]
+    y = [row[field][1] if row[field][1] is not None else np.nan for row in rows]
+    return [rows[i] for i in lttb(x, y, max_points)]
+
+
+def to_columns(rows, fields):
+    """Column-oriented response body: parallel arrays instead of one object per bucket"""
+    def rounded(value):
+        return None if value is None else round(float(value), 3)
+
+    columns = {
+        "timestamps": [row["timestamp"].isoformat() for row in rows],
+        "count": [row["count"] for row in rows],
+        "fields": {
+            field: {
+                "min": [rounded(row[field][0]) for row in rows],
+                "mean": [rounded(row[field][1]) for row in rows],
+                "max": [rounded(row[field][2]) for row in rows],
+            }
+            for field in fields
+        },
+    }
+    # Rollup rows also carry a standard deviation per field
+    if rows and "std" in rows[0]:
+        for field in fields:
+            columns["fields"][field]["std"] = [rounded(row["std"][field]) for row in rows]
+    return columns
@@ -0,0 +1,272 @@
+"""
+Online anomaly and threshold alerts for incoming sensor readings.
+
+Every reading accepted by /api/esp32 and /api/esp32/batch goes through
+AnomalyDetector.observe(). Per device and field it keeps an exponentially
+weighted mean and variance (ANOMALY_ALPHA), the last value and how many times
+in a row it was repeated: constant memory, no history reads. Three checks:
+
+    zscore  |value - mean| / std above ANOMALY_Z_THRESHOLD, once ANOMALY_WARMUP
+            readings are in; at most one per field every ANOMALY_COOLDOWN seconds
+    stuck   the same value ANOMALY_STUCK_READINGS times in a row (a frozen or
+            disconnected sensor); once per run
+    range   outside the device's target crop range (min/max over that crop's rows
+            in crop-data.csv), or the ALERT_RANGES bounds for ec and moisture,
+            which crop-data.csv has no columns for; once per excursion
+
+Outliers are folded into the statistics too, so a lasting shift in level stops
+raising z-score alerts once the average has caught up with it.
+
+Alerts are queued to a BatchWriter and written to the alerts collection off the
+request path; GET /api/alerts reads them back. Detector state is checkpointed to
+the anomaly_state collection every ANOMALY_CHECKPOINT_INTERVAL seconds and on
+shutdown, and reloaded when a worker starts. Each worker keeps its own state for
+the readings it handled: with several workers a device's readings are split
+between them, and its checkpoint is whichever worker wrote last.
+"""
+import math
+import os
+import threading
+from datetime import datetime
+
+from pymongo import ReplaceOne
+
+from aggregates import SENSOR_FIELDS
+from ingest import IngestQueueFull
+from logs import get_logger
+
+ANOMALY_DETECTION = os.environ.get("ANOMALY_DETECTION", "1") == "1"
+# Weight of the newest reading in the running mean and variance (~2/alpha readings of memory)
+ANOMALY_ALPHA = float(os.environ.get("ANOMALY_ALPHA", 0.05))
+ANOMALY_Z_THRESHOLD = float(os.environ.get("ANOMALY_Z_THRESHOLD", 4.0))
+ANOMALY_WARMUP = int(os.environ.get("ANOMALY_WARMUP", 30))
+ANOMALY_STUCK_READINGS = int(os.environ.get("ANOMALY_STUCK_READINGS", 20))
+ANOMALY_COOLDOWN = float(os.environ.get("ANOMALY_COOLDOWN", 900))
+ANOMALY_CHECKPOINT_INTERVAL = float(os.environ.get("ANOMALY_CHECKPOINT_INTERVAL", 30))
+# field:low:high bounds that apply to every device
+ALERT_RANGES = os.environ.get("ALERT_RANGES", "ec:0.2:3.5,moisture:20:80")
+# Upper bound on ?limit= for GET /api/alerts
+MAX_ALERTS_PAGE = int(os.environ.get("MAX_ALERTS_PAGE", 500))
+
+ALERT_KINDS = ["zscore", "stuck", "range"]
+ALERT_INDEX = [("device_id", 1), ("timestamp", -1)]
+
+# Floor for the standard deviation in z-scores, about one step of sensor
+# resolution, so a field that has been perfectly steady does not alert on its
+# next small change
+MIN_STD = {"temperature": 0.2, "humidity": 0.5, "ph": 0.05, "ec": 0.05,
+           "N": 1.0, "P": 1.0, "K": 1.0, "moisture": 0.5}
+
+# Positions in a field's state list
+N, MEAN, VAR, LAST, REPEATS, OUT_OF_RANGE, ALERTED_AT = range(7)
+
+log = get_logger("alerts")
+
+
+def parse_ranges(text):
+    """{field: (low, high)} from "field:low:high,..." """
+    ranges = {}
+    for part in text.split(","):
+        if part.strip():
+            field, low, high = part.split(":")
+            ranges[field.strip()] = (float(low), float(high))
+    return ranges
+
+
+class CropRanges:
+    """Per-crop (low, high) of each sensor field, plus bounds that apply to every crop"""
+
+    def __init__(self, ranges, common):
+        self.common = common
+        self.ranges = {crop: dict(common, **fields) for crop, fields in ranges.items()}
+        self.labels = sorted(self.ranges)
+
+    @classmethod
+    def from_dataframe(cls, crop_data, common=None):
+        """min/max of every sensor field crop-data.csv has, per crop"""
+        fields = [field for field in SENSOR_FIELDS if field in crop_data.columns]
+        grouped = crop_data.groupby("label")[fields]
+        lows, highs = grouped.min(), grouped.max()
+        ranges = {crop: {field: (float(lows.at[crop, field]), float(highs.at[crop, field])) for field in fields}
+                  for crop in lows.index}
+        return cls(ranges, parse_ranges(ALERT_RANGES) if common is None else common)
+
+    def __contains__(self, crop_name):
+        return crop_name in self.ranges
+
+    def get(self, crop_name):
+        """Bounds for a device growing crop_name (None or unknown: the common bounds only)"""
+        return self.ranges.get(crop_name, self.common)
+
+
+class AnomalyDetector:
+    """Running statistics per (device, field) and the alerts they raise"""
+
+    def __init__(self, state_collection, writer, alpha=ANOMALY_ALPHA, z_threshold=ANOMALY_Z_THRESHOLD,
+                 warmup=ANOMALY_WARMUP, stuck_readings=ANOMALY_STUCK_READINGS, cooldown=ANOMALY_COOLDOWN,
+                 checkpoint_interval=ANOMALY_CHECKPOINT_INTERVAL):
+        self.state_collection = state_collection
+        self.writer = writer
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.warmup = warmup
+        self.stuck_readings = stuck_readings
+        self.cooldown = cooldown
+        self.checkpoint_interval = checkpoint_interval
+        self._devices = {}  # device_id -> {field: [n, mean, var, last, repeats, out_of_range, alerted_at]}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.stats = {"readings": 0, "alerts": 0, "dropped": 0, "checkpoints": 0, "restored": 0, "failed": 0}
+
+    def observe(self, device_id, reading, fields, bounds):
+        """
+        Update the device's statistics with one reading (a sensor_data document)
+        and queue any alerts it raises. fields are the ones the device actually
+        sent, so defaults filled in for missing sensors are not tracked. bounds
+        is {field: (low, high)}, from CropRanges.get(). Returns the alerts.
+        """
+        self.ensure_started()
+        alpha = self.alpha
+        timestamp = reading["timestamp"]
+        alerts = []
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is None:
+                state = self._devices[device_id] = {}
+            for field in fields:
+                value = reading.get(field)
+                if value is None:
+                    continue
+                stats = state.get(field)
+                if stats is None:
+                    stats = state[field] = [0, value, 0.0, None, 0, False, 0.0]
+                n, mean, var = stats[N], stats[MEAN], stats[VAR]
+
+                # z-score against the statistics from before this reading
+                if n >= self.warmup:
+                    std = math.sqrt(var)
+                    z = (value - mean) / max(std, MIN_STD.get(field, 1e-9))
+                    if abs(z) > self.z_threshold:
+                        seconds = timestamp.timestamp()
+                        if seconds - stats[ALERTED_AT] >= self.cooldown:
+                            stats[ALERTED_AT] = seconds
+                            alerts.append(self._alert(device_id, timestamp, "zscore", field, value,
+                                                      mean=round(mean, 4), std=round(std, 4), z=round(z, 2)))
+                diff = value - mean
+                increment = alpha * diff
+                stats[N] = n + 1
+                stats[MEAN] = mean + increment
+                stats[VAR] = (1 - alpha) * (var + diff * increment)
+
+                if value == stats[LAST]:
+                    stats[REPEATS] += 1
+                    if stats[REPEATS] == self.stuck_readings:
+                        alerts.append(self._alert(device_id, timestamp, "stuck", field, value,
+                                                  repeats=self.stuck_readings))
+                else:
+                    stats[LAST] = value
+                    stats[REPEATS] = 1
+
+                limits = bounds.get(field)
+                if limits is not None:
+                    outside = value < limits[0] or value > limits[1]
+                    if outside and not stats[OUT_OF_RANGE]:
+                        alerts.append(self._alert(device_id, timestamp, "range", field, value,
+                                                  low=limits[0], high=limits[1]))
+                    stats[OUT_OF_RANGE] = outside
+            self._dirty.add(device_id)
+            self.stats["readings"] += 1
+        for alert in alerts:
+            self._emit(alert)
+        return alerts
+
+    @staticmethod
+    def _alert(device_id, timestamp, kind, field, value, **detail):
+        return dict(detail, device_id=device_id, timestamp=timestamp, kind=kind, field=field, value=value,
+                    created_at=datetime.now())
+
+    def _emit(self, alert):
+        try:
+            self.writer.submit(alert)
+            self.stats["alerts"] += 1
+        except IngestQueueFull:
+            self.stats["dropped"] += 1
+
+    def checkpoint(self):
+        """Write the state of every device that changed since the last checkpoint"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            states = [(device_id, {field: list(stats) for field, stats in self._devices[device_id].items()})
+                      for device_id in dirty if device_id in self._devices]
+        if not states:
+            return 0
+        now = datetime.now()
+        try:
+            self.state_collection.bulk_write(
+                [ReplaceOne({"_id": device_id}, {"fields": fields, "updated_at": now}, upsert=True)
+                 for device_id, fields in states], ordered=False)
+            self.stats["checkpoints"] += 1
+        except Exception as e:
+            # Try again next time
+            with self._lock:
+                self._dirty |= dirty
+            self.stats["failed"] += 1
+            log.error("Error checkpointing anomaly state", devices=len(states), error=str(e))
+        return len(states)
+
+    def restore(self):
+        """Load checkpointed state for devices this process has not seen yet"""
+        restored = 0
+        try:
+            for doc in self.state_collection.find({}):
+                with self._lock:
+                    if doc["_id"] not in self._devices:
+                        self._devices[doc["_id"]] = {field: list(stats)
+                                                     for field, stats in doc.get("fields", {}).items()}
+                        restored += 1
+        except Exception as e:
+            log.error("Error restoring anomaly state", error=str(e))
+        self.stats["restored"] += restored
+        return restored
+
+    def ensure_started(self):
+        """Start the restore-then-checkpoint thread in this process (again after a fork)"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._stopping.clear()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="anomaly-checkpointer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        self.restore()
+        while not self._stopping.wait(self.checkpoint_interval):
+            self.checkpoint()
+
+    def stop(self, timeout=10):
+        """Checkpoint once more and write the alerts still queued"""
+        self._stopping.set()
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.checkpoint()
+        self.writer.stop()
+
+    def snapshot(self):
+        return dict(self.stats, devices=len(self._devices), queued=self.writer.depth())
+
+
+def find_alerts(collection, device_id, since=None, kind=None, field=None, limit=100):
+    """A device's alerts, newest first"""
+    query = {"device_id": device_id}
+    if since is not None:
+        query["timestamp"] = {"$gte": since}
+    if kind:
+        query["kind"] = kind
+    if field:
+        query["field"] = field
+    return list(collection.find(query, {"_id": 0}, sort=[("timestamp", -1)], limit=limit))
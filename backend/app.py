@@ -1,7 +1,6 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, session, g, has_app_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import pickle
-import pandas as pd
 import numpy as np
 import os
 import requests
@@ -12,6 +11,36 @@ from dotenv import load_dotenv
 from werkzeug.security import generate_password_hash, check_password_hash
 from pymongo import MongoClient
 import secrets
+import hmac
+import atexit
+import logging
+import threading
+import time
+from suitability import CropProfileIndex, CropNeighborIndex, NEIGHBOR_TOP_K
+from inference import CropInference, FertilizerEncoder, ForestPredictor, pin_n_jobs
+from model_store import LAZY_MODEL_LOADING, load_crop_model, load_fertilizer_bundle, load_crop_data
+from model_registry import ModelRegistry, ModelsView
+from ingest import (BatchWriter, IngestQueueFull, ESP32_INGEST_MODE, MAX_BATCH_READINGS,
+                    decode_readings, parse_device_timestamp)
+from device_cache import DeviceCache
+from alerts import (ANOMALY_DETECTION, ALERT_INDEX, ALERT_KINDS, MAX_ALERTS_PAGE, AnomalyDetector, CropRanges,
+                    find_alerts)
+from history import (MAX_HISTORY_PAGE_SIZE, HISTORY_FIELDS, TotalsCache, history_projection,
+                     encode_cursor, decode_cursor)
+from aggregates import (SENSOR_FIELDS, BUCKET_SECONDS, DEFAULT_SPANS, MAX_AGGREGATE_BUCKETS,
+                        downsample, to_columns)
+from rollups import Rollups, ROLLUP_INDEX, ROLLUP_RESOLUTIONS
+from export import EXPORT_BATCH_SIZE, EXPORT_FORMATS, export_stream
+from latest_store import create_latest_store
+from sensor_store import create_sensor_store
+from http_cache import (HTTP_ETAGS, STATIC_MAX_AGE, StaticHashes, WriteMarkers, compress_response, make_etag,
+                        not_modified, set_validator)
+from sensor_stream import SensorHub, TooManyClients, parse_event_id
+from prediction_cache import PredictionCache
+from offload import CpuPool
+from logs import ROOT_LOGGER, get_logger
+from metrics import (METRICS_ENABLED, INFERENCE_SECONDS, JSON_SECONDS, REQUEST_ERRORS, REQUEST_SECONDS,
+                     SUITABILITY_SECONDS, LogCounter, MongoCommandTimer, registry as metrics_registry, time_block)
 
 # Load environment variables from .env (only for local development)
 load_dotenv()
@@ -26,18 +55,124 @@ app.secret_key = os.environ.get('SECRET_KEY')
 if not app.secret_key:
     raise RuntimeError('SECRET_KEY environment variable not set!')
 
-# Store sensor data per device_id
-sensor_data = {}  # device_id -> latest data dict
+log = get_logger("app")
+if METRICS_ENABLED:
+    logging.getLogger(ROOT_LOGGER).addHandler(LogCounter())
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, timing every encode for /metrics"""
+
+    def dumps(self, obj, **kwargs):
+        with time_block(JSON_SECONDS):
+            return super().dumps(obj, **kwargs)
+
+app.json = TimedJSONProvider(app)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is not None:
+        # Route template rather than path, so ids do not create new series
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        status = str(response.status_code)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route=route, method=request.method, status=status)
+        if response.status_code >= 500:
+            REQUEST_ERRORS.inc(route=route, status=status)
+    return response
+
+# Latest sensor reading per device_id, shared across workers (LATEST_STORE_BACKEND)
+latest_readings = create_latest_store()
+# Out-of-order readings written by this process; part of the history ETags
+write_markers = WriteMarkers()
+# Content hashes for ?v= on static URLs, so the files can be cached for a long time
+static_hashes = StaticHashes(app.static_folder)
+
+@app.url_defaults
+def hashed_static_urls(endpoint, values):
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        digest = static_hashes.get(values['filename'])
+        if digest:
+            values['v'] = digest
+
+@app.after_request
+def cache_and_compress(response):
+    if request.endpoint == 'static' and response.status_code == 200:
+        # Only the URL naming the current content may be cached "forever"
+        if request.args.get('v') and request.args['v'] == static_hashes.get(request.view_args['filename']):
+            response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+        return response
+    return compress_response(response, request.accept_encodings)
+
+def history_etag(device_id, *parts):
+    """
+    ETag for a device's history plus the given request details, or None when no
+    reading is known for the device yet. Reads the shared latest-reading store and
+    this process's write markers only, never Mongo.
+    """
+    if not HTTP_ETAGS or ESP32_INGEST_MODE == "queued":
+        return None
+    reading = latest_readings.get(device_id)
+    if reading is None:
+        return None
+    newest = reading.get('timestamp')
+    return make_etag(device_id, newest, write_markers.get(device_id, newest), *parts)
+
+def note_late_write(device_id):
+    """Record readings that did not replace the device's newest one"""
+    reading = latest_readings.get(device_id)
+    write_markers.touch(device_id, reading.get('timestamp') if reading else None)
 
 # Hardcoded valid device IDs (replace with DB or CSV as needed)
 VALID_DEVICE_IDS = {"ABC123", "DEF456", "GHI789", "JKL012", "MNO345"}
 
 MONGO_URI = os.environ.get("MONGO_URI")
-client = MongoClient(MONGO_URI)
+# One client (and connection pool) per worker process. In async mode a worker
+# serves many requests at once, and each waiting on Mongo holds a connection.
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 100))
+# Every command is timed for /metrics through pymongo's command monitoring.
+# connect=False: no connection or monitor thread until the first operation, which
+# happens in a worker. With preload_app the client is created in the gunicorn
+# master, and a client that has connected is not safe to use across a fork.
+client = MongoClient(MONGO_URI, connect=False, maxPoolSize=MONGO_MAX_POOL_SIZE,
+                     event_listeners=[MongoCommandTimer()] if METRICS_ENABLED else [])
 db = client['terradetect']
 users_col = db['users']
 devices_col = db['device_ids']
-sensor_data_col = db['sensor_data']
+# Readings are stored one per document or packed into buckets (SENSOR_STORAGE)
+sensor_store = create_sensor_store(db)
+rollups_col = db['sensor_rollups']
+alerts_col = db['alerts']
+
+# device_id -> (api key hash, registered, target crop), so device checks do not hit Mongo every time
+device_cache = DeviceCache(lambda device_id: devices_col.find_one(
+    {"device_id": device_id}, {"_id": 0, "api_key": 1, "registered": 1, "target_crop": 1}))
+
+# Per-device reading counts for /api/sensor/history, refreshed every HISTORY_TOTAL_TTL seconds
+history_totals = TotalsCache(sensor_store.count)
+
+# Batches sensor_data inserts in the background when ESP32_INGEST_MODE=queued
+sensor_writer = BatchWriter(sensor_store)
+# Write out anything still queued when the worker exits
+atexit.register(sensor_writer.stop)
+
+# Hourly/daily per-device summaries, updated as readings arrive (ROLLUP_MODE)
+rollups = Rollups(rollups_col, db['rollup_state'])
+atexit.register(rollups.stop)
+
+# Streaming z-score, stuck-sensor and crop range checks on every reading (ANOMALY_DETECTION);
+# alerts are written to alerts_col in the background, state is checkpointed to anomaly_state
+anomaly_detector = AnomalyDetector(db['anomaly_state'], BatchWriter(alerts_col))
+atexit.register(anomaly_detector.stop)
+
+# Results of /predict and /predict/batch for recently seen inputs;
+# keyed by model version and emptied when a new version is swapped in
+prediction_cache = PredictionCache()
+# Model inference and password hashing, off the event loop in async mode (SERVER_MODE=async)
+cpu_pool = CpuPool()
 
 def load_models():
     """Load all required models and data"""
@@ -47,35 +182,119 @@ def load_models():
         'label_encoders': None,
         'fertilizer_details': [],
         'crop_mapping': {},
-        'crop_data': None
+        'crop_data': None,
+        'crop_profiles': None,
+        'crop_ranges': None,
+        'crop_neighbors': None,
+        'crop_inference': None,
+        'fertilizer_encoder': None,
+        'fertilizer_predictor': None,
+        'fertilizer_compositions': {}
     }
 
     try:
-        # Load crop recommendation model
-        with open(os.path.join(os.path.dirname(__file__), "crop-model.pkl"), "rb") as f:
-            models['crop_model'] = pickle.load(f)
-        print("Crop recommendation model loaded successfully.")
+        # Load crop recommendation model (joblib artifact if exported, else the pickle)
+        models['crop_model'] = load_crop_model()
+        models['crop_inference'] = CropInference(models['crop_model'])
+        log.info("Crop recommendation model loaded")
 
         # Load fertilizer model and data
-        with open(os.path.join(os.path.dirname(__file__), "fertilizer-model.pkl"), "rb") as f:
-            data = pickle.load(f)
-            models['fertilizer_model'] = data['model']
-            models['label_encoders'] = data['label_encoders']
-            models['fertilizer_details'] = data['fertilizer_details']
-            models['crop_mapping'] = data.get('crop_mapping', {})
-        print("Fertilizer recommendation model loaded successfully.")
+        data = load_fertilizer_bundle()
+        models['fertilizer_model'] = pin_n_jobs(data['model'])
+        models['label_encoders'] = data['label_encoders']
+        models['fertilizer_details'] = data['fertilizer_details']
+        models['crop_mapping'] = data.get('crop_mapping', {})
+        models['fertilizer_encoder'] = FertilizerEncoder(models['fertilizer_model'], models['label_encoders'])
+        models['fertilizer_predictor'] = ForestPredictor(models['fertilizer_model'], "fertilizer")
+        # Fertilizer name -> composition (first entry wins, like the old linear scan)
+        for item in models['fertilizer_details']:
+            models['fertilizer_compositions'].setdefault(item['name'], item['composition'])
+        log.info("Fertilizer recommendation model loaded")
         
         # Load crop data for suitability calculations
-        models['crop_data'] = pd.read_csv(os.path.join(os.path.dirname(__file__), "crop-data.csv"))
-        print("Crop data loaded successfully.")
+        models['crop_data'] = load_crop_data()
+        models['crop_profiles'] = CropProfileIndex.from_dataframe(models['crop_data'])
+        models['crop_neighbors'] = CropNeighborIndex.from_dataframe(models['crop_data'])
+        models['crop_ranges'] = CropRanges.from_dataframe(models['crop_data'])
+        log.info("Crop data loaded")
         
     except Exception as e:
-        print(f"Error loading models: {e}")
-    
+        log.exception("Error loading models", error=str(e))
+
     return models
 
-# Load models at startup
-models = load_models()
+_indexes_checked_pid = None
+
+def ensure_indexes():
+    """Create the indexes used by history and latest-reading queries, and the rollups and alerts indexes"""
+    try:
+        sensor_store.ensure_indexes()
+        rollups_col.create_index(ROLLUP_INDEX, unique=True)
+        alerts_col.create_index(ALERT_INDEX)
+    except Exception as e:
+        log.warning("Could not ensure sensor indexes", error=str(e))
+
+@app.before_request
+def check_indexes_once():
+    # Once per worker process, in the background: MongoClient must not be used
+    # in the gunicorn master before it forks, and startup must not wait on Mongo
+    global _indexes_checked_pid
+    if _indexes_checked_pid != os.getpid():
+        _indexes_checked_pid = os.getpid()
+        threading.Thread(target=ensure_indexes, daemon=True).start()
+
+# Versioned model sets, reloadable without a restart. The first set is loaded at
+# startup, or on first use when LAZY_MODEL_LOADING=1
+model_registry = ModelRegistry(load_models, lazy=LAZY_MODEL_LOADING)
+model_registry.on_swap(lambda new_models: prediction_cache.clear())
+# Each request reads the set that was active when it started
+models = ModelsView(model_registry, lambda: g.get('models') if has_app_context() else None)
+
+@app.before_request
+def pin_models():
+    g.models = model_registry.current()
+    model_registry.ensure_watching()
+
+# Shared secret for /api/admin/* (the admin endpoints are disabled without it)
+ADMIN_API_KEY = os.environ.get("ADMIN_API_KEY")
+
+# Required sensor fields, and optional ones with their defaults
+REQUIRED_SENSOR_FIELDS = ['temperature', 'ph', 'humidity']
+OPTIONAL_SENSOR_FIELDS = {'ec': 0, 'N': 0, 'P': 0, 'K': 0, 'moisture': 40}
+
+def device_authorized(device_id, api_key):
+    """Check the API key sent by a device against its (cached) devices_col record"""
+    return device_cache.check_api_key(device_id, api_key)
+
+def build_sensor_doc(device_id, data, timestamp=None):
+    """
+    Validate and coerce one reading into a sensor_data document.
+    Returns None if a required field is missing; raises ValueError for non-numeric values.
+    """
+    if not all(field in data for field in REQUIRED_SENSOR_FIELDS):
+        return None
+    sensor_doc = {'device_id': device_id}
+    for field in REQUIRED_SENSOR_FIELDS:
+        sensor_doc[field] = float(data[field])
+    for field, default in OPTIONAL_SENSOR_FIELDS.items():
+        sensor_doc[field] = float(data.get(field, default))
+    sensor_doc['timestamp'] = timestamp or datetime.now()
+    return sensor_doc
+
+def detect_anomalies(device_id, readings):
+    """
+    Pass (sensor_doc, fields the device sent) pairs, oldest first, through the
+    anomaly detector. Never fails the ingestion request.
+    """
+    if not ANOMALY_DETECTION:
+        return
+    try:
+        crop_ranges = models['crop_ranges']
+        bounds = crop_ranges.get(device_cache.target_crop(device_id)) if crop_ranges is not None else {}
+        for sensor_doc, fields in readings:
+            anomaly_detector.observe(device_id, sensor_doc, fields, bounds)
+    except Exception as e:
+        log.exception("Error in anomaly detection", device_id=device_id, error=str(e))
 
 @app.route('/api/esp32', methods=['POST'])
 def receive_esp32_data():
@@ -87,70 +306,195 @@ def receive_esp32_data():
         if not device_id:
             return jsonify({"error": "Missing device_id"}), 400
         # Validate API key for this device_id
-        device = devices_col.find_one({"device_id": device_id})
-        if not device or device.get("api_key") != api_key:
+        if not device_authorized(device_id, api_key):
             return jsonify({"error": "Unauthorized: Invalid API key for device_id"}), 401
-        # Validate required fields
-        required_fields = ['temperature', 'ph', 'humidity']
-        if not all(field in data for field in required_fields):
+        # Validate required fields and prepare sensor data document
+        sensor_doc = build_sensor_doc(device_id, data)
+        if sensor_doc is None:
             return jsonify({"error": "Missing required sensor fields"}), 400
-        # Prepare sensor data document
-        sensor_doc = {
-            'device_id': device_id,
-            'temperature': float(data['temperature']),
-            'ph': float(data['ph']),
-            'humidity': float(data['humidity']),
-            'ec': float(data.get('ec', 0)),
-            'N': float(data.get('N', 0)),
-            'P': float(data.get('P', 0)),
-            'K': float(data.get('K', 0)),
-            'moisture': float(data.get('moisture', 40)),
-            'timestamp': datetime.now()
-        }
-        result = sensor_data_col.insert_one(sensor_doc)
-        print(f"Inserted sensor_doc: {sensor_doc}")
-        inserted_doc = sensor_data_col.find_one({'_id': result.inserted_id})
-        print(f"Fetched inserted_doc: {inserted_doc}")
-        if inserted_doc and '_id' in inserted_doc:
-            del inserted_doc['_id']
-        if inserted_doc and 'device_id' in inserted_doc:
-            del inserted_doc['device_id']
-        # Also update in-memory latest for compatibility
-        sensor_data[device_id] = {k: v for k, v in sensor_doc.items() if k != 'device_id'}
-        response_data = {k: v for k, v in sensor_data[device_id].items() if k != 'timestamp'}
+        # Copy before writing: the insert adds '_id' to sensor_doc (from the writer thread when queued)
+        latest = {k: v for k, v in sensor_doc.items() if k != 'device_id'}
+        if ESP32_INGEST_MODE == "queued":
+            try:
+                sensor_writer.submit(sensor_doc)
+            except IngestQueueFull:
+                return jsonify({"error": "Server busy, retry later"}), 503, {"Retry-After": "1"}
+        else:
+            sensor_store.insert_one(sensor_doc)
+        history_totals.bump(device_id)
+        rollups.record([dict(latest, device_id=device_id)])
+        detect_anomalies(device_id, [(latest, [field for field in SENSOR_FIELDS if field in data])])
+        # Write through to the shared latest-reading store and push to open streams
+        if latest_readings.update(device_id, latest):
+            sensor_hub.publish(device_id, latest)
+        else:
+            note_late_write(device_id)
+        # Respond with the document as written, no read-back from Mongo
         return jsonify({
             "status": "success",
             "message": "Sensor data received",
-            "data": inserted_doc or response_data
+            "data": latest
         })
     except Exception as e:
-        print(f"Error in /api/esp32: {e}")
+        log.exception("Error in /api/esp32", error=str(e))
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/esp32/batch', methods=['POST'])
+def receive_esp32_batch():
+    """
+    Endpoint for devices replaying buffered readings: many readings, one API key check.
+    Body is JSON {"device_id", "readings": [...]} or {"device_id", "columns": {...}},
+    or CSV (Content-Type: text/csv) with the device_id in the x-device-id header.
+    Each reading may carry its own device "timestamp".
+    """
+    try:
+        api_key = request.headers.get('x-api-key')
+        if request.mimetype == 'text/csv':
+            device_id = request.headers.get('x-device-id') or request.args.get('device_id')
+            payload = None
+            csv_text = request.get_data(as_text=True)
+        else:
+            payload = request.get_json()
+            if not isinstance(payload, dict):
+                return jsonify({"error": "Expected a JSON object"}), 400
+            device_id = payload.get('device_id')
+            csv_text = None
+        if not device_id:
+            return jsonify({"error": "Missing device_id"}), 400
+        if not device_authorized(device_id, api_key):
+            return jsonify({"error": "Unauthorized: Invalid API key for device_id"}), 401
+        try:
+            readings = decode_readings(payload, csv_text)
+        except (ValueError, TypeError, KeyError) as e:
+            return jsonify({"error": f"Invalid readings: {e}"}), 400
+        if len(readings) > MAX_BATCH_READINGS:
+            return jsonify({"error": f"Too many readings (max {MAX_BATCH_READINGS})"}), 400
+
+        docs = []
+        sent_fields = []
+        rejected = []
+        for i, reading in enumerate(readings):
+            try:
+                if not isinstance(reading, dict):
+                    raise ValueError("Reading must be an object")
+                sensor_doc = build_sensor_doc(device_id, reading, parse_device_timestamp(reading.get('timestamp')))
+                if sensor_doc is None:
+                    raise ValueError("Missing required sensor fields")
+                docs.append(sensor_doc)
+                sent_fields.append([field for field in SENSOR_FIELDS if field in reading])
+            except (ValueError, TypeError, OverflowError, OSError) as e:
+                rejected.append({"index": i, "error": str(e)})
+
+        if docs:
+            newest = max(docs, key=lambda doc: doc['timestamp'])
+            latest = {k: v for k, v in newest.items() if k != 'device_id'}
+            # One unordered write for the whole batch
+            sensor_store.insert_many(docs, ordered=False)
+            history_totals.bump(device_id, len(docs))
+            rollups.record(docs)
+            # Replayed readings can arrive in any order; the detector wants them oldest first
+            detect_anomalies(device_id, sorted(zip(docs, sent_fields), key=lambda pair: pair[0]['timestamp']))
+            # Only replaces the stored reading (and streams it) if this one is newer
+            if latest_readings.update(device_id, latest):
+                sensor_hub.publish(device_id, latest)
+            else:
+                note_late_write(device_id)
+        return jsonify({
+            "status": "success",
+            "message": "Sensor data received",
+            "accepted": len(docs),
+            "rejected": rejected
+        })
+    except Exception as e:
+        log.exception("Error in /api/esp32/batch", error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+def latest_reading(device_id):
+    """Latest reading for a device from the shared store, falling back to Mongo on a miss"""
+    if not device_id:
+        return None
+    reading = latest_readings.get(device_id)
+    if reading is not None:
+        return reading
+    doc = sensor_store.latest(device_id)
+    if not doc:
+        return None
+    # Remove MongoDB _id and device_id, and remember it for the next request
+    doc.pop('_id', None)
+    doc.pop('device_id', None)
+    if isinstance(doc.get('timestamp'), datetime):
+        latest_readings.update(device_id, doc)
+    return doc
+
 @app.route('/api/sensor/latest', methods=['GET'])
 def get_latest_sensor_data():
-    """Endpoint to fetch latest sensor data for the logged-in user's device_id from DB"""
+    """Endpoint to fetch latest sensor data for the logged-in user's device_id"""
     device_id = session.get('device_id')
     if not device_id:
         return jsonify({"error": "No sensor data available for your device"}), 404
-    doc = sensor_data_col.find_one({'device_id': device_id}, sort=[('timestamp', -1)])
+    doc = latest_reading(device_id)
     if not doc:
         return jsonify({"error": "No sensor data available for your device"}), 404
-    # Remove MongoDB _id and device_id from response
-    doc.pop('_id', None)
-    doc.pop('device_id', None)
-    return jsonify({
+    # The reading itself is the validator: unchanged timestamp, unchanged body
+    etag = make_etag(device_id, doc['timestamp']) if HTTP_ETAGS and doc.get('timestamp') else None
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    return set_validator(jsonify({
         "data": {k: v for k, v in doc.items() if k != 'timestamp'},
         "timestamp": doc.get('timestamp', datetime.now().isoformat()),
         "source": "esp32"
+    }), etag)
+
+def sensor_backlog(device_id, since, limit):
+    """Readings for a stream (re)connect: the latest one, or those after since, oldest first"""
+    if since is None:
+        reading = latest_reading(device_id)
+        return [reading] if reading and isinstance(reading.get('timestamp'), datetime) else []
+    projection = {field: 1 for field in HISTORY_FIELDS}
+    projection['_id'] = 0
+    return list(sensor_store.readings(device_id, {'$gt': since}, projection, limit=limit))
+
+# One subscription per device for /api/sensor/stream, fed by ingestion in this
+# process and by polling the shared latest-reading store for the other workers
+sensor_hub = SensorHub(latest_readings.get, sensor_backlog)
+
+@app.route('/api/sensor/stream', methods=['GET'])
+def stream_sensor_data():
+    """
+    Server-Sent Events feed of new readings for the logged-in user's device_id.
+    Each "reading" event has the /api/sensor/latest body as data and the reading's
+    epoch-millisecond timestamp as id; browsers send it back as Last-Event-ID on reconnect.
+    """
+    device_id = session.get('device_id')
+    if not device_id:
+        return jsonify({"error": "No sensor data available for your device"}), 404
+    last_event_id = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    try:
+        sub, initial = sensor_hub.subscribe(device_id, last_event_id)
+    except TooManyClients:
+        return jsonify({"error": "Too many open streams, retry later"}), 503, {"Retry-After": "5"}
+    return Response(sensor_hub.stream(sub, initial), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop nginx-style proxies from buffering the stream
+        'X-Accel-Buffering': 'no',
     })
 
 @app.route('/api/sensor/history', methods=['GET'])
 def get_sensor_history():
-    """Endpoint to fetch paginated sensor data for the logged-in user's device_id from DB"""
+    """
+    Endpoint to fetch paginated sensor data for the logged-in user's device_id from DB, newest first.
+    Pass a response's "next"/"prev" token back as ?cursor= for keyset paging; ?page= still
+    works for the history page. ?fields= limits the columns, ?total=exact|cached|none.
+    """
     device_id = session.get('device_id')
     if not device_id:
         return jsonify({"error": "No sensor data available for your device"}), 404
+    # Same newest reading and same query (cursor position included): same page
+    etag = history_etag(device_id, request.query_string)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
     try:
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 10))
@@ -159,171 +503,365 @@ def get_sensor_history():
     except Exception:
         page = 1
         per_page = 10
-    skip = (page - 1) * per_page
-    total = sensor_data_col.count_documents({'device_id': device_id})
-    cursor = sensor_data_col.find({'device_id': device_id}, sort=[('timestamp', -1)]).skip(skip).limit(per_page)
+    per_page = min(per_page, MAX_HISTORY_PAGE_SIZE)
+    projection = history_projection(request.args.get('fields'))
+
+    cursor_token = request.args.get('cursor')
+    if cursor_token:
+        try:
+            timestamp, doc_id, direction = decode_cursor(cursor_token)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        # One extra row tells us whether there is another page in this direction
+        docs = sensor_store.page(device_id, projection, per_page + 1, position=(timestamp, doc_id, direction))
+        more = len(docs) > per_page
+        docs = docs[:per_page]
+        if direction == "prev":
+            docs.reverse()
+        has_older = more if direction == "next" else True
+        has_newer = more if direction == "prev" else True
+        page = None
+    else:
+        skip = (page - 1) * per_page
+        docs = sensor_store.page(device_id, projection, per_page + 1, skip=skip)
+        has_older = len(docs) > per_page
+        docs = docs[:per_page]
+        has_newer = page > 1
+
+    total_mode = request.args.get('total', 'cached')
+    if total_mode == 'none':
+        total = None
+    elif total_mode == 'exact':
+        total = sensor_store.count(device_id)
+    else:
+        total = history_totals.get(device_id)
+
+    next_token = encode_cursor(docs[-1], "next") if docs and has_older else None
+    prev_token = encode_cursor(docs[0], "prev") if docs and has_newer else None
     history = []
-    for doc in cursor:
+    for doc in docs:
         doc.pop('_id', None)
         doc.pop('device_id', None)
         history.append(doc)
-    return jsonify({
+    return set_validator(jsonify({
         "history": history,
         "total": total,
         "page": page,
-        "per_page": per_page
+        "per_page": per_page,
+        "next": next_token,
+        "prev": prev_token
+    }), etag)
+
+@app.route('/api/sensor/export', methods=['GET'])
+def export_sensor_history():
+    """
+    Endpoint to download the logged-in user's full sensor history, oldest first.
+    ?format=csv|ndjson, optional ?start=/?end= and ?fields=, ?gzip=1 to compress.
+    Streams from a server-side cursor; nothing is collected into a list.
+    """
+    device_id = session.get('device_id')
+    if not device_id:
+        return jsonify({"error": "No sensor data available for your device"}), 404
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    try:
+        time_range = {}
+        if request.args.get('start'):
+            time_range['$gte'] = parse_device_timestamp(request.args['start'])
+        if request.args.get('end'):
+            time_range['$lt'] = parse_device_timestamp(request.args['end'])
+    except (ValueError, OverflowError, OSError):
+        return jsonify({"error": "Invalid start or end"}), 400
+    projection = history_projection(request.args.get('fields'))
+    projection['_id'] = 0
+    fields = [field for field in HISTORY_FIELDS if field in projection]
+    gzip = request.args.get('gzip') in ('1', 'true')
+
+    readings = sensor_store.readings(device_id, time_range, projection, batch_size=EXPORT_BATCH_SIZE)
+    filename = f"sensor-history-{device_id}.{fmt}" + (".gz" if gzip else "")
+    return Response(
+        export_stream(readings, fmt, fields, gzip=gzip),
+        mimetype="application/gzip" if gzip else EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.route('/api/sensor/aggregate', methods=['GET'])
+def get_sensor_aggregate():
+    """
+    Endpoint to fetch min/mean/max per time bucket for the logged-in user's device_id.
+    ?bucket=minute|hour|day, ?start=/?end= (ISO 8601 or epoch seconds), ?fields=,
+    ?max_points= to downsample with LTTB on ?downsample_field= (default: first field).
+    ?source=rollups reads hour/day buckets from the precomputed rollups (adds std).
+    """
+    device_id = session.get('device_id')
+    if not device_id:
+        return jsonify({"error": "No sensor data available for your device"}), 404
+    bucket = request.args.get('bucket', 'hour')
+    if bucket not in BUCKET_SECONDS:
+        return jsonify({"error": "bucket must be one of minute, hour, day"}), 400
+    fields = SENSOR_FIELDS
+    if request.args.get('fields'):
+        requested = [f.strip() for f in request.args['fields'].split(',')]
+        fields = [f for f in SENSOR_FIELDS if f in requested]
+        if not fields:
+            return jsonify({"error": "No valid fields requested"}), 400
+    try:
+        end = parse_device_timestamp(request.args.get('end'))
+        start = parse_device_timestamp(request.args['start']) if request.args.get('start') else end - DEFAULT_SPANS[bucket]
+        max_points = int(request.args.get('max_points', 0))
+    except (ValueError, OverflowError, OSError):
+        return jsonify({"error": "Invalid start, end or max_points"}), 400
+    if max_points and max_points < 3:
+        # LTTB keeps the first and last points plus one per bucket in between
+        return jsonify({"error": "max_points must be at least 3 (or 0 for every bucket)"}), 400
+    if start >= end:
+        return jsonify({"error": "start must be before end"}), 400
+    if (end - start).total_seconds() / BUCKET_SECONDS[bucket] > MAX_AGGREGATE_BUCKETS:
+        return jsonify({"error": f"Range too large for {bucket} buckets (max {MAX_AGGREGATE_BUCKETS})"}), 400
+    downsample_field = request.args.get('downsample_field', fields[0])
+    if downsample_field not in fields:
+        downsample_field = fields[0]
+
+    if request.args.get('source') == 'rollups' and bucket in ROLLUP_RESOLUTIONS:
+        rows, source = rollups.buckets(device_id, start, end, bucket, fields), "rollups"
+    else:
+        rows, source = sensor_store.aggregate(device_id, start, end, bucket, fields)
+    buckets = len(rows)
+    rows = downsample(rows, max_points, downsample_field)
+    return jsonify(dict(to_columns(rows, fields),
+                        bucket=bucket,
+                        start=start.isoformat(),
+                        end=end.isoformat(),
+                        buckets=buckets,
+                        points=len(rows),
+                        source=source))
+
+@app.route('/api/alerts', methods=['GET'])
+def get_alerts():
+    """
+    Alerts raised for the logged-in user's device_id, newest first.
+    ?since= (ISO 8601 or epoch seconds), ?kind=zscore|stuck|range, ?field=, ?limit=
+    """
+    device_id = session.get('device_id')
+    if not device_id:
+        return jsonify({"error": "No sensor data available for your device"}), 404
+    kind = request.args.get('kind')
+    if kind and kind not in ALERT_KINDS:
+        return jsonify({"error": "kind must be one of " + ", ".join(ALERT_KINDS)}), 400
+    field = request.args.get('field')
+    if field and field not in SENSOR_FIELDS:
+        return jsonify({"error": "Unknown field"}), 400
+    try:
+        since = parse_device_timestamp(request.args['since']) if request.args.get('since') else None
+        limit = min(max(int(request.args.get('limit', 100)), 1), MAX_ALERTS_PAGE)
+    except (ValueError, OverflowError, OSError):
+        return jsonify({"error": "Invalid since or limit"}), 400
+    alerts = find_alerts(alerts_col, device_id, since, kind, field, limit)
+    return jsonify({"alerts": alerts, "count": len(alerts)})
+
+@app.route('/api/alerts/settings', methods=['GET', 'POST'])
+def alert_settings():
+    """Get or set the target crop whose ranges the device's readings are checked against"""
+    device_id = session.get('device_id')
+    if not device_id:
+        return jsonify({"error": "Not logged in"}), 401
+    crop_ranges = models['crop_ranges']
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        crop = data.get('target_crop') or None
+        if crop is not None and (crop_ranges is None or crop not in crop_ranges):
+            return jsonify({"error": "Unknown crop"}), 400
+        devices_col.update_one({"device_id": device_id}, {"$set": {"target_crop": crop}})
+        device_cache.invalidate(device_id)
+    crop = device_cache.target_crop(device_id)
+    return jsonify({
+        "target_crop": crop,
+        "ranges": crop_ranges.get(crop) if crop_ranges is not None else {},
+        "crops": crop_ranges.labels if crop_ranges is not None else []
     })
 
+# Row labels of the suitability table, in CROP_FEATURES order
+SUITABILITY_PARAMETERS = ["Nitrogen (N)", "Phosphorus (P)", "Potassium (K)", "Temperature", "Humidity", "pH", "Rainfall"]
+
+SUITABILITY_ADVICE_LOW = {
+    "Nitrogen (N)": "Apply nitrogen-rich fertilizers like urea or ammonium sulfate",
+    "Phosphorus (P)": "Use phosphorus fertilizers such as bone meal or superphosphate",
+    "Potassium (K)": "Add potassium-based fertilizers like potash or wood ash",
+    "Temperature": "Use greenhouse techniques or choose planting times strategically",
+    "Humidity": "Implement irrigation systems or use mulching techniques",
+    "pH": "Add lime to increase pH or sulfur to decrease pH",
+    "Rainfall": "Use drip irrigation or rainwater harvesting techniques"
+}
+
+SUITABILITY_ADVICE_HIGH = {
+    "Nitrogen (N)": "Consider soil amendments or drainage improvements.",
+    "Phosphorus (P)": "Consider soil amendments or drainage improvements.",
+    "Potassium (K)": "Consider soil amendments or drainage improvements.",
+    "Temperature": "Use greenhouse techniques or choose planting times strategically",
+    "Humidity": "Consider improving ventilation or using humidifiers/dehumidifiers",
+    "pH": "Add lime to increase pH or sulfur to decrease pH",
+    "Rainfall": "Improve drainage or implement water conservation measures"
+}
+
 def calculate_suitability(user_input, crop_name):
     """
     Calculate crop suitability and provide soil adjustment recommendations.
     """
-    # Find the specific crop's ideal parameters
-    crop_info = models['crop_data'][models['crop_data']["label"] == crop_name]
+    return calculate_suitability_batch([user_input], [crop_name])[0]
 
-    if crop_info.empty:
-        return None, "Crop not found in dataset.", None
+def calculate_suitability_batch(user_inputs, crop_names):
+    """
+    calculate_suitability() for a list of inputs and crop names, with the scores
+    and the low/high checks computed for all of them in one NumPy pass.
+    Returns one (score, adjustments, table_data) per input, in order.
+    """
+    results = [(None, "Crop not found in dataset.", None)] * len(crop_names)
+    # Look up each crop's ideal parameters in the precomputed index
+    profiles = models['crop_profiles']
+    rows = [profiles.row_of.get(crop_name) if isinstance(crop_name, str) else None for crop_name in crop_names]
+    known = [i for i, row in enumerate(rows) if row is not None]
+    if not known:
+        return results
 
-    # Extract ideal values
-    ideal_values = crop_info.iloc[0][["N", "P", "K", "temperature", "humidity", "ph", "rainfall"]].values.astype(float)
-    
-    # Calculate percentage suitability
-    user_values = np.array(user_input).astype(float)
+    # Calculate percentage suitability (20% deviation tolerance)
+    user_values = np.array([user_inputs[i] for i in known]).astype(float)
+    ideal_values = profiles.ideal_values[[rows[i] for i in known]]
     deviation = np.abs(user_values - ideal_values)
-    max_deviation = ideal_values * 0.2  # 20% deviation tolerance
-    suitability_score = (max(0, abs(100 - (np.sum(deviation / max_deviation) * 100 / len(ideal_values)))) ) % 100
-    
+    max_deviation = ideal_values * 0.2
+    raw = np.abs(100 - (np.sum(deviation / max_deviation, axis=1) * 100 / ideal_values.shape[1]))
+    # np.where rather than np.maximum so NaN falls back to 0 like max(0, nan)
+    scores = np.round(np.where(raw > 0, raw, 0.0) % 100, 2).tolist()
+    too_low = (user_values < ideal_values * 0.8).tolist()
+    too_high = (user_values > ideal_values * 1.2).tolist()
+    shortages = np.round(ideal_values - user_values, 2).tolist()
+    excesses = np.round(user_values - ideal_values, 2).tolist()
+    recommended = np.round(ideal_values, 2).tolist()
+    observed = np.round(user_values, 2).tolist()
+    user_values, ideal_values = user_values.tolist(), ideal_values.tolist()
+
     # Generate detailed recommendations as structured data for table
-    adjustments = []
-    param_names = ["Nitrogen (N)", "Phosphorus (P)", "Potassium (K)", "Temperature", "Humidity", "pH", "Rainfall"]
-    
-    fertilizer_recommendations = {
-        "Nitrogen (N)": "Apply nitrogen-rich fertilizers like urea or ammonium sulfate",
-        "Phosphorus (P)": "Use phosphorus fertilizers such as bone meal or superphosphate",
-        "Potassium (K)": "Add potassium-based fertilizers like potash or wood ash",
-        "Temperature": "Use greenhouse techniques or choose planting times strategically",
-        "Humidity": "Implement irrigation systems or use mulching techniques",
-        "pH": "Add lime to increase pH or sulfur to decrease pH",
-        "Rainfall": "Use drip irrigation or rainwater harvesting techniques"
+    for n, i in enumerate(known):
+        adjustments = []
+        table_data = []
+        for j, param in enumerate(SUITABILITY_PARAMETERS):
+            param_entry = {
+                "parameter": param,
+                "recommended": recommended[n][j],
+                "observed": observed[n][j],
+                "remarks": "Optimal"
+            }
+            current, ideal = user_values[n][j], ideal_values[n][j]
+            if too_low[n][j]:
+                shortage = shortages[n][j]
+                param_entry["remarks"] = f"Too low. Increase by {shortage}. {SUITABILITY_ADVICE_LOW[param]}."
+                adjustments.append(f"{param} is too low (Current: {current}, Ideal: {ideal}). Increase by {shortage}.")
+            elif too_high[n][j]:
+                excess = excesses[n][j]
+                if param in ["Humidity", "Rainfall"]:
+                    param_entry["remarks"] = "Too high."
+                    adjustments.append(f"{param} is too high (Current: {current}, Ideal: {ideal}).")
+                else:
+                    param_entry["remarks"] = f"Too high. Decrease by {excess}. {SUITABILITY_ADVICE_HIGH[param]}"
+                    adjustments.append(f"{param} is too high (Current: {current}, Ideal: {ideal}). Decrease by {excess}.")
+            table_data.append(param_entry)
+        results[i] = (scores[n], adjustments, table_data)
+    return results
+
+def fertilizer_input(soil_data, crop_name):
+    """Map soil data and crop name onto the fertilizer model's input columns"""
+    return {
+        'Temperature': soil_data.get('temperature', 25),
+        'Humidity': soil_data.get('humidity', 50),
+        'Moisture': soil_data.get('moisture', 40),
+        'Soil': soil_data.get('soil', 'Black'),  # Default to Black if not specified
+        'Crop': crop_name or 'Wheat',  # Default to Wheat if not specified
+        'Nitrogen': soil_data.get('N', 0),
+        'Potassium': soil_data.get('K', 0),
+        'Phosphorus': soil_data.get('P', 0)
     }
-    
-    fertilizer_recommendations_2 = {
-        "Nitrogen (N)": "Consider soil amendments or drainage improvements.",
-        "Phosphorus (P)": "Consider soil amendments or drainage improvements.",
-        "Potassium (K)": "Consider soil amendments or drainage improvements.",
-        "Temperature": "Use greenhouse techniques or choose planting times strategically",
-        "Humidity": "Consider improving ventilation or using humidifiers/dehumidifiers",
-        "pH": "Add lime to increase pH or sulfur to decrease pH",
-        "Rainfall": "Improve drainage or implement water conservation measures"
+
+def build_fertilizer_recommendation(fertilizer_name, soil_data, crop_name):
+    """Turn a predicted fertilizer into the recommendation returned to the client"""
+    # Get composition from fertilizer details
+    composition = models['fertilizer_compositions'].get(fertilizer_name, "Varies")
+
+    # Generate application advice
+    application_advice = generate_application_advice(fertilizer_name, crop_name)
+
+    # Calculate soil nutrient deficiencies
+    deficiencies = {
+        "N": max(0, 50 - soil_data.get('N', 0)),  # Assuming 50 is a good threshold
+        "P": max(0, 40 - soil_data.get('P', 0)),  # Assuming 40 is a good threshold
+        "K": max(0, 40 - soil_data.get('K', 0))   # Assuming 40 is a good threshold
     }
-    
-    table_data = []
-    
-    for i in range(len(user_values)):
-        param_entry = {
-            "parameter": param_names[i],
-            "recommended": round(ideal_values[i], 2),
-            "observed": round(user_values[i], 2),
-            "remarks": "Optimal"
-        }
-        
-        if user_values[i] < ideal_values[i] * 0.8:
-            shortage = round(ideal_values[i] - user_values[i], 2)
-            param_entry["remarks"] = f"Too low. Increase by {shortage}. {fertilizer_recommendations[param_names[i]]}."
-            adjustments.append(f"{param_names[i]} is too low (Current: {user_values[i]}, Ideal: {ideal_values[i]}). Increase by {shortage}.")
-        elif user_values[i] > ideal_values[i] * 1.2:
-            excess = round(user_values[i] - ideal_values[i], 2)
-            
-            if param_names[i] in ["Humidity", "Rainfall"]:
-                param_entry["remarks"] = "Too high."
-                adjustments.append(f"{param_names[i]} is too high (Current: {user_values[i]}, Ideal: {ideal_values[i]}).")
-            else:
-                param_entry["remarks"] = f"Too high. Decrease by {excess}. {fertilizer_recommendations_2[param_names[i]]}"
-                adjustments.append(f"{param_names[i]} is too high (Current: {user_values[i]}, Ideal: {ideal_values[i]}). Decrease by {excess}.")
-        
-        table_data.append(param_entry)
 
-    return round(suitability_score, 2), adjustments, table_data
+    # Create recommendation result
+    recommendation = {
+        "fertilizer": fertilizer_name,
+        "composition": composition,
+        "deficiencies": deficiencies,
+        "rationale": "Recommended based on soil and crop requirements",
+        "application": application_advice
+    }
 
-def predict_fertilizer(soil_data, crop_name):
+    # Add specific advice for deficient nutrients
+    fertilizer_options = {
+        "N": ["Urea", "Ammonium Sulfate", "Calcium Nitrate"],
+        "P": ["DAP", "Single Super Phosphate", "Rock Phosphate"],
+        "K": ["Muriate of Potash", "Sulfate of Potash", "Potassium Nitrate"]
+    }
+
+    if deficiencies["N"] > 0:
+        recommendation["nitrogen_advice"] = f"Add {deficiencies['N']} kg/ha of nitrogen using {fertilizer_options['N'][0]} or similar"
+    if deficiencies["P"] > 0:
+        recommendation["phosphorus_advice"] = f"Add {deficiencies['P']} kg/ha of phosphorus using {fertilizer_options['P'][0]} or similar"
+    if deficiencies["K"] > 0:
+        recommendation["potassium_advice"] = f"Add {deficiencies['K']} kg/ha of potassium using {fertilizer_options['K'][0]} or similar"
+
+    return recommendation
+
+# soil_data fields the fertilizer model and recommendation actually use
+FERTILIZER_SOIL_FIELDS = ['N', 'P', 'K', 'temperature', 'humidity', 'moisture']
+
+def predict_fertilizer_batch(batch):
     """
-    Use the trained model to predict fertilizer based on soil and crop parameters.
+    Predict fertilizers for a list of (soil_data, crop_name) pairs with one model call
+    for all cache misses. Returns one recommendation (or error dict) per pair, in order.
     """
     if models['fertilizer_model'] is None or models['label_encoders'] is None:
-        return {"error": "Fertilizer recommendation model not available."}
-    
+        return [{"error": "Fertilizer recommendation model not available."} for _ in batch]
+
+    keys = [("fertilizer", models['version'], crop_name, soil_data.get('soil')) +
+            prediction_cache.key_values([soil_data.get(field) for field in FERTILIZER_SOIL_FIELDS],
+                                        FERTILIZER_SOIL_FIELDS)
+            for soil_data, crop_name in batch]
+    return prediction_cache.get_many(keys, lambda missing: recommend_fertilizers([batch[i] for i in missing]))
+
+def recommend_fertilizers(batch):
+    """Uncached predict_fertilizer_batch()"""
     try:
-        # Prepare input data for the model
-        input_data = {
-            'Temperature': soil_data.get('temperature', 25),
-            'Humidity': soil_data.get('humidity', 50),
-            'Moisture': soil_data.get('moisture', 40),
-            'Soil': soil_data.get('soil', 'Black'),  # Default to Black if not specified
-            'Crop': crop_name or 'Wheat',  # Default to Wheat if not specified
-            'Nitrogen': soil_data.get('N', 0),
-            'Potassium': soil_data.get('K', 0),
-            'Phosphorus': soil_data.get('P', 0)
-        }
-        
-        # Convert to DataFrame for easier processing
-        input_df = pd.DataFrame([input_data])
-        
-        # Apply label encoding to categorical features
-        for col, encoder in models['label_encoders'].items():
-            if col in input_df.columns:
-                # Handle potential unknown categories
-                try:
-                    input_df[col] = encoder.transform(input_df[col])
-                except ValueError:
-                    # If category is unknown, use the first category as default
-                    print(f"Warning: Unknown category in {col}, using default")
-                    input_df[col] = 0
-        
+        # Encode the whole batch straight into the model's feature array
+        # (unknown categories fall back to the first class and are counted)
+        features = models['fertilizer_encoder'].encode(
+            [fertilizer_input(soil_data, crop_name) for soil_data, crop_name in batch])
+
         # Make prediction
-        fertilizer_name = models['fertilizer_model'].predict(input_df)[0]
-        
-        # Get composition from fertilizer details
-        composition = next((item['composition'] for item in models['fertilizer_details'] 
-                           if item['name'] == fertilizer_name), "Varies")
-        
-        # Generate application advice
-        application_advice = generate_application_advice(fertilizer_name, crop_name)
-        
-        # Calculate soil nutrient deficiencies
-        deficiencies = {
-            "N": max(0, 50 - soil_data.get('N', 0)),  # Assuming 50 is a good threshold
-            "P": max(0, 40 - soil_data.get('P', 0)),  # Assuming 40 is a good threshold
-            "K": max(0, 40 - soil_data.get('K', 0))   # Assuming 40 is a good threshold
-        }
-        
-        # Create recommendation result
-        recommendation = {
-            "fertilizer": fertilizer_name,
-            "composition": composition,
-            "deficiencies": deficiencies,
-            "rationale": "Recommended based on soil and crop requirements",
-            "application": application_advice
-        }
-        
-        # Add specific advice for deficient nutrients
-        fertilizer_options = {
-            "N": ["Urea", "Ammonium Sulfate", "Calcium Nitrate"],
-            "P": ["DAP", "Single Super Phosphate", "Rock Phosphate"],
-            "K": ["Muriate of Potash", "Sulfate of Potash", "Potassium Nitrate"]
-        }
-        
-        if deficiencies["N"] > 0:
-            recommendation["nitrogen_advice"] = f"Add {deficiencies['N']} kg/ha of nitrogen using {fertilizer_options['N'][0]} or similar"
-        if deficiencies["P"] > 0:
-            recommendation["phosphorus_advice"] = f"Add {deficiencies['P']} kg/ha of phosphorus using {fertilizer_options['P'][0]} or similar"
-        if deficiencies["K"] > 0:
-            recommendation["potassium_advice"] = f"Add {deficiencies['K']} kg/ha of potassium using {fertilizer_options['K'][0]} or similar"
-        
-        return recommendation
-        
+        with time_block(INFERENCE_SECONDS, model="fertilizer"):
+            fertilizer_names = models['fertilizer_predictor'].predict(features)
+
+        return [build_fertilizer_recommendation(fertilizer_name, soil_data, crop_name)
+                for fertilizer_name, (soil_data, crop_name) in zip(fertilizer_names, batch)]
+
     except Exception as e:
-        print(f"Error in model prediction: {e}")
-        return {"error": f"Error in fertilizer recommendation: {str(e)}"}
+        log.exception("Error in fertilizer prediction", error=str(e))
+        return [{"error": f"Error in fertilizer recommendation: {str(e)}"} for _ in batch]
+
+def predict_fertilizer(soil_data, crop_name):
+    """
+    Use the trained model to predict fertilizer based on soil and crop parameters.
+    """
+    return predict_fertilizer_batch([(soil_data, crop_name)])[0]
 
 def generate_application_advice(fertilizer, crop_name=None):
     """Generate specific application advice based on fertilizer type and crop"""
@@ -377,7 +915,7 @@ def login():
             else:
                 error = "Invalid username, password, or device ID. Please try again."
         except Exception as e:
-            print("Login error:", e)
+            log.exception("Login error", error=str(e))
             error = "An internal error occurred. Please try again later."
     return render_template("login.html", error=error)
 
@@ -401,7 +939,7 @@ def register():
                 else:
                     error = f"Registration failed: {err}"
         except Exception as e:
-            print("Registration error:", e)
+            log.exception("Registration error", error=str(e))
             error = "An internal error occurred. Please try again later."
     return render_template("register.html", error=error)
 
@@ -411,114 +949,296 @@ def dashboard():
     if not device_id:
         return redirect(url_for("login"))
     # Only pass this user's device's data
-    user_sensor_data = sensor_data.get(device_id, {})
+    user_sensor_data = latest_reading(device_id) or {}
     return render_template("index.html", device_id=device_id, sensor_data=user_sensor_data)
 
 @app.route("/software")
 def software_only():
     return render_template("index.html")
 
+# Upper bound on the number of inputs accepted by /predict/batch
+MAX_BATCH_PREDICT_ITEMS = int(os.environ.get("MAX_BATCH_PREDICT_ITEMS", 5000))
+
+def parse_parameters(data, sensor_data=None):
+    """
+    Build the 7-parameter model input and EC value from a /predict request body.
+    sensor_data is the device's latest reading, used when use_sensor_data is set.
+    """
+    sensor_data = sensor_data or {}
+    if data.get("use_sensor_data", False):
+        # Try to fetch fresh data from ThingSpeak
+        # if not sensor_data or (datetime.now() - datetime.fromisoformat(sensor_data.get('timestamp', '2000-01-01'))).total_seconds() > 300:
+        #     fetch_thingspeak_data() # This line is removed
+        parameters = [
+            sensor_data.get("N", 0),
+            sensor_data.get("P", 0),
+            sensor_data.get("K", 0),
+            sensor_data.get("temperature", 25),
+            data.get("humidity", sensor_data.get("humidity", 50)),
+            sensor_data.get("ph", 7),
+            float(data.get("rainfall", 100))
+        ]
+        ec_value = sensor_data.get("ec", 0)
+    else:
+        parameters = [
+            float(data.get("N", 0)),
+            float(data.get("P", 0)),
+            float(data.get("K", 0)),
+            float(data.get("temperature", 25)),
+            float(data.get("humidity", 50)),
+            float(data.get("ph", 7)),
+            float(data.get("rainfall", 100))
+        ]
+        ec_value = float(data.get("ec", 0))
+    return parameters, ec_value
+
+def build_soil_data(data, parameters, ec_value, sensor_data=None):
+    """Soil data dict for predict_fertilizer() from a /predict request body"""
+    sensor_data = sensor_data or {}
+    use_sensor_data = data.get("use_sensor_data", False)
+    return {
+        "N": parameters[0],
+        "P": parameters[1],
+        "K": parameters[2],
+        "temperature": parameters[3],
+        "humidity": parameters[4],
+        "ph": parameters[5],
+        "moisture": sensor_data.get("moisture", 40) if use_sensor_data else float(data.get("moisture", 40)),
+        "ec": ec_value,
+        "soil": data.get("soil", "Black")
+    }
+
+def parse_top_k(data):
+    """Number of top predicted crops requested with a crop-mode input (0 = none); raises ValueError if invalid"""
+    top_k = data.get("top_k") or 0
+    try:
+        if isinstance(top_k, bool):
+            raise TypeError
+        return max(0, int(top_k))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("Invalid top_k (expected an integer)")
+
+# How crop mode picks its "crop": the suitability formula against each crop's
+# profile row, or the most similar crop-data.csv samples (CropNeighborIndex)
+CROP_ENGINES = ("suitability", "neighbors")
+
+def parse_engine(data):
+    """Crop-mode recommendation engine requested by an input; raises ValueError if unknown"""
+    engine = data.get("engine") or "suitability"
+    if engine not in CROP_ENGINES:
+        raise ValueError(f"Invalid engine (expected one of: {', '.join(CROP_ENGINES)})")
+    return engine
+
+def predict_crops(parameter_rows, top_k=0, engine="suitability"):
+    """
+    Crop-mode results for a list of 7-parameter inputs, one model call for all cache misses.
+    top_k and engine are one value or one value per input. Returns one result dict per input, in order.
+    """
+    top_ks = list(top_k) if isinstance(top_k, (list, tuple)) else [top_k] * len(parameter_rows)
+    engines = list(engine) if isinstance(engine, (list, tuple)) else [engine] * len(parameter_rows)
+    keys = [("crop", models['version'], k, e) + prediction_cache.key_values(row)
+            for row, k, e in zip(parameter_rows, top_ks, engines)]
+    return prediction_cache.get_many(
+        keys, lambda missing: score_crops([parameter_rows[i] for i in missing], [top_ks[i] for i in missing],
+                                          [engines[i] for i in missing]))
+
+def score_crops(parameter_rows, top_k=0, engines=None):
+    """Uncached predict_crops()"""
+    features = np.asarray(parameter_rows, dtype=float)
+    with time_block(INFERENCE_SECONDS, model="crop"):
+        predictions, confidences, top_crops = models['crop_inference'].predict(features, top_k)
+    # Score every crop for every input at once instead of calling calculate_suitability() per crop
+    profiles = models['crop_profiles']
+    with time_block(SUITABILITY_SECONDS, kind="all_crops"):
+        scores = profiles.score_matrix(features)
+    results = []
+    for i, prediction in enumerate(predictions):
+        best = int(np.argmax(scores[i]))
+        results.append({
+            "crop": profiles.labels[best],
+            "confidence": round(scores[i][best], 2),
+            "crop-predicted": prediction,
+            "confidence-predicted": round(confidences[i], 2)
+        })
+        if top_crops[i]:
+            results[-1]["top-crops"] = [{"crop": crop, "probability": probability}
+                                        for crop, probability in top_crops[i]]
+
+    # Inputs asking for the nearest-neighbor engine: one KD-tree query for all of them
+    neighbor_rows = [i for i, engine in enumerate(engines or []) if engine == "neighbors"]
+    if neighbor_rows:
+        top_ks = top_k if isinstance(top_k, (list, tuple)) else [top_k] * len(results)
+        wanted = [top_ks[i] or NEIGHBOR_TOP_K for i in neighbor_rows]
+        with time_block(INFERENCE_SECONDS, model="neighbors"):
+            similar = models['crop_neighbors'].nearest_crops(features[neighbor_rows], max(wanted))
+        for i, k, crops in zip(neighbor_rows, wanted, similar):
+            results[i]["engine"] = "neighbors"
+            results[i]["similar-crops"] = [{"crop": crop, "score": score, "distance": distance}
+                                           for crop, score, distance in crops[:k]]
+            if crops:
+                results[i]["crop"], results[i]["confidence"] = crops[0][0], crops[0][1]
+    return results
+
+def suitability_result(parameters, crop_name):
+    """Suitability-mode result for one input, or an error dict"""
+    return suitability_results([(parameters, crop_name)])[0]
+
+def suitability_results(pairs):
+    """
+    Suitability-mode results for a list of (parameters, crop_name) pairs, one
+    NumPy pass for all cache misses. Returns one result (or error dict) per pair, in order.
+    """
+    results = [{"error": "Crop name is required"}] * len(pairs)
+    named = [i for i, (_, crop_name) in enumerate(pairs) if crop_name]
+    if not named:
+        return results
+    keys = [("suitability", models['version'], pairs[i][1]) + prediction_cache.key_values(pairs[i][0])
+            for i in named]
+    scored = prediction_cache.get_many(keys, lambda missing: score_suitability([pairs[named[i]] for i in missing]))
+    for i, result in zip(named, scored):
+        results[i] = result
+    return results
+
+def score_suitability(pairs):
+    """Uncached suitability_results() for (parameters, crop_name) pairs with a crop name"""
+    with time_block(SUITABILITY_SECONDS, kind="one_crop"):
+        scored = calculate_suitability_batch([parameters for parameters, _ in pairs],
+                                             [crop_name for _, crop_name in pairs])
+    results = []
+    for (_, crop_name), (suitability, recommendations, table_data) in zip(pairs, scored):
+        if suitability is None:
+            results.append({"error": recommendations})
+            continue
+        results.append({
+            "crop": crop_name,
+            "suitability": suitability,
+            "recommendations": recommendations,
+            "table_data": table_data
+        })
+    return results
+
 @app.route("/predict", methods=["POST"])
 def predict():
     try:
         data = request.get_json()
-        print("/predict called with data:", data)
         mode = data.get("mode", "crop")
-        print("Mode:", mode)
         use_sensor_data = data.get("use_sensor_data", False)
-        print("use_sensor_data:", use_sensor_data)
-
-        if use_sensor_data:
-            # Try to fetch fresh data from ThingSpeak
-            # if not sensor_data or (datetime.now() - datetime.fromisoformat(sensor_data.get('timestamp', '2000-01-01'))).total_seconds() > 300:
-            #     fetch_thingspeak_data() # This line is removed
-            parameters = [
-                sensor_data.get("N", 0),
-                sensor_data.get("P", 0),
-                sensor_data.get("K", 0),
-                sensor_data.get("temperature", 25),
-                data.get("humidity", sensor_data.get("humidity", 50)),
-                sensor_data.get("ph", 7),
-                float(data.get("rainfall", 100))
-            ]
-            ec_value = sensor_data.get("ec", 0)
-        else:
-            parameters = [
-                float(data.get("N", 0)),
-                float(data.get("P", 0)),
-                float(data.get("K", 0)),
-                float(data.get("temperature", 25)),
-                float(data.get("humidity", 50)),
-                float(data.get("ph", 7)),
-                float(data.get("rainfall", 100))
-            ]
-            ec_value = float(data.get("ec", 0))
-        print("Parameters:", parameters)
-        print("EC value:", ec_value)
+
+        sensor_reading = latest_reading(session.get("device_id")) if use_sensor_data else None
+        parameters, ec_value = parse_parameters(data, sensor_reading)
+        log.debug("/predict called", mode=mode, use_sensor_data=use_sensor_data, parameters=parameters, ec=ec_value)
 
         if mode == "crop":
             if models['crop_model'] is None:
-                print("Crop model not available!")
+                log.error("Crop model not available")
                 return jsonify({"error": "Crop model not available"}), 500
-            prediction = models['crop_model'].predict([parameters])[0]
-            confidence = models['crop_model'].predict_proba([parameters])[0].max() * 100 if hasattr(models['crop_model'], "predict_proba") else 85
-            all_crops = models['crop_data']["label"].unique()
-            suitability_scores = []
-            for crop in all_crops:
-                suitability, _, _ = calculate_suitability(parameters, crop)
-                if suitability is not None:
-                    suitability_scores.append((crop, suitability))
-            if suitability_scores:
-                best_crop_by_suitability = max(suitability_scores, key=lambda x: x[1])
-            else:
-                best_crop_by_suitability = (None, 0)
-            print("Prediction:", prediction, "Best by suitability:", best_crop_by_suitability)
-            return jsonify({
-                "crop": best_crop_by_suitability[0],
-                "confidence": round(best_crop_by_suitability[1], 2),
-                "crop-predicted": prediction,
-                "confidence-predicted": round(confidence, 2)
-            })
+            try:
+                top_k, engine = parse_top_k(data), parse_engine(data)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            result = cpu_pool.run(predict_crops, [parameters], top_k, engine)[0]
+            log.debug("Crop prediction", predicted=result["crop-predicted"], best=result["crop"],
+                      confidence=result["confidence"])
+            return jsonify(dict(result, model_version=models['version']))
         elif mode == "suitability":
-            crop_name = data.get("crop_name")
-            if not crop_name:
-                print("No crop name provided!")
-                return jsonify({"error": "Crop name is required"}), 400
-            suitability, recommendations, table_data = calculate_suitability(parameters, crop_name)
-            if suitability is None:
-                print("Suitability error:", recommendations)
-                return jsonify({"error": recommendations}), 400
-            return jsonify({
-                "crop": crop_name,
-                "suitability": suitability,
-                "recommendations": recommendations,
-                "table_data": table_data
-            })
+            result = cpu_pool.run(suitability_result, parameters, data.get("crop_name"))
+            if "error" in result:
+                log.debug("Suitability error", error=result["error"])
+                return jsonify(result), 400
+            return jsonify(dict(result, model_version=models['version']))
         elif mode == "fertilizer":
-            soil_data = {
-                "N": parameters[0],
-                "P": parameters[1],
-                "K": parameters[2],
-                "temperature": parameters[3],
-                "humidity": parameters[4],
-                "ph": parameters[5],
-                "moisture": sensor_data.get("moisture", 40) if use_sensor_data else float(data.get("moisture", 40)),
-                "ec": ec_value,
-                "soil": data.get("soil", "Black")
-            }
-            print("Soil data:", soil_data)
-            recommendation = predict_fertilizer(soil_data, data.get("crop_name"))
+            soil_data = build_soil_data(data, parameters, ec_value, sensor_reading)
+            log.debug("Fertilizer soil data", soil_data=soil_data)
+            recommendation = cpu_pool.run(predict_fertilizer, soil_data, data.get("crop_name"))
             if "error" in recommendation:
-                print("Fertilizer error:", recommendation["error"])
+                log.warning("Fertilizer error", error=recommendation["error"])
                 return jsonify({"error": recommendation["error"]}), 500
-            return jsonify(recommendation)
+            return jsonify(dict(recommendation, model_version=models['version']))
         else:
-            print("Invalid mode specified:", mode)
+            log.debug("Invalid mode specified", mode=mode)
             return jsonify({"error": "Invalid mode specified"}), 400
     except Exception as e:
-        print("Exception in /predict:", str(e))
+        log.exception("Exception in /predict", error=str(e))
         return jsonify({"error": str(e)}), 500
-    
+
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    """
+    Run many /predict inputs in one request. Inputs are grouped by mode and each
+    model runs once per group; results come back in input order, with per-item errors.
+    """
+    try:
+        data = request.get_json()
+        items = data.get("inputs") if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            return jsonify({"error": "Expected a list of inputs"}), 400
+        if len(items) > MAX_BATCH_PREDICT_ITEMS:
+            return jsonify({"error": f"Too many inputs (max {MAX_BATCH_PREDICT_ITEMS})"}), 400
+
+        results = [None] * len(items)
+        groups = {"crop": [], "suitability": [], "fertilizer": []}
+        # Looked up once, for inputs with use_sensor_data
+        sensor_reading = None
+        if any(isinstance(item, dict) and item.get("use_sensor_data") for item in items):
+            sensor_reading = latest_reading(session.get("device_id"))
+        for i, item in enumerate(items):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Each input must be an object")
+                mode = item.get("mode", "crop")
+                if mode not in groups:
+                    results[i] = {"error": "Invalid mode specified"}
+                    continue
+                parameters, ec_value = parse_parameters(item, sensor_reading)
+                if mode == "fertilizer":
+                    soil_data = build_soil_data(item, parameters, ec_value, sensor_reading)
+                    groups[mode].append((i, (soil_data, item.get("crop_name"))))
+                elif mode == "suitability":
+                    groups[mode].append((i, (parameters, item.get("crop_name"))))
+                else:
+                    groups[mode].append((i, (parameters, parse_top_k(item), parse_engine(item))))
+            except Exception as e:
+                results[i] = {"error": str(e)}
+
+        if groups["crop"]:
+            if models['crop_model'] is None:
+                crop_results = [{"error": "Crop model not available"}] * len(groups["crop"])
+            else:
+                try:
+                    crop_results = cpu_pool.run(predict_crops,
+                                                [parameters for _, (parameters, _, _) in groups["crop"]],
+                                                [top_k for _, (_, top_k, _) in groups["crop"]],
+                                                [engine for _, (_, _, engine) in groups["crop"]])
+                except Exception as e:
+                    log.exception("Exception in /predict/batch crop group", error=str(e))
+                    crop_results = [{"error": str(e)}] * len(groups["crop"])
+            for (i, _), result in zip(groups["crop"], crop_results):
+                results[i] = result
+
+        if groups["suitability"]:
+            try:
+                suitability = cpu_pool.run(suitability_results, [pair for _, pair in groups["suitability"]])
+            except Exception as e:
+                log.exception("Exception in /predict/batch suitability group", error=str(e))
+                suitability = [{"error": str(e)}] * len(groups["suitability"])
+            for (i, _), result in zip(groups["suitability"], suitability):
+                results[i] = result
+
+        if groups["fertilizer"]:
+            recommendations = cpu_pool.run(predict_fertilizer_batch, [pair for _, pair in groups["fertilizer"]])
+            for (i, _), recommendation in zip(groups["fertilizer"], recommendations):
+                results[i] = recommendation
+
+        return jsonify({
+            "results": results,
+            "count": len(results),
+            "errors": sum(1 for result in results if "error" in result),
+            "model_version": models['version']
+        })
+    except Exception as e:
+        log.exception("Exception in /predict/batch", error=str(e))
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/logout")
 def logout():
     session.clear()
@@ -534,21 +1254,21 @@ def receive_device_data():
     data = request.get_json()
     device_id = data.get('device_id')
     # TODO: Validate device_id, save to database, etc.
-    print(f"Received data from {device_id}: {data}")
+    log.debug("Received device data", device_id=device_id)
     return jsonify({"status": "success"})
 
 @app.route('/api/check_device_id', methods=['POST'])
 def check_device_id():
     data = request.get_json()
     device_id = data.get('device_id', '').strip()
-    device = devices_col.find_one({"device_id": device_id, "registered": True})
-    return jsonify({"registered": bool(device)})
+    return jsonify({"registered": device_cache.registered(device_id) is True})
 
 def is_valid_device_id(device_id):
-    return devices_col.find_one({"device_id": device_id, "registered": False}) is not None
+    # Read through to Mongo: another worker may have registered it since we cached it
+    return device_cache.registered(device_id, fresh=True) is False
 
 def register_user(username, password, device_id):
-    password_hash = generate_password_hash(password)
+    password_hash = cpu_pool.run(generate_password_hash, password)
     try:
         users_col.insert_one({
             "username": username,
@@ -556,13 +1276,14 @@ def register_user(username, password, device_id):
             "device_id": device_id
         })
         devices_col.update_one({"device_id": device_id}, {"$set": {"registered": True}})
+        device_cache.invalidate(device_id)
         return True, None
     except Exception as e:
         return False, str(e)
 
 def authenticate_user(username, password, device_id):
     user = users_col.find_one({"username": username, "device_id": device_id})
-    if user and check_password_hash(user['password_hash'], password):
+    if user and cpu_pool.run(check_password_hash, user['password_hash'], password):
         return True
     return False
 
@@ -597,6 +1318,76 @@ def api_login():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Internal server error: {str(e)}'}), 500
 
+def admin_authorized():
+    key = request.headers.get('x-admin-key')
+    return bool(ADMIN_API_KEY) and key is not None and hmac.compare_digest(key, ADMIN_API_KEY)
+
+@app.route('/api/admin/models', methods=['GET'])
+def admin_models():
+    """Active model version, its validation report and recent reload results"""
+    if not admin_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(model_registry.snapshot())
+
+@app.route('/api/admin/models/reload', methods=['POST'])
+def admin_reload_models():
+    """
+    Load, validate and swap in the model files on disk (this worker only; set
+    MODEL_WATCH_INTERVAL for all workers to follow file changes). ?force=1 reloads
+    even if the files match the active version, ?wait=1 waits for the result.
+    """
+    if not admin_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    force = request.args.get('force') == '1'
+    if request.args.get('wait') == '1':
+        result = model_registry.reload(force=force, wait=True)
+        return jsonify(result), 200 if result["status"] in ("swapped", "unchanged") else 422
+    return jsonify(model_registry.reload(force=force)), 202
+
+# Queue depths, cache sizes and component counters, read at scrape time
+metrics_registry.register_stats("terradetect_ingest_queue", "Sensor batch writer counters and queue depth",
+                                lambda: dict(sensor_writer.stats, depth=sensor_writer.depth()))
+metrics_registry.register_stats("terradetect_rollups", "Rollup accumulator counters",
+                                lambda: rollups.accumulator.stats)
+metrics_registry.register_stats("terradetect_sensor_stream", "Live sensor stream clients and events",
+                                sensor_hub.snapshot)
+metrics_registry.register_stats("terradetect_prediction_cache", "Prediction cache counters",
+                                prediction_cache.snapshot)
+metrics_registry.register_stats("terradetect_device_cache", "Device record cache counters",
+                                device_cache.snapshot)
+metrics_registry.register_stats("terradetect_anomaly_detection", "Anomaly detector readings, alerts and checkpoints",
+                                anomaly_detector.snapshot)
+metrics_registry.register_stats("terradetect_cpu_pool", "CPU offload pool calls and busy threads",
+                                cpu_pool.snapshot)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text-format metrics for this worker process"""
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/status', methods=['GET'])
+def status():
+    """Cache and queue counters for monitoring"""
+    return jsonify({
+        "device_cache": device_cache.snapshot(),
+        "ingest_queue": dict(sensor_writer.stats, depth=sensor_writer.depth(), mode=ESP32_INGEST_MODE),
+        "sensor_storage": sensor_store.layout,
+        "rollups": dict(rollups.accumulator.stats, mode=rollups.mode),
+        "anomaly_detection": dict(anomaly_detector.snapshot(), enabled=ANOMALY_DETECTION),
+        "sensor_stream": sensor_hub.snapshot(),
+        "prediction_cache": prediction_cache.snapshot(),
+        "cpu_pool": cpu_pool.snapshot(),
+        "models": {"version": models['version'], "loaded_at": models['loaded_at'],
+                   "flat_forest": {"crop": bool(models['crop_inference'] and models['crop_inference'].forest.compiled),
+                                   "fertilizer": bool(models['fertilizer_predictor']
+                                                      and models['fertilizer_predictor'].compiled)},
+                   # Fertilizer inputs whose category was unknown to the current model, by column
+                   "fertilizer_unknown_categories": (dict(models['fertilizer_encoder'].unknown_counts)
+                                                     if models['fertilizer_encoder'] is not None else {})}
+    })
+
 @app.route('/history')
 def history_page():
     device_id = session.get('device_id')
@@ -0,0 +1,100 @@
+"""
+Per-reading cost of the streaming anomaly detector (alerts.py) on the ingestion path.
+
+Feeds --readings synthetic readings from --devices devices through
+AnomalyDetector.observe(), with all eight sensor fields and a target crop, and
+times every call. About --anomaly-rate of the readings carry a spike, so alerts
+are raised and queued as they would be in production (the queue is drained into
+a collection that discards them). Prints mean/p50/p99 microseconds per reading
+and exits with status 1 if the mean is above --budget-us.
+
+Run from the backend directory:
+    python benchmarks/bench_anomaly.py [--readings 200000] [--devices 1000] [--budget-us 50]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from aggregates import SENSOR_FIELDS
+from alerts import AnomalyDetector, CropRanges
+from ingest import BatchWriter
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+class DiscardCollection:
+    """Stands in for the alerts and anomaly_state collections; keeps nothing"""
+
+    def insert_many(self, docs, ordered=True):
+        pass
+
+    def bulk_write(self, requests, ordered=True):
+        pass
+
+    def find(self, *args, **kwargs):
+        return []
+
+
+def readings(devices, count, anomaly_rate, seed):
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    base = {"temperature": 25.0, "humidity": 82.0, "ph": 6.5, "ec": 1.2,
+            "N": 80.0, "P": 45.0, "K": 40.0, "moisture": 40.0}
+    for i in range(count):
+        doc = {field: round(value + rng.gauss(0, 0.5), 2) for field, value in base.items()}
+        if rng.random() < anomaly_rate:
+            doc[rng.choice(SENSOR_FIELDS)] *= 3
+        doc["timestamp"] = start + timedelta(seconds=15 * (i // len(devices)))
+        yield devices[i % len(devices)], doc
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the anomaly detector per reading")
+    parser.add_argument("--readings", type=int, default=200000)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--crop", default="Rice", help="target crop for range checks")
+    parser.add_argument("--anomaly-rate", type=float, default=0.01)
+    parser.add_argument("--budget-us", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    crop_ranges = CropRanges.from_dataframe(pd.read_csv(os.path.join(BACKEND_DIR, "crop-data.csv")))
+    bounds = crop_ranges.get(args.crop)
+    sink = DiscardCollection()
+    detector = AnomalyDetector(sink, BatchWriter(sink, max_queue=1000000), checkpoint_interval=3600)
+    devices = [f"BENCH{i:05d}" for i in range(args.devices)]
+    stream = list(readings(devices, args.readings, args.anomaly_rate, args.seed))
+
+    observe = detector.observe
+    timer = time.perf_counter_ns
+    latencies = np.empty(len(stream), dtype=np.int64)
+    started = time.perf_counter()
+    for i, (device_id, doc) in enumerate(stream):
+        t0 = timer()
+        observe(device_id, doc, SENSOR_FIELDS, bounds)
+        latencies[i] = timer() - t0
+    elapsed = time.perf_counter() - started
+    detector.checkpoint()
+
+    micros = latencies / 1000
+    mean = float(micros.mean())
+    print(f"{len(stream)} readings, {args.devices} devices, {len(SENSOR_FIELDS)} fields, crop {args.crop}")
+    print(f"alerts raised: {detector.stats['alerts']} (dropped {detector.stats['dropped']})")
+    print(f"us/reading: mean {mean:.2f}  p50 {np.percentile(micros, 50):.2f}  "
+          f"p99 {np.percentile(micros, 99):.2f}  max {micros.max():.1f}")
+    print(f"throughput: {len(stream) / elapsed:,.0f} readings/s on one thread")
+    if mean > args.budget_us:
+        print(f"FAIL: mean above the {args.budget_us:g}us budget")
+        sys.exit(1)
+    print(f"OK: within the {args.budget_us:g}us budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Concurrent-connection capacity of the serving modes, under gunicorn with the
+same number of workers:
+
+    sync     gunicorn's sync worker: one request at a time per worker
+    gthread  the default (gunicorn.conf.py): GUNICORN_THREADS threads per worker
+    async    SERVER_MODE=async: gevent worker, inference and hashing on the CPU pool
+
+For each --concurrency level, that many keep-alive connections send requests
+back to back for --duration seconds, in the --mix of ESP32 readings, history
+pages, crop predictions and (optionally) password logins. Reports requests/sec,
+p50/p99 latency and the error rate per level, and per mode the largest level
+that stayed under --slo-ms p99 with under 1% errors.
+
+The app runs on mongomock with stub models (see load_test.py), and every Mongo
+call sleeps --mongo-latency-ms first to stand in for the network round trip to
+a real server, which is what lets the modes differ. Set MONGO_URI to use a real
+server instead (its database is seeded with benchmark users and devices).
+Needs `pip install gunicorn mongomock gevent`.
+
+Run from the backend directory:
+    python benchmarks/bench_async_capacity.py [--modes sync,gthread,async] [--concurrency 10,50,200,500]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(BENCH_DIR, ".."))
+
+MODES = {
+    # gunicorn quietly runs gthread when a sync worker is given more than one thread
+    "sync": {"GUNICORN_WORKER_CLASS": "sync", "GUNICORN_THREADS": "1"},
+    "gthread": {"GUNICORN_WORKER_CLASS": "gthread"},
+    "async": {"SERVER_MODE": "async"},
+}
+DEVICES = [f"CAP{i:04d}" for i in range(50)]
+PASSWORD = "capacity-test"
+MONGOMOCK_CALLS = ("find", "find_one", "insert_one", "insert_many", "update_one", "update_many",
+                   "bulk_write", "count_documents", "aggregate", "find_one_and_update")
+
+
+def add_mongo_latency(seconds):
+    """Make every mongomock collection call wait like a network round trip would"""
+    import functools
+
+    from mongomock.collection import Collection
+
+    def delayed(method):
+        @functools.wraps(method)
+        def call(*args, **kwargs):
+            time.sleep(seconds)
+            return method(*args, **kwargs)
+        return call
+
+    for name in MONGOMOCK_CALLS:
+        setattr(Collection, name, delayed(getattr(Collection, name)))
+
+
+def serve():
+    """gunicorn app factory: the app on mongomock (or MONGO_URI) with stub models and seeded users"""
+    from load_test import build_stub_models, random_reading
+
+    workdir = os.environ["BENCH_WORKDIR"]
+    os.environ["MODEL_ARTIFACT_DIR"] = os.path.join(workdir, "artifacts")
+    os.environ["LATEST_STORE_PATH"] = os.path.join(workdir, "latest")
+    if not os.path.isdir(os.environ["MODEL_ARTIFACT_DIR"]):
+        build_stub_models(os.environ["MODEL_ARTIFACT_DIR"])
+    if not os.environ.get("MONGO_URI"):
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+        # Seeding below runs before the delay is added
+        latency = float(os.environ.get("BENCH_MONGO_LATENCY_MS", 0)) / 1000
+    else:
+        latency = 0
+
+    from datetime import datetime
+
+    from werkzeug.security import generate_password_hash
+    import app as appmod
+
+    rng = random.Random(0)
+    appmod.devices_col.delete_many({"device_id": {"$in": DEVICES}})
+    appmod.users_col.delete_many({"device_id": {"$in": DEVICES}})
+    appmod.devices_col.insert_many([{"device_id": d, "api_key": f"key-{d}", "registered": True} for d in DEVICES])
+    password_hash = generate_password_hash(PASSWORD)
+    appmod.users_col.insert_many([{"username": f"cap{i}", "password_hash": password_hash, "device_id": d}
+                                  for i, d in enumerate(DEVICES)])
+    # mongomock scans every document on each query, so keep the seeded history small
+    per_device = int(os.environ.get("BENCH_SEED_READINGS", 20))
+    now = time.time()
+    appmod.sensor_store.insert_many([dict(random_reading(rng), device_id=d,
+                                          timestamp=datetime.fromtimestamp(now - (per_device - i) * 60))
+                                     for d in DEVICES for i in range(per_device)])
+    appmod.ensure_indexes()
+    if latency:
+        add_mongo_latency(latency)
+    return appmod.app
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, args, workdir):
+    port = free_port()
+    env = dict(os.environ, BENCH_WORKDIR=workdir, BENCH_MONGO_LATENCY_MS=str(args.mongo_latency_ms),
+               BENCH_SEED_READINGS=str(args.seed_readings),
+               SECRET_KEY="capacity-test", LOG_LEVEL="WARNING", **MODES[mode])
+    command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--pythonpath", BENCH_DIR,
+               "--workers", str(args.workers), "--bind", f"127.0.0.1:{port}", "--backlog", "2048",
+               "--timeout", "120", "bench_async_capacity:serve()"]
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL,
+                               stderr=None if args.verbose else subprocess.DEVNULL)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn ({mode}) exited with status {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"gunicorn ({mode}) did not start listening")
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def build_request(method, path, body=None, headers=None, content_type="application/json"):
+    lines = [f"{method} {path} HTTP/1.1", "Host: 127.0.0.1"]
+    lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+    payload = b""
+    if body is not None:
+        payload = body if isinstance(body, bytes) else json.dumps(body).encode()
+        lines.extend([f"Content-Type: {content_type}", f"Content-Length: {len(payload)}"])
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + payload
+
+
+async def read_response(reader):
+    """(status, headers, keep-alive) of one response on the connection, body discarded"""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers.setdefault(name.strip().lower(), []).append(value.strip())
+    length = int(headers.get("content-length", ["0"])[0])
+    if length:
+        await reader.readexactly(length)
+    keep_alive = headers.get("connection", [""])[0].lower() != "close"
+    return status, headers, keep_alive
+
+
+async def login(port, index):
+    """Session cookie for benchmark user `index`"""
+    form = urllib.parse.urlencode({"username": f"cap{index}", "password": PASSWORD,
+                                   "device_id": DEVICES[index]}).encode()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(build_request("POST", "/login", form, {"Connection": "close"},
+                                   "application/x-www-form-urlencoded"))
+        status, headers, _ = await read_response(reader)
+    finally:
+        writer.close()
+    for cookie in headers.get("set-cookie", []):
+        if cookie.startswith("session="):
+            return cookie.split(";", 1)[0]
+    raise RuntimeError(f"Login failed with status {status}")
+
+
+def request_factory(mix, cookie, rng):
+    """A function returning (route, raw request) in the proportions of mix"""
+    from load_test import random_reading
+
+    def esp32():
+        device_id = rng.choice(DEVICES)
+        return build_request("POST", "/api/esp32", dict(random_reading(rng), device_id=device_id),
+                             {"x-api-key": f"key-{device_id}"})
+
+    def history():
+        return build_request("GET", "/api/sensor/history?per_page=20", headers={"Cookie": cookie})
+
+    def predict():
+        body = dict(random_reading(rng), mode="crop", rainfall=round(rng.uniform(20, 300), 1))
+        return build_request("POST", "/predict", body, {"Cookie": cookie})
+
+    def login_form():
+        index = rng.randrange(len(DEVICES))
+        form = urllib.parse.urlencode({"username": f"cap{index}", "password": PASSWORD,
+                                       "device_id": DEVICES[index]}).encode()
+        return build_request("POST", "/login", form, content_type="application/x-www-form-urlencoded")
+
+    builders = {"esp32": esp32, "history": history, "predict": predict, "login": login_form}
+    routes = [route for route, weight in mix.items() if weight > 0]
+    weights = [mix[route] for route in routes]
+
+    def next_request():
+        route = rng.choices(routes, weights)[0]
+        return route, builders[route]()
+    return next_request
+
+
+async def connection_loop(port, next_request, deadline, timeout, samples):
+    reader = writer = None
+    while time.monotonic() < deadline:
+        route, raw = next_request()
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+            writer.write(raw)
+            status, _, keep_alive = await asyncio.wait_for(read_response(reader), timeout)
+            samples.append((route, time.perf_counter() - start, status < 400))
+        except Exception:
+            samples.append((route, time.perf_counter() - start, False))
+            keep_alive = False
+        if not keep_alive and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_level(port, concurrency, args, mix, seed):
+    cookie = await login(port, 0)
+    rng = random.Random(seed)
+    samples = []
+    deadline = time.monotonic() + args.duration
+    started = time.perf_counter()
+    await asyncio.gather(*(connection_loop(port, request_factory(mix, cookie, random.Random(rng.random())),
+                                           deadline, args.timeout, samples)
+                           for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies = np.array([latency for _, latency, _ in samples]) * 1000
+    errors = sum(1 for _, _, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "rps": (len(samples) - errors) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(samples) else None,
+        "p99_ms": float(np.percentile(latencies, 99)) if len(samples) else None,
+        "error_rate": errors / len(samples) if samples else 1.0,
+    }
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        route, _, weight = part.partition(":")
+        mix[route.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare concurrent-connection capacity of the serving modes")
+    parser.add_argument("--modes", default="sync,gthread,async")
+    parser.add_argument("--concurrency", default="10,50,200,500", help="comma-separated connection counts")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per concurrency level")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers in every mode")
+    parser.add_argument("--mix", default="esp32:5,history:3,predict:2,login:0",
+                        help="route weights; logins cost a full password hash each")
+    parser.add_argument("--mongo-latency-ms", type=float, default=5, help="simulated round trip per Mongo call")
+    parser.add_argument("--seed-readings", type=int, default=20, help="history readings per device")
+    parser.add_argument("--slo-ms", type=float, default=500, help="p99 a level must stay under to count")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds before a request counts as failed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show gunicorn's output")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+    mix = parse_mix(args.mix)
+    sys.path.insert(0, BENCH_DIR)
+
+    print(f"{args.workers} worker(s), {args.duration:g}s per level, mix {args.mix}, "
+          f"Mongo {'at MONGO_URI' if os.environ.get('MONGO_URI') else f'mongomock +{args.mongo_latency_ms:g}ms'}\n")
+    print(f"{'mode':8s} {'conns':>6s} {'req/s':>9s} {'p50 ms':>9s} {'p99 ms':>9s} {'errors':>8s}")
+    capacity = {}
+    with tempfile.TemporaryDirectory(prefix="terradetect-capacity-") as workdir:
+        for mode in args.modes.split(","):
+            process, port = start_server(mode, args, workdir)
+            try:
+                capacity[mode] = 0
+                for level in levels:
+                    result = asyncio.run(run_level(port, level, args, mix, args.seed))
+                    p50 = f"{result['p50_ms']:9.1f}" if result["p50_ms"] is not None else f"{'-':>9s}"
+                    p99 = f"{result['p99_ms']:9.1f}" if result["p99_ms"] is not None else f"{'-':>9s}"
+                    print(f"{mode:8s} {level:6d} {result['rps']:9.1f} {p50} {p99} {result['error_rate']:8.1%}")
+                    if (result["p99_ms"] is not None and result["p99_ms"] <= args.slo_ms
+                            and result["error_rate"] < 0.01):
+                        capacity[mode] = level
+            finally:
+                stop_server(process)
+
+    print(f"\nlargest level with p99 <= {args.slo_ms:g}ms and < 1% errors")
+    for mode, level in capacity.items():
+        print(f"{mode:8s} {level or '-':>6}")
+
+
+if __name__ == "__main__":
+    main()
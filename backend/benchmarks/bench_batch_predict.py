@@ -0,0 +1,69 @@
+"""
+Throughput of /predict/batch against the same inputs sent one by one to /predict.
+
+Needs crop-model.pkl and fertilizer-model.pkl in the backend directory. No Mongo
+server is contacted. The prediction cache is off (PREDICT_CACHE_SIZE=0) unless set
+otherwise, so the batch pass is not served from results the single pass cached.
+Single /predict responses carry their own model_version while batch items share
+the top-level one, so it is left out of the comparison.
+
+Run from the backend directory:
+    python benchmarks/bench_batch_predict.py [batch_size]
+"""
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("PREDICT_CACHE_SIZE", "0")
+from app import app
+
+SOILS = ["Sandy", "Loamy", "Black", "Red", "Clayey"]
+CROPS = ["Wheat", "Rice", "Maize", "Cotton", "Sugarcane"]
+
+
+def make_inputs(n, seed=0):
+    rng = random.Random(seed)
+    inputs = []
+    for i in range(n):
+        item = {
+            "mode": ("crop", "suitability", "fertilizer")[i % 3],
+            "N": rng.uniform(0, 140), "P": rng.uniform(5, 145), "K": rng.uniform(5, 205),
+            "temperature": rng.uniform(10, 40), "humidity": rng.uniform(15, 99),
+            "ph": rng.uniform(4, 9), "rainfall": rng.uniform(20, 300),
+            "moisture": rng.uniform(20, 60), "crop_name": rng.choice(CROPS), "soil": rng.choice(SOILS),
+        }
+        inputs.append(item)
+    return inputs
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    client = app.test_client()
+    inputs = make_inputs(n)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        single = [client.post("/predict", json=item).get_json() for item in inputs]
+        single_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = client.post("/predict/batch", json={"inputs": inputs}).get_json()["results"]
+        batch_time = time.perf_counter() - start
+
+    for result in single:
+        result.pop("model_version", None)
+    mismatches = sum(1 for a, b in zip(single, batch) if a != b)
+    print(f"inputs: {n} (mixed crop/suitability/fertilizer), mismatches: {mismatches}, "
+          f"prediction cache size: {os.environ['PREDICT_CACHE_SIZE']}")
+    print(f"/predict x{n}:   {single_time:8.3f} s  ({n / single_time:10.1f} items/s)")
+    print(f"/predict/batch: {batch_time:8.3f} s  ({n / batch_time:10.1f} items/s)")
+    print(f"speedup:        {single_time / batch_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark: the "neighbors" crop engine (CropNeighborIndex) against the
+suitability ranking (CropProfileIndex, same scores as calculate_suitability()).
+
+Reports per-request latency, how often the two engines agree on the best crop
+and on the top 5, and how often each recovers the true label of a dataset row
+after adding noise to it.
+Run from the backend directory:  python benchmarks/bench_crop_neighbors.py
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from suitability import CropProfileIndex, CropNeighborIndex, CROP_FEATURES
+
+crop_data = pd.read_csv(os.path.join(os.path.dirname(__file__), "..", "crop-data.csv"))
+profiles = CropProfileIndex.from_dataframe(crop_data)
+neighbors = CropNeighborIndex.from_dataframe(crop_data)
+parameters = [90.0, 42.0, 43.0, 20.8, 82.0, 6.5, 202.9]
+TOP = 5
+
+
+def suitability_ranking(user_input):
+    scores = profiles.score_all(user_input)
+    order = np.argsort(-scores, kind="stable")
+    return [profiles.labels[i] for i in order[:TOP]]
+
+
+def neighbor_ranking(user_input):
+    return [crop for crop, _, _ in neighbors.nearest_crops(user_input, TOP)[0]]
+
+
+def main():
+    rng = np.random.default_rng(0)
+    rows = crop_data[CROP_FEATURES].values.astype(float)
+    sample = rng.choice(len(rows), 1000, replace=False)
+    # 5% multiplicative noise, so the neighbor engine cannot just find the row itself
+    inputs = rows[sample] * rng.normal(1.0, 0.05, size=(len(sample), len(CROP_FEATURES)))
+    labels = crop_data["label"].values[sample]
+
+    top1 = overlap = suit_correct = neigh_correct = 0
+    for user_input, label in zip(inputs, labels):
+        suit = suitability_ranking(user_input)
+        neigh = neighbor_ranking(user_input)
+        # The tree path must give the same crops as the exhaustive scan
+        point = (user_input - neighbors.mean) / neighbors.scale
+        assert neigh == [neighbors.labels[crop] for crop, _ in neighbors._exhaustive(point, TOP)], user_input
+        top1 += suit[0] == neigh[0]
+        overlap += len(set(suit) & set(neigh))
+        suit_correct += suit[0] == label
+        neigh_correct += neigh[0] == label
+
+    runs = 2000
+    suit_time = timeit.timeit(lambda: profiles.best_crop(parameters), number=runs) / runs
+    best_time = timeit.timeit(lambda: neighbors.nearest_crops(parameters, 1), number=runs) / runs
+    neigh_time = timeit.timeit(lambda: neighbors.nearest_crops(parameters, TOP), number=runs) / runs
+    batch_time = timeit.timeit(lambda: neighbors.nearest_crops(inputs, TOP), number=5) / 5
+
+    n = len(inputs)
+    print(f"crops: {len(neighbors)}, rows: {len(crop_data)}, noisy inputs: {n}")
+    print(f"suitability best crop:   {suit_time * 1e6:8.1f} us/request")
+    print(f"neighbors best crop:     {best_time * 1e6:8.1f} us/request")
+    print(f"neighbors top-{TOP}:         {neigh_time * 1e6:8.1f} us/request")
+    print(f"neighbors top-{TOP}, batch:  {batch_time / n * 1e6:8.1f} us/input ({n} inputs)")
+    print(f"best crop agreement:     {top1 / n:8.1%}")
+    print(f"top-{TOP} overlap:           {overlap / (n * TOP):8.1%}")
+    print(f"true label, suitability: {suit_correct / n:8.1%}")
+    print(f"true label, neighbors:   {neigh_correct / n:8.1%}")
+
+
+if __name__ == "__main__":
+    main()
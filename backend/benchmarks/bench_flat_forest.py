@@ -0,0 +1,99 @@
+"""
+The flattened forest evaluator (inference.FlatForest) against sklearn's predict_proba.
+
+First checks that it returns bit-identical probabilities for every row of
+crop-data.csv and fertilizer-data.csv, as one batch and row by row (exit status
+1 on any difference). Then times both at each --batch-sizes size, along with
+ForestPredictor, which picks one of the two per call (FLAT_FOREST_MAX_ROWS).
+
+Uses the models load_models() would load (artifacts or pickles, see model_store.py).
+
+Run from the backend directory:
+    python benchmarks/bench_flat_forest.py [--batch-sizes 1,100,10000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from inference import (FERTILIZER_COLUMNS, FLAT_FOREST_MAX_ROWS, FertilizerEncoder, FlatForest, ForestPredictor,
+                       pin_n_jobs)
+from model_registry import FERTILIZER_DATA_CSV
+from model_store import CROP_DATA_CSV, load_crop_model, load_fertilizer_bundle
+from suitability import CROP_FEATURES
+
+
+def load():
+    """[(name, sklearn model, feature matrix of its whole dataset)]"""
+    crop_model = pin_n_jobs(load_crop_model())
+    crops = pd.read_csv(CROP_DATA_CSV)[CROP_FEATURES].values.astype(float)
+    bundle = load_fertilizer_bundle()
+    fertilizer_model = pin_n_jobs(bundle["model"])
+    encoder = FertilizerEncoder(fertilizer_model, bundle["label_encoders"])
+    fertilizers = encoder.encode(pd.read_csv(FERTILIZER_DATA_CSV)[FERTILIZER_COLUMNS].to_dict("records"))
+    return [("crop", crop_model, crops), ("fertilizer", fertilizer_model, fertilizers)]
+
+
+def check(model, flat, X):
+    """Number of rows whose probabilities differ from sklearn's, batched and one at a time"""
+    mismatched = int(np.sum(~np.all(flat.predict_proba(X) == model.predict_proba(X), axis=1)))
+    for i in range(len(X)):
+        if not np.array_equal(flat.predict_proba(X[i:i + 1]), model.predict_proba(X[i:i + 1])):
+            mismatched += 1
+    return mismatched
+
+
+def best_time(fn, X, min_seconds):
+    """Best per-call time of fn(X), in milliseconds"""
+    fn(X)
+    times = []
+    deadline = time.perf_counter() + min_seconds
+    while len(times) < 3 or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        fn(X)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate and time the flattened forest evaluator")
+    parser.add_argument("--batch-sizes", default="1,100,10000")
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="timing time per measurement")
+    parser.add_argument("--skip-check", action="store_true")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.batch_sizes.split(",")]
+
+    failed = False
+    rows = []
+    for name, model, X in load():
+        start = time.perf_counter()
+        flat = FlatForest.from_forest(model)
+        compile_ms = (time.perf_counter() - start) * 1000
+        print(f"{name}: {len(model.estimators_)} trees, {len(flat.threshold)} nodes, depth {flat.depth}, "
+              f"compiled in {compile_ms:.0f}ms")
+        if not args.skip_check:
+            mismatched = check(model, flat, X)
+            print(f"  {len(X)} rows: {'identical to predict_proba' if not mismatched else f'{mismatched} differ'}")
+            failed = failed or bool(mismatched)
+        predictor = ForestPredictor(model, name, enabled=True)
+        for size in sizes:
+            batch = np.resize(X, (size, X.shape[1]))
+            timings = [best_time(fn, batch, args.min_seconds)
+                       for fn in (model.predict_proba, flat.predict_proba, predictor.predict_proba)]
+            rows.append((name, size, *timings))
+
+    print(f"\n{'model':12s}{'rows':>8s}{'sklearn ms':>13s}{'flat ms':>11s}{'speedup':>9s}"
+          f"{'predictor ms':>14s}   (flat up to {FLAT_FOREST_MAX_ROWS} rows)")
+    for name, size, sklearn_ms, flat_ms, predictor_ms in rows:
+        print(f"{name:12s}{size:8d}{sklearn_ms:13.3f}{flat_ms:11.3f}{sklearn_ms / flat_ms:8.1f}x{predictor_ms:14.3f}")
+    if failed:
+        print("\nFAIL: the flattened forest does not match predict_proba")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Startup time and resident memory added by loading the models from the pickles versus the
+joblib artifacts (read into memory, and memory-mapped).
+
+Each variant runs in a fresh interpreter. Run from the backend directory:
+    python benchmarks/bench_model_loading.py
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+LOADER = """
+import json, os, time, sys
+sys.path.insert(0, {backend!r})
+import joblib, pandas, sklearn.ensemble  # library imports are the same for every variant
+import model_store
+
+def rss_mb():
+    # Resident pages of this process (Linux)
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+rss_before = rss_mb()
+start = time.perf_counter()
+loaded = (model_store.load_crop_model(), model_store.load_fertilizer_bundle(), model_store.load_crop_data())
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "rss_mb": rss_mb() - rss_before}}))
+"""
+
+
+def run(env_overrides):
+    env = dict(os.environ, **env_overrides)
+    out = subprocess.run([sys.executable, "-c", LOADER.format(backend=BACKEND_DIR)],
+                         env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    sys.path.insert(0, BACKEND_DIR)
+    import model_store
+
+    with tempfile.TemporaryDirectory() as artifact_dir:
+        model_store.export_artifacts(artifact_dir)
+        variants = {
+            "pickle": {"MODEL_ARTIFACT_DIR": os.path.join(artifact_dir, "missing")},
+            "joblib": {"MODEL_ARTIFACT_DIR": artifact_dir, "MODEL_MMAP_MODE": ""},
+            "joblib+mmap": {"MODEL_ARTIFACT_DIR": artifact_dir, "MODEL_MMAP_MODE": "r"},
+        }
+        for name, env in variants.items():
+            # Warm the page cache first so every variant reads from memory
+            run(env)
+            result = run(env)
+            print(f"{name:12s} load {result['seconds'] * 1000:8.1f} ms   RSS added {result['rss_mb']:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Storage size and query latency of the sensor reading layouts (sensor_store.py)
+on a synthetic fleet: --devices devices, --readings in total, one reading every
+--interval seconds per device.
+
+Sizes are the BSON bytes of the documents and of the index keys. The compressed
+column uses zlib on 32 KB blocks as a rough stand-in for WiredTiger's block
+compression. With MONGO_URI set, the data goes to a scratch database on that
+server, and collStats sizes and real index lookups are reported too. Without it
+the data goes to mongomock (pip install mongomock). mongomock has no indexes, so
+its latencies mostly show how many documents each query scans.
+
+Run from the backend directory:
+    python benchmarks/bench_sensor_storage.py [--readings 1000000] [--devices 100] [--layouts documents,buckets]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+
+import bson
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from aggregates import SENSOR_FIELDS
+from history import history_projection
+from sensor_store import BUCKET_INDEX, SENSOR_COLLECTIONS, create_sensor_store
+
+START = datetime(2026, 1, 1)
+
+
+def device_readings(device_id, n, interval, rng):
+    """n readings for one device, oldest first, with a little jitter and drift"""
+    values = {"temperature": 25.0, "humidity": 60.0, "ph": 6.5, "ec": 1.2,
+              "N": 80.0, "P": 40.0, "K": 40.0, "moisture": 40.0}
+    docs = []
+    for i in range(n):
+        for field in SENSOR_FIELDS:
+            values[field] = max(0.0, values[field] + rng.gauss(0, 0.3))
+        doc = {"device_id": device_id}
+        doc.update({field: round(value, 2) for field, value in values.items()})
+        doc["timestamp"] = START + timedelta(seconds=i * interval + rng.randint(0, 2))
+        docs.append(doc)
+    return docs
+
+
+def load(store, devices, per_device, interval, seed):
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    for device_id in devices:
+        docs = device_readings(device_id, per_device, interval, rng)
+        for i in range(0, len(docs), 5000):
+            store.insert_many(docs[i:i + 5000])
+    return time.perf_counter() - started
+
+
+def document_sizes(docs, block=32 * 1024):
+    """(documents, BSON bytes, zlib-compressed bytes in block-sized pages)"""
+    count = total = compressed = 0
+    page, size = [], 0
+    for doc in docs:
+        blob = bson.encode(doc)
+        count += 1
+        total += len(blob)
+        page.append(blob)
+        size += len(blob)
+        if size >= block:
+            compressed += len(zlib.compress(b"".join(page), 1))
+            page, size = [], 0
+    if page:
+        compressed += len(zlib.compress(b"".join(page), 1))
+    return count, total, compressed
+
+
+def storage_report(db, store):
+    """Sizes from the documents themselves (and from collStats on a real server)"""
+    collection = store.collection
+    count, data_bytes, compressed = document_sizes(collection.find())
+    index_fields = [name for name, _ in (BUCKET_INDEX if store.layout == "buckets" else store.index)]
+    # One key per document for the layout's index, plus the _id index
+    index_bytes = sum(len(bson.encode({name: doc.get(name) for name in index_fields + ["_id"]}))
+                      + len(bson.encode({"_id": doc["_id"]})) for doc in collection.find({}, index_fields))
+    report = {
+        "documents": count,
+        "data_bytes": data_bytes,
+        "compressed_bytes": compressed,
+        "index_key_bytes": index_bytes,
+    }
+    try:
+        stats = db.command("collStats", collection.name)
+        report.update(storage_size=stats.get("storageSize"), total_index_size=stats.get("totalIndexSize"))
+    except Exception:
+        pass
+    return report
+
+
+def timed(fn, repeat, devices, rng):
+    latencies = []
+    for _ in range(repeat):
+        device_id = rng.choice(devices)
+        start = time.perf_counter()
+        fn(device_id)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    return float(np.median(latencies)), float(np.percentile(latencies, 95))
+
+
+def query_report(store, devices, per_device, interval, repeat, seed):
+    rng = random.Random(seed)
+    projection = history_projection(None)
+    export_projection = dict(projection, _id=0)
+    span = timedelta(seconds=per_device * interval)
+    day_start = START + span / 2
+    devices = rng.sample(devices, min(len(devices), 10))
+    # A cursor position halfway through each sampled device's history
+    positions = {}
+    for device_id in devices:
+        doc = store.page(device_id, projection, 1, skip=per_device // 2)[0]
+        positions[device_id] = (doc["timestamp"], doc["_id"], "next")
+
+    queries = {
+        "latest": lambda d: store.latest(d),
+        "history page 1": lambda d: store.page(d, projection, 21),
+        "history cursor (mid)": lambda d: store.page(d, projection, 21, position=positions[d]),
+        "count": lambda d: store.count(d),
+        "export 1 day": lambda d: sum(1 for _ in store.readings(
+            d, {"$gte": day_start, "$lt": day_start + timedelta(days=1)}, export_projection)),
+        "aggregate 7d hourly": lambda d: store.aggregate(d, START, START + timedelta(days=7), "hour", SENSOR_FIELDS),
+    }
+    return {name: timed(fn, repeat, devices, rng) for name, fn in queries.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sensor reading storage layouts")
+    parser.add_argument("--readings", type=int, default=1000000)
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--interval", type=float, default=15, help="seconds between a device's readings")
+    parser.add_argument("--layouts", default="documents,buckets",
+                        help="comma-separated; timeseries needs a MongoDB 5.0+ server")
+    parser.add_argument("--repeat", type=int, default=50, help="timed runs per query")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if os.environ.get("MONGO_URI"):
+        from pymongo import MongoClient
+        client, backend = MongoClient(os.environ["MONGO_URI"]), "mongodb"
+    else:
+        import mongomock
+        client, backend = mongomock.MongoClient(), "mongomock"
+    db = client["terradetect_storage_bench"]
+    devices = [f"BENCH{i:04d}" for i in range(args.devices)]
+    per_device = args.readings // args.devices
+    print(f"{per_device * args.devices} readings: {args.devices} devices x {per_device}, "
+          f"every {args.interval:g}s ({backend})\n")
+
+    results = {}
+    for layout in args.layouts.split(","):
+        db.drop_collection(SENSOR_COLLECTIONS[layout])
+        store = create_sensor_store(db, layout)
+        store.ensure_indexes()
+        load_seconds = load(store, devices, per_device, args.interval, args.seed)
+        results[layout] = (storage_report(db, store), query_report(
+            store, devices, per_device, args.interval, args.repeat, args.seed))
+        print(f"{layout}: loaded in {load_seconds:.1f}s")
+        db.drop_collection(SENSOR_COLLECTIONS[layout])
+
+    layouts = list(results)
+    print(f"\n{'storage':24s}" + "".join(f"{layout:>16s}" for layout in layouts))
+    for key in results[layouts[0]][0]:
+        row = [results[layout][0].get(key) for layout in layouts]
+        cells = "".join(f"{value:>16,}" if value is not None else f"{'-':>16s}" for value in row)
+        print(f"{key:24s}{cells}")
+    print(f"\n{'query ms (p50 / p95)':24s}" + "".join(f"{layout:>16s}" for layout in layouts))
+    for name in results[layouts[0]][1]:
+        cells = "".join(f"{'%.2f / %.2f' % results[layout][1][name]:>16s}" for layout in layouts)
+        print(f"{name:24s}{cells}")
+
+
+if __name__ == "__main__":
+    main()
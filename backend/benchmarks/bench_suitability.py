@@ -0,0 +1,51 @@
+"""
+Micro-benchmark: per-request cost of finding the best crop by suitability.
+
+Compares the old per-crop DataFrame scan against CropProfileIndex.
+Run from the backend directory:  python benchmarks/bench_suitability.py
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from suitability import CropProfileIndex, CROP_FEATURES
+
+crop_data = pd.read_csv(os.path.join(os.path.dirname(__file__), "..", "crop-data.csv"))
+index = CropProfileIndex.from_dataframe(crop_data)
+parameters = [90.0, 42.0, 43.0, 20.8, 82.0, 6.5, 202.9]
+
+
+def legacy_best_crop(user_input):
+    """The scan predict() used to do: one boolean-mask filter per crop"""
+    scores = []
+    for crop in crop_data["label"].unique():
+        crop_info = crop_data[crop_data["label"] == crop]
+        ideal_values = crop_info.iloc[0][CROP_FEATURES].values.astype(float)
+        user_values = np.array(user_input).astype(float)
+        deviation = np.abs(user_values - ideal_values)
+        max_deviation = ideal_values * 0.2
+        score = (max(0, abs(100 - (np.sum(deviation / max_deviation) * 100 / len(ideal_values))))) % 100
+        scores.append((crop, round(score, 2)))
+    return max(scores, key=lambda x: x[1])
+
+
+def main():
+    # Same answer on a spread of real inputs before timing anything
+    for row in crop_data[CROP_FEATURES].values[::97]:
+        assert legacy_best_crop(row) == index.best_crop(row), row
+
+    runs = 200
+    legacy = timeit.timeit(lambda: legacy_best_crop(parameters), number=runs) / runs
+    indexed = timeit.timeit(lambda: index.best_crop(parameters), number=runs) / runs
+    print(f"crops: {len(index)}, rows: {len(crop_data)}")
+    print(f"legacy scan:  {legacy * 1e6:10.1f} us/request")
+    print(f"profile index:{indexed * 1e6:10.1f} us/request")
+    print(f"speedup:      {legacy / indexed:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+Load test: a simulated ESP32 fleet and dashboard users against a local copy of the app.
+
+The app is started in this process on a threaded HTTP server, with mongomock in
+place of MongoDB and stub models trained from crop-data.csv and
+fertilizer-data.csv (written as joblib artifacts to a temporary directory, so
+the real pickles are neither needed nor touched). Needs `pip install mongomock`.
+
+For --duration seconds:
+    --devices N devices each POST a reading to /api/esp32 --device-rate times a second
+    --clients M dashboard users each make --client-rate requests a second, cycling
+      through /api/sensor/latest, /api/sensor/history (first page and next page)
+      and /predict in crop, suitability and fertilizer mode
+
+Requests are scheduled open-loop. When the server falls behind, senders skip
+ahead instead of queueing, and the report counts those skipped slots.
+
+Prints requests/sec and p50/p95/p99 latency per route. --save writes the results
+as a JSON baseline and --compare checks a run against one. The exit status is 1
+when a route's p95 grows, or its throughput drops, by more than --tolerance.
+
+Run from the backend directory:
+    python benchmarks/load_test.py --devices 50 --device-rate 1 --clients 10 --duration 30 --save baseline.json
+    python benchmarks/load_test.py --devices 50 --device-rate 1 --clients 10 --duration 30 --compare baseline.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BACKEND_DIR)
+
+SOILS = ["Sandy", "Loamy", "Black", "Red", "Clayey"]
+CROPS = ["Wheat", "Rice", "Maize", "Cotton", "Sugarcane"]
+
+
+def build_stub_models(artifact_dir, seed=0):
+    """Small forests trained on the bundled CSVs, saved where model_store looks for artifacts"""
+    import joblib
+    import pandas as pd
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import LabelEncoder
+
+    crop_data = pd.read_csv(os.path.join(BACKEND_DIR, "crop-data.csv"))
+    crop_model = RandomForestClassifier(n_estimators=50, random_state=seed)
+    crop_model.fit(crop_data.drop(columns="label").values, crop_data["label"])
+
+    fertilizer_data = pd.read_csv(os.path.join(BACKEND_DIR, "fertilizer-data.csv"))
+    label_encoders = {}
+    for column in ("Soil", "Crop"):
+        label_encoders[column] = LabelEncoder().fit(fertilizer_data[column])
+        fertilizer_data[column] = label_encoders[column].transform(fertilizer_data[column])
+    fertilizer_model = RandomForestClassifier(n_estimators=50, random_state=seed)
+    fertilizer_model.fit(fertilizer_data.drop(columns="Fertilizer"), fertilizer_data["Fertilizer"])
+    details = [{"name": name, "composition": "stub"} for name in fertilizer_data["Fertilizer"].unique()]
+
+    os.makedirs(artifact_dir, exist_ok=True)
+    joblib.dump(crop_model, os.path.join(artifact_dir, "crop-model.joblib"))
+    joblib.dump({"model": fertilizer_model, "label_encoders": label_encoders, "fertilizer_details": details},
+                os.path.join(artifact_dir, "fertilizer-model.joblib"))
+    joblib.dump({col: crop_data[col].to_numpy() for col in crop_data.columns},
+                os.path.join(artifact_dir, "crop-data.joblib"))
+
+
+def start_app(args, workdir):
+    """Import the app against mongomock and serve it on a free local port"""
+    import mongomock
+    import pymongo
+
+    os.environ.setdefault("SECRET_KEY", "load-test")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["MODEL_ARTIFACT_DIR"] = os.path.join(workdir, "artifacts")
+    os.environ["LATEST_STORE_PATH"] = os.path.join(workdir, "latest")
+    build_stub_models(os.environ["MODEL_ARTIFACT_DIR"], args.seed)
+    pymongo.MongoClient = mongomock.MongoClient
+
+    from werkzeug.security import generate_password_hash
+    from werkzeug.serving import make_server
+    import app as appmod
+
+    rng = random.Random(args.seed)
+    devices = [f"LOAD{i:05d}" for i in range(max(args.devices, args.clients))]
+    appmod.devices_col.insert_many([{"device_id": d, "api_key": f"key-{d}", "registered": True} for d in devices])
+    password_hash = generate_password_hash("load-test")
+    appmod.users_col.insert_many([{"username": f"user{i}", "password_hash": password_hash, "device_id": devices[i]}
+                                  for i in range(args.clients)])
+    # Some history for the dashboard to page through
+    now = time.time()
+    appmod.sensor_store.insert_many([
+        dict(random_reading(rng), device_id=device_id,
+             timestamp=datetime.fromtimestamp(now - (args.seed_readings - i) * 60))
+        for device_id in devices for i in range(args.seed_readings)])
+    appmod.ensure_indexes()
+
+    # One access-log line per request would dominate the output (and the timings)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, appmod.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, devices
+
+
+def random_reading(rng):
+    return {
+        "temperature": round(rng.uniform(10, 40), 2), "humidity": round(rng.uniform(15, 99), 2),
+        "ph": round(rng.uniform(4, 9), 2), "ec": round(rng.uniform(0, 3), 2),
+        "N": round(rng.uniform(0, 140), 1), "P": round(rng.uniform(5, 145), 1),
+        "K": round(rng.uniform(5, 205), 1), "moisture": round(rng.uniform(20, 60), 1),
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}  # route -> list of (latency seconds, ok)
+        self.skipped = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, latency, ok):
+        with self._lock:
+            self.samples.setdefault(route, []).append((latency, ok))
+
+    def skip(self, route, count):
+        with self._lock:
+            self.skipped[route] = self.skipped.get(route, 0) + count
+
+    def summary(self, elapsed):
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            latencies = np.array([latency for latency, _ in samples]) * 1000
+            errors = sum(1 for _, ok in samples if not ok)
+            routes[route] = {
+                "count": len(samples),
+                "errors": errors,
+                "skipped": self.skipped.get(route, 0),
+                "rps": round(len(samples) / elapsed, 2),
+                "mean_ms": round(float(latencies.mean()), 3),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            }
+        return routes
+
+
+def paced(rate, deadline, stop, route, recorder, action):
+    """Call action() rate times a second until deadline, skipping slots when behind"""
+    interval = 1.0 / rate
+    next_at = time.monotonic() + random.random() * interval
+    while not stop.is_set():
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        if next_at > now:
+            time.sleep(min(next_at - now, deadline - now))
+            continue
+        behind = int((now - next_at) / interval)
+        if behind:
+            recorder.skip(route(), behind)
+            next_at += behind * interval
+        action()
+        next_at += interval
+
+
+def timed(session, recorder, route, method, url, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = session.request(method, url, timeout=30, **kwargs)
+        ok = response.status_code < 400
+    except Exception:
+        response, ok = None, False
+    recorder.record(route, time.perf_counter() - start, ok)
+    return response
+
+
+def device_loop(base, device_id, args, deadline, stop, recorder, seed):
+    import requests
+    session = requests.Session()
+    rng = random.Random(seed)
+    headers = {"x-api-key": f"key-{device_id}"}
+
+    def post():
+        timed(session, recorder, "POST /api/esp32", "POST", f"{base}/api/esp32",
+              json=dict(random_reading(rng), device_id=device_id), headers=headers)
+
+    paced(args.device_rate, deadline, stop, lambda: "POST /api/esp32", recorder, post)
+
+
+def dashboard_loop(base, index, device_id, args, deadline, stop, recorder, seed):
+    import requests
+    session = requests.Session()
+    rng = random.Random(seed)
+    session.post(f"{base}/login", data={"username": f"user{index}", "password": "load-test",
+                                        "device_id": device_id}, allow_redirects=False)
+    state = {"step": 0, "cursor": None}
+
+    def predict_body(mode):
+        reading = random_reading(rng)
+        reading.update(mode=mode, rainfall=round(rng.uniform(20, 300), 1),
+                       crop_name=rng.choice(CROPS), soil=rng.choice(SOILS))
+        return reading
+
+    actions = [
+        ("GET /api/sensor/latest", lambda: ("GET", f"{base}/api/sensor/latest", {})),
+        ("GET /api/sensor/history", lambda: ("GET", f"{base}/api/sensor/history",
+                                             {"params": {"per_page": 20}})),
+        ("GET /api/sensor/history?cursor", lambda: ("GET", f"{base}/api/sensor/history",
+                                                    {"params": {"per_page": 20, "cursor": state["cursor"]}})),
+        ("POST /predict crop", lambda: ("POST", f"{base}/predict", {"json": predict_body("crop")})),
+        ("POST /predict suitability", lambda: ("POST", f"{base}/predict", {"json": predict_body("suitability")})),
+        ("POST /predict fertilizer", lambda: ("POST", f"{base}/predict", {"json": predict_body("fertilizer")})),
+    ]
+
+    def current_route():
+        return actions[state["step"] % len(actions)][0]
+
+    def step():
+        route, build = actions[state["step"] % len(actions)]
+        state["step"] += 1
+        if route.endswith("?cursor") and not state["cursor"]:
+            return
+        method, url, kwargs = build()
+        response = timed(session, recorder, route, method, url, **kwargs)
+        if route == "GET /api/sensor/history" and response is not None and response.ok:
+            state["cursor"] = response.json().get("next")
+
+    paced(args.client_rate, deadline, stop, current_route, recorder, step)
+
+
+def compare(results, baseline, tolerance):
+    """Print per-route changes against a saved baseline; returns True if anything regressed"""
+    regressed = False
+    print(f"\nAgainst baseline ({baseline.get('saved_at', 'unknown date')}), tolerance {tolerance:.0%}:")
+    for route, current in results["routes"].items():
+        before = baseline.get("routes", {}).get(route)
+        if not before:
+            print(f"  {route:32s} new route")
+            continue
+        p95_change = current["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        rps_change = current["rps"] / before["rps"] - 1 if before["rps"] else 0.0
+        flags = []
+        if p95_change > tolerance:
+            flags.append("p95 REGRESSION")
+        if rps_change < -tolerance:
+            flags.append("throughput REGRESSION")
+        regressed = regressed or bool(flags)
+        print(f"  {route:32s} p95 {before['p95_ms']:8.2f} -> {current['p95_ms']:8.2f} ms ({p95_change:+.0%})  "
+              f"rps {before['rps']:7.1f} -> {current['rps']:7.1f} ({rps_change:+.0%})  {' '.join(flags)}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test with a simulated ESP32 fleet")
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--device-rate", type=float, default=1.0, help="readings per second per device")
+    parser.add_argument("--clients", type=int, default=5, help="dashboard users")
+    parser.add_argument("--client-rate", type=float, default=2.0, help="requests per second per user")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--seed-readings", type=int, default=200, help="history rows per device before the run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        print("Starting app with mongomock and stub models...")
+        server, devices = start_app(args, workdir)
+        base = f"http://127.0.0.1:{server.server_port}"
+        recorder = Recorder()
+        stop = threading.Event()
+        deadline = time.monotonic() + args.duration
+        threads = [threading.Thread(target=device_loop, daemon=True,
+                                    args=(base, devices[i], args, deadline, stop, recorder, args.seed + i))
+                   for i in range(args.devices)]
+        threads += [threading.Thread(target=dashboard_loop, daemon=True,
+                                     args=(base, i, devices[i], args, deadline, stop, recorder,
+                                           args.seed + 100000 + i))
+                    for i in range(args.clients)]
+        started = time.monotonic()
+        print(f"Running {args.devices} devices x {args.device_rate}/s and "
+              f"{args.clients} dashboard users x {args.client_rate}/s for {args.duration:.0f}s...")
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            stop.set()
+        elapsed = time.monotonic() - started
+        server.shutdown()
+
+    routes = recorder.summary(elapsed)
+    total = sum(route["count"] for route in routes.values())
+    results = {
+        "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("save", "compare")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count(), "ingest_mode": os.environ.get("ESP32_INGEST_MODE", "sync")},
+        "elapsed_s": round(elapsed, 2),
+        "total_rps": round(total / elapsed, 2),
+        "routes": routes,
+    }
+
+    print(f"\n{'route':32s} {'count':>7s} {'err':>5s} {'skip':>5s} {'rps':>8s} "
+          f"{'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}")
+    for name, route in routes.items():
+        print(f"{name:32s} {route['count']:7d} {route['errors']:5d} {route['skipped']:5d} {route['rps']:8.1f} "
+              f"{route['p50_ms']:8.2f} {route['p95_ms']:8.2f} {route['p99_ms']:8.2f}")
+    print(f"total: {total} requests, {results['total_rps']} req/s")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+In-process LRU/TTL cache of device records, so the ESP32 endpoints do not query
+devices_col on every reading. Only a hash of the API key is kept in memory.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEVICE_CACHE_SIZE = int(os.environ.get("DEVICE_CACHE_SIZE", 10000))
+DEVICE_CACHE_TTL = float(os.environ.get("DEVICE_CACHE_TTL", 60))
+# Unknown device ids are cached briefly, to absorb floods of bad ids
+DEVICE_CACHE_NEGATIVE_TTL = float(os.environ.get("DEVICE_CACHE_NEGATIVE_TTL", 5))
+
+
+def hash_api_key(api_key):
+    if api_key is None:
+        return None
+    return hashlib.sha256(str(api_key).encode()).digest()
+
+
+class DeviceCache:
+    """device_id -> (api key hash, registered flag, target crop), loaded through loader(device_id)"""
+
+    def __init__(self, loader, max_size=DEVICE_CACHE_SIZE, ttl=DEVICE_CACHE_TTL,
+                 negative_ttl=DEVICE_CACHE_NEGATIVE_TTL):
+        self.loader = loader
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()  # device_id -> (found, key_hash, registered, target_crop, expires_at)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "negative_hits": 0, "evictions": 0, "invalidations": 0}
+
+    def _load(self, device_id):
+        device = self.loader(device_id)
+        now = time.monotonic()
+        if device is None:
+            entry = (False, None, None, None, now + self.negative_ttl)
+        else:
+            entry = (True, hash_api_key(device.get("api_key")), device.get("registered"),
+                     device.get("target_crop"), now + self.ttl)
+        with self._lock:
+            self._entries[device_id] = entry
+            self._entries.move_to_end(device_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return entry
+
+    def _get(self, device_id, fresh=False):
+        if not fresh:
+            with self._lock:
+                entry = self._entries.get(device_id)
+                if entry is not None and entry[4] > time.monotonic():
+                    self._entries.move_to_end(device_id)
+                    self.stats["hits" if entry[0] else "negative_hits"] += 1
+                    return entry
+        self.stats["misses"] += 1
+        return self._load(device_id)
+
+    def check_api_key(self, device_id, api_key):
+        """True if the device exists and api_key matches its stored key"""
+        found, key_hash, _, _, _ = self._get(device_id)
+        if not found or key_hash is None or api_key is None:
+            return False
+        return hmac.compare_digest(key_hash, hash_api_key(api_key))
+
+    def registered(self, device_id, fresh=False):
+        """The device's registered flag, or None if the device is unknown"""
+        found, _, registered, _, _ = self._get(device_id, fresh)
+        return registered if found else None
+
+    def target_crop(self, device_id):
+        """The crop the device's plot is growing, for range alerts (None if not set)"""
+        return self._get(device_id)[3]
+
+    def invalidate(self, device_id):
+        with self._lock:
+            if self._entries.pop(device_id, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self):
+        """Counters plus current size, for monitoring"""
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.stats["hits"] + self.stats["negative_hits"] + self.stats["misses"]
+        hit_rate = (self.stats["hits"] + self.stats["negative_hits"]) / lookups if lookups else 0.0
+        return dict(self.stats, size=size, hit_rate=round(hit_rate, 4))
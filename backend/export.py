@@ -0,0 +1,71 @@
+"""
+Streaming export of a device's sensor history as CSV or NDJSON.
+
+Readings are read from a server-side cursor in EXPORT_BATCH_SIZE batches and
+written out in EXPORT_CHUNK_BYTES chunks, so memory use does not depend on the
+length of the history. Output can be gzip-compressed on the fly.
+"""
+import csv
+import io
+import json
+import os
+import zlib
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 2000))
+EXPORT_CHUNK_BYTES = int(os.environ.get("EXPORT_CHUNK_BYTES", 64 * 1024))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _csv_lines(docs, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    yield buffer.getvalue()
+    for doc in docs:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([doc["timestamp"].isoformat() if field == "timestamp" else doc.get(field, "")
+                         for field in fields])
+        yield buffer.getvalue()
+
+
+def _ndjson_lines(docs, fields):
+    for doc in docs:
+        row = {field: doc.get(field) for field in fields}
+        row["timestamp"] = doc["timestamp"].isoformat()
+        yield json.dumps(row, separators=(",", ":")) + "\n"
+
+
+def _chunked(lines, chunk_bytes):
+    """Join small lines into chunks of about chunk_bytes"""
+    parts = []
+    size = 0
+    for line in lines:
+        parts.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield "".join(parts).encode()
+            parts = []
+            size = 0
+    if parts:
+        yield "".join(parts).encode()
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(docs, fmt, fields, gzip=False, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """Generator of response body bytes for an iterable of sensor_data documents"""
+    lines = _csv_lines(docs, fields) if fmt == "csv" else _ndjson_lines(docs, fields)
+    chunks = _chunked(lines, chunk_bytes)
+    return _gzipped(chunks) if gzip else chunks
@@ -0,0 +1,49 @@
+# Picked up automatically by `gunicorn app:app` when started from this directory.
+import gc
+import os
+import sys
+
+# SERVER_MODE=async: gevent workers, each serving up to GUNICORN_WORKER_CONNECTIONS
+# connections on one event loop. Mongo I/O yields to other requests; inference and
+# password hashing run on a bounded thread pool (offload.py). Needs `pip install gevent`.
+# The patching has to happen here, before the preloaded app creates its Mongo
+# client and background threads, or those would keep blocking the loop.
+SERVER_MODE = os.environ.get("SERVER_MODE", "sync")
+if SERVER_MODE == "async":
+    from gevent import monkey
+    monkey.patch_all()
+
+# Import the app (and load the models) once in the master process, so forked
+# workers share the model pages copy-on-write instead of each loading their own.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+# /api/sensor/stream holds a connection open for minutes, which would block (and
+# time out) a sync worker. Use threads by default; "gevent" also works.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent" if SERVER_MODE == "async" else "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 16))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+
+def pre_fork(server, worker):
+    # With LAZY_MODEL_LOADING=1 the models are not loaded at import time;
+    # load them here so the workers still inherit them from the master
+    models = getattr(sys.modules.get("app"), "models", None)
+    if hasattr(models, "ensure_loaded"):
+        models.ensure_loaded()
+    # Move everything loaded so far into the permanent GC generation, so the
+    # collector in each worker does not touch (and copy) the shared pages.
+    gc.freeze()
+
+
+def worker_exit(server, worker):
+    # Flush readings still queued by the batch writer (ESP32_INGEST_MODE=queued),
+    # pending rollup increments, queued alerts and the anomaly detector's state
+    writer = getattr(sys.modules.get("app"), "sensor_writer", None)
+    if writer is not None:
+        writer.stop()
+    rollups = getattr(sys.modules.get("app"), "rollups", None)
+    if rollups is not None:
+        rollups.stop()
+    detector = getattr(sys.modules.get("app"), "anomaly_detector", None)
+    if detector is not None:
+        detector.stop()
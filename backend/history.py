@@ -0,0 +1,105 @@
+"""
+Helpers for /api/sensor/history: keyset (cursor) pagination over
+(device_id, timestamp desc, _id desc), and a short-lived cache of per-device totals.
+"""
+import base64
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId
+
+# Server-side cap on per_page
+MAX_HISTORY_PAGE_SIZE = int(os.environ.get("MAX_HISTORY_PAGE_SIZE", 100))
+# How long a device's count_documents result is reused
+HISTORY_TOTAL_TTL = float(os.environ.get("HISTORY_TOTAL_TTL", 30))
+
+# Fields a history row may contain; ?fields= picks a subset
+HISTORY_FIELDS = ["timestamp", "temperature", "humidity", "ph", "N", "P", "K", "moisture", "ec"]
+
+# Index backing both the keyset queries and the latest-reading lookup
+SENSOR_HISTORY_INDEX = [("device_id", 1), ("timestamp", -1), ("_id", -1)]
+
+
+def history_projection(fields_param=None):
+    """Mongo projection for the requested fields (all history fields by default)"""
+    fields = HISTORY_FIELDS
+    if fields_param:
+        requested = [f.strip() for f in fields_param.split(",")]
+        fields = [f for f in HISTORY_FIELDS if f in requested] or HISTORY_FIELDS
+    projection = {field: 1 for field in fields}
+    # Needed to build the cursor tokens; stripped from the response
+    projection["timestamp"] = 1
+    projection["_id"] = 1
+    return projection
+
+
+def encode_cursor(doc, direction):
+    """Opaque token pointing just past doc, for paging in direction ("next" or "prev")"""
+    position = {"t": doc["timestamp"].isoformat(), "id": str(doc["_id"]), "d": direction}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Return (timestamp, _id, direction); raises ValueError for a malformed token"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        timestamp = datetime.fromisoformat(position["t"])
+        doc_id = ObjectId(position["id"]) if ObjectId.is_valid(position["id"]) else position["id"]
+        direction = position["d"]
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if direction not in ("next", "prev"):
+        raise ValueError("Invalid cursor")
+    return timestamp, doc_id, direction
+
+
+def keyset_query(device_id, timestamp, doc_id, direction):
+    """
+    Filter and sort for the page after (next, older) or before (prev, newer)
+    the position (timestamp, _id) in newest-first order.
+    """
+    op = "$lt" if direction == "next" else "$gt"
+    query = {
+        "device_id": device_id,
+        "$or": [
+            {"timestamp": {op: timestamp}},
+            {"timestamp": timestamp, "_id": {op: doc_id}},
+        ],
+    }
+    order = -1 if direction == "next" else 1
+    return query, [("timestamp", order), ("_id", order)]
+
+
+class TotalsCache:
+    """Per-device document counts, reused for HISTORY_TOTAL_TTL seconds"""
+
+    def __init__(self, counter, ttl=HISTORY_TOTAL_TTL, max_size=10000):
+        self.counter = counter
+        self.ttl = ttl
+        self.max_size = max_size
+        self._totals = {}  # device_id -> (total, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, device_id):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._totals.get(device_id)
+        if cached and cached[1] > now:
+            return cached[0]
+        total = self.counter(device_id)
+        with self._lock:
+            if len(self._totals) >= self.max_size:
+                self._totals.clear()
+            self._totals[device_id] = (total, now + self.ttl)
+        return total
+
+    def bump(self, device_id, count=1):
+        """Account for readings written by this process since the count was taken"""
+        with self._lock:
+            cached = self._totals.get(device_id)
+            if cached:
+                self._totals[device_id] = (cached[0] + count, cached[1])
@@ -0,0 +1,150 @@
+"""
+HTTP caching for the dashboard: conditional GET for the sensor APIs, response
+compression, and long-lived caching of frontend/static behind content-hashed URLs.
+
+ETags for /api/sensor/latest and /api/sensor/history are derived from the
+timestamp of the device's newest reading in the shared latest-reading store,
+so a matching If-None-Match is answered with 304 without touching Mongo or
+serializing anything, and every worker computes the same ETag. Readings that
+arrive out of order do not move that timestamp; ingestion counts them in an
+in-process marker that is part of the history ETag. A late reading accepted by
+another worker is therefore only noticed once a newer reading arrives. With
+LATEST_STORE_BACKEND=memory and several workers, set HTTP_ETAGS=0. History
+ETags are off with ESP32_INGEST_MODE=queued, where the newest timestamp moves
+before the readings are in Mongo.
+
+Last-Modified is not used. A device can send several readings per second, and
+HTTP dates only have one-second resolution.
+
+JSON and text responses of at least COMPRESS_MIN_BYTES are compressed with
+brotli (when the brotli package is installed and the client accepts it) or gzip.
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+from werkzeug.security import safe_join
+from werkzeug.wrappers import Response
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip only without it
+    brotli = None
+
+HTTP_ETAGS = os.environ.get("HTTP_ETAGS", "1") == "1"
+# Smaller bodies are sent as they are; 0 turns compression off
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 5))
+# For hashed static URLs (?v=<content hash>); a year, the usual "forever"
+STATIC_MAX_AGE = int(os.environ.get("STATIC_MAX_AGE", 31536000))
+
+COMPRESSIBLE_TYPES = {"application/json", "text/html", "text/csv", "text/plain", "text/css",
+                      "application/javascript", "text/javascript"}
+
+
+class WriteMarkers:
+    """
+    Readings this process wrote out of order, per device. A late reading (not
+    newer than the device's newest) changes history without moving the newest
+    timestamp, so it is counted against that timestamp. Once a newer reading
+    arrives, the timestamp itself changes the ETags and the count is dropped.
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._markers = {}  # device_id -> (newest timestamp, late writes)
+        self._lock = threading.Lock()
+
+    def touch(self, device_id, newest):
+        with self._lock:
+            current = self._markers.get(device_id)
+            late = current[1] + 1 if current and current[0] == newest else 1
+            if len(self._markers) >= self.max_size and device_id not in self._markers:
+                self._markers.clear()
+            self._markers[device_id] = (newest, late)
+
+    def get(self, device_id, newest):
+        current = self._markers.get(device_id)
+        return current[1] if current and current[0] == newest else 0
+
+
+def make_etag(*parts):
+    """Short opaque validator for the given values"""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+
+def not_modified(request, etag):
+    """A 304 response if the request's If-None-Match matches etag, else None"""
+    if etag is None or not request.if_none_match.contains_weak(etag):
+        return None
+    return set_validator(Response(status=304), etag)
+
+
+def set_validator(response, etag):
+    """Attach etag; private because the data belongs to the session's device"""
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    # Cache, but ask the server every time (answered with 304 when unchanged)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def choose_encoding(accept_encodings):
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress_response(response, accept_encodings, min_bytes=COMPRESS_MIN_BYTES):
+    """Compress a buffered JSON/text response in place when it is large enough"""
+    if (not min_bytes or response.status_code != 200 or response.direct_passthrough
+            or response.is_streamed or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    data = response.get_data()
+    if len(data) < min_bytes:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+    if encoding == "br":
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0))
+    response.headers["Content-Encoding"] = encoding
+    # A strong ETag names exact bytes, and these are no longer the original bytes
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+class StaticHashes:
+    """Content hash per static file, recomputed when the file's mtime changes"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._hashes = {}  # filename -> (mtime_ns, hash)
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        path = safe_join(self.folder, filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        cached = self._hashes.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, "rb") as f:
+            digest = hashlib.md5(f.read()).hexdigest()[:12]
+        with self._lock:
+            self._hashes[filename] = (mtime, digest)
+        return digest
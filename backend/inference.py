@@ -0,0 +1,300 @@
+import os
+import warnings
+
+import numpy as np
+
+from logs import get_logger
+from metrics import UNKNOWN_CATEGORIES
+
+# sklearn forests default to n_jobs=None, but a pickled model may carry n_jobs=-1
+# from training. Each gunicorn worker is already one process, so spinning up a
+# thread pool per request only adds latency to single-row predictions.
+MODEL_N_JOBS = int(os.environ.get("MODEL_N_JOBS", 1))
+# Models ("crop", "fertilizer") evaluated by FlatForest instead of sklearn's predict_proba
+FLAT_FOREST_MODELS = {name.strip() for name in os.environ.get("FLAT_FOREST_MODELS", "crop,fertilizer").split(",")
+                      if name.strip()}
+# Larger batches go to sklearn, whose compiled per-tree traversal wins once the
+# per-call overhead is spread over enough rows
+FLAT_FOREST_MAX_ROWS = int(os.environ.get("FLAT_FOREST_MAX_ROWS", 1000))
+# Random rows compared against sklearn when a forest is compiled
+FLAT_FOREST_PROBE_ROWS = 256
+# Rows walked together; keeps the (rows x trees) working set in cache
+FLAT_FOREST_CHUNK_ROWS = 256
+
+log = get_logger("inference")
+
+# The fertilizer model was fitted on a DataFrame, but FertilizerEncoder hands it
+# arrays already in its column order, so sklearn's warning about unnamed input
+# is noise. Installed once for the process: catch_warnings() around each call
+# swaps global state and is not safe with several request threads.
+warnings.filterwarnings("ignore", message="X does not have valid feature names", category=UserWarning)
+
+
+def pin_n_jobs(model, n_jobs=MODEL_N_JOBS):
+    """Set n_jobs on a loaded sklearn estimator, if it has one"""
+    if model is not None and hasattr(model, "n_jobs"):
+        model.n_jobs = n_jobs
+    return model
+
+
+class FlatForest:
+    """
+    A fitted RandomForestClassifier compiled into flat NumPy arrays, evaluated for
+    all rows and all trees at once without sklearn's per-call validation, joblib
+    dispatch and per-tree Python calls.
+
+    Nodes of every tree share one set of arrays: feature, threshold, children and
+    the leaf class fractions. Nodes are renumbered level by level so a node's two
+    children are adjacent: the next node is children[node] + (x > threshold).
+    Leaves point at themselves with an infinite threshold, so every (row, tree)
+    pair can take the same number of steps. Pairs that reached a leaf are dropped
+    from the working set every few steps.
+
+    predict_proba matches sklearn's bit for bit: inputs are rounded to float32
+    as sklearn does, each tree's leaf fractions are summed in estimator order
+    from zero, and the sum is divided by the number of trees.
+    """
+
+    def __init__(self, feature, threshold, children, values, roots, depth, classes):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.values = values
+        self.roots = roots
+        self.depth = depth
+        self.classes_ = classes
+        self.internal = np.isfinite(threshold)
+
+    @classmethod
+    def from_forest(cls, model):
+        """Compile a fitted single-output forest classifier"""
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        n_classes = len(model.classes_)
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+        left = np.concatenate([np.where(tree.children_left >= 0, tree.children_left + offset, -1)
+                               for tree, offset in zip(trees, offsets)])
+        right = np.concatenate([np.where(tree.children_right >= 0, tree.children_right + offset, -1)
+                                for tree, offset in zip(trees, offsets)])
+        old_feature = np.concatenate([tree.feature for tree in trees])
+        old_threshold = np.concatenate([tree.threshold for tree in trees])
+        old_values = np.concatenate([tree.value[:, 0, :n_classes] for tree in trees])
+
+        # Breadth-first renumbering: roots are 0..T-1, then each level's children in pairs
+        total = int(offsets[-1])
+        new_to_old = np.empty(total, dtype=np.intp)
+        first_child = np.empty(total, dtype=np.intp)
+        frontier = offsets[:-1].astype(np.intp)
+        frontier_new = np.arange(len(trees), dtype=np.intp)
+        new_to_old[frontier_new] = frontier
+        next_id = len(trees)
+        depth = 0
+        while len(frontier):
+            internal = left[frontier] >= 0
+            leaves = frontier_new[~internal]
+            first_child[leaves] = leaves
+            parents = frontier[internal]
+            if not len(parents):
+                break
+            pairs = next_id + 2 * np.arange(len(parents), dtype=np.intp)
+            first_child[frontier_new[internal]] = pairs
+            frontier = np.column_stack([left[parents], right[parents]]).ravel()
+            frontier_new = np.column_stack([pairs, pairs + 1]).ravel()
+            new_to_old[frontier_new] = frontier
+            next_id += 2 * len(parents)
+            depth += 1
+
+        is_leaf = left[new_to_old] < 0
+        feature = np.where(is_leaf, 0, old_feature[new_to_old]).astype(np.intp)
+        threshold = np.where(is_leaf, np.inf, old_threshold[new_to_old])
+        values = np.ascontiguousarray(old_values[new_to_old], dtype=np.float64)
+        return cls(feature, threshold, first_child, values, np.arange(len(trees), dtype=np.intp),
+                   depth, model.classes_)
+
+    def leaves(self, X):
+        """(n_rows, n_trees) leaf node of every tree for every row of a float64 array"""
+        n_rows, n_features = X.shape
+        n_trees = len(self.roots)
+        flat_X = X.ravel()
+        node = np.tile(self.roots, n_rows)
+        row_base = np.repeat(np.arange(n_rows, dtype=np.intp) * n_features, n_trees)
+        position = None  # index into the result of each pair still walking, once compacted
+        result = node
+        for step in range(1, self.depth + 1):
+            node = self.children[node] + (flat_X[row_base + self.feature[node]] > self.threshold[node])
+            if step % 8 == 0 and step < self.depth:
+                walking = self.internal[node]
+                if position is None:
+                    result = node.copy()
+                    position = np.arange(len(node), dtype=np.intp)
+                else:
+                    result[position] = node
+                if not walking.any():
+                    return result.reshape(n_rows, n_trees)
+                if not walking.all():
+                    keep = np.flatnonzero(walking)
+                    node, row_base, position = node[keep], row_base[keep], position[keep]
+        if position is None:
+            result = node
+        else:
+            result[position] = node
+        return result.reshape(n_rows, n_trees)
+
+    def predict_proba(self, X):
+        # sklearn validates X to float32 and compares it with float64 thresholds
+        X = np.atleast_2d(np.asarray(X, dtype=np.float32)).astype(np.float64)
+        proba = np.empty((len(X), len(self.classes_)), dtype=np.float64)
+        for start in range(0, len(X), FLAT_FOREST_CHUNK_ROWS):
+            chunk = X[start:start + FLAT_FOREST_CHUNK_ROWS]
+            fractions = self.values[self.leaves(chunk).T]  # (n_trees, n_rows, n_classes)
+            # Reducing the leading axis adds tree by tree, like sklearn's accumulation
+            np.add.reduce(fractions, axis=0, out=proba[start:start + len(chunk)])
+        proba /= len(self.roots)
+        return proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+
+class ForestPredictor:
+    """
+    predict/predict_proba for a forest classifier, through its FlatForest when
+    the model is listed in FLAT_FOREST_MODELS and the batch is at most
+    FLAT_FOREST_MAX_ROWS rows; sklearn otherwise, and for non-finite inputs.
+    """
+
+    def __init__(self, model, name, enabled=None, max_rows=FLAT_FOREST_MAX_ROWS):
+        self.model = model
+        self.name = name
+        self.classes_ = getattr(model, "classes_", None)
+        self.max_rows = max_rows
+        self.flat = None
+        if enabled is None:
+            enabled = name in FLAT_FOREST_MODELS
+        if enabled and hasattr(model, "estimators_") and hasattr(model, "predict_proba"):
+            try:
+                self.flat = self._compile()
+            except Exception as e:
+                log.warning("Could not compile forest, using sklearn", model=name, error=str(e))
+
+    def _compile(self):
+        flat = FlatForest.from_forest(self.model)
+        # Refuse to serve anything sklearn would not have returned: random rows
+        # spanning each feature's split thresholds, plus a margin on both sides
+        n_features = self.model.n_features_in_
+        low, high = np.zeros(n_features), np.ones(n_features)
+        for j in range(n_features):
+            splits = flat.threshold[flat.internal & (flat.feature == j)]
+            if len(splits):
+                margin = max(1.0, splits.max() - splits.min()) * 0.1
+                low[j], high[j] = splits.min() - margin, splits.max() + margin
+        probe = np.random.default_rng(0).uniform(low, high, (FLAT_FOREST_PROBE_ROWS, n_features))
+        if not np.array_equal(flat.predict_proba(probe), self.model.predict_proba(probe)):
+            raise ValueError("compiled forest does not match predict_proba")
+        log.info("Compiled forest", model=self.name, nodes=len(flat.threshold), depth=flat.depth)
+        return flat
+
+    @property
+    def compiled(self):
+        return self.flat is not None
+
+    def _use_flat(self, features):
+        return self.flat is not None and len(features) <= self.max_rows and np.isfinite(features).all()
+
+    def predict_proba(self, features):
+        features = np.atleast_2d(np.asarray(features, dtype=float))
+        if self._use_flat(features):
+            return self.flat.predict_proba(features)
+        return self.model.predict_proba(features)
+
+    def predict(self, features):
+        features = np.atleast_2d(np.asarray(features, dtype=float))
+        if self._use_flat(features):
+            return self.flat.predict(features)
+        return self.model.predict(features)
+
+
+class CropInference:
+    """
+    Wrapper around the crop model that walks the forest once per call:
+    the label, the confidence and the top-k crops all come from predict_proba.
+    """
+
+    def __init__(self, model):
+        self.model = pin_n_jobs(model)
+        self.has_proba = hasattr(model, "predict_proba")
+        self.forest = ForestPredictor(self.model, "crop")
+
+    def predict(self, features, top_k=0):
+        """
+        Predict crops for an (n, 7) array of inputs.
+        Returns (labels, confidences, top) where confidences are percentages and
+        top is a list of [(crop, probability %), ...] per row (empty when top_k is 0).
+        top_k may be one int for all rows or a list with one value per row.
+        """
+        features = np.atleast_2d(np.asarray(features, dtype=float))
+        if not self.has_proba:
+            labels = self.model.predict(features)
+            return labels, np.full(len(features), 85), [[] for _ in range(len(features))]
+
+        proba = self.forest.predict_proba(features)
+        # Same as RandomForestClassifier.predict(): classes_ at the argmax
+        best = np.argmax(proba, axis=1)
+        labels = self.model.classes_.take(best, axis=0)
+        confidences = proba[np.arange(len(proba)), best] * 100
+
+        top_ks = top_k if isinstance(top_k, (list, tuple)) else [top_k] * len(features)
+        top = [[] for _ in range(len(features))]
+        max_k = min(max(top_ks, default=0), proba.shape[1])
+        if max_k > 0:
+            # Stable sort so ties keep class order, like argmax
+            order = np.argsort(-proba, axis=1, kind="stable")[:, :max_k]
+            for i, k in enumerate(top_ks):
+                top[i] = [(self.model.classes_[j], round(proba[i, j] * 100, 2)) for j in order[i, :k]]
+        return labels, confidences, top
+
+
+# Column order of fertilizer-data.csv, used when the model does not record its own
+FERTILIZER_COLUMNS = ['Temperature', 'Humidity', 'Moisture', 'Soil', 'Crop', 'Nitrogen', 'Potassium', 'Phosphorus']
+
+
+class FertilizerEncoder:
+    """
+    The fertilizer model's LabelEncoders compiled into plain dict lookups.
+    Builds feature rows directly as a NumPy array in the model's column order,
+    so no DataFrame or encoder.transform call is needed per request.
+    """
+
+    def __init__(self, model, label_encoders):
+        # Rows are built as arrays in exactly this order (the model is left untouched)
+        self.columns = list(getattr(model, "feature_names_in_", FERTILIZER_COLUMNS))
+        self.lookups = {
+            col: {category: code for code, category in enumerate(encoder.classes_)}
+            for col, encoder in label_encoders.items() if col in self.columns
+        }
+        # Unknown categories fall back to code 0 (the first class) and are counted here,
+        # in /api/status, and in UNKNOWN_CATEGORIES for /metrics
+        self.unknown_counts = {col: 0 for col in self.lookups}
+
+    def encode_value(self, col, value):
+        """Encoded value for one categorical column, falling back to 0 if unknown"""
+        try:
+            code = self.lookups[col].get(value)
+        except TypeError:
+            code = None
+        if code is None:
+            self.unknown_counts[col] += 1
+            UNKNOWN_CATEGORIES.inc(column=col)
+            log.warning("Unknown category, using default", column=col)
+            return 0
+        return code
+
+    def encode(self, rows):
+        """Encode a list of input dicts (column -> raw value) into an (n, columns) array"""
+        features = np.empty((len(rows), len(self.columns)), dtype=float)
+        for i, row in enumerate(rows):
+            for j, col in enumerate(self.columns):
+                if col in self.lookups:
+                    features[i, j] = self.encode_value(col, row[col])
+                else:
+                    features[i, j] = row[col]
+        return features
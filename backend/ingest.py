@@ -0,0 +1,183 @@
+"""
+Background batch writer for sensor readings.
+
+With ESP32_INGEST_MODE=queued, /api/esp32 puts each validated reading on a
+bounded in-process queue instead of inserting it directly. A writer thread
+flushes the queue with insert_many when INGEST_BATCH_SIZE readings are waiting,
+or every INGEST_FLUSH_INTERVAL seconds, whichever comes first.
+"""
+import csv
+import io
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from logs import get_logger
+
+ESP32_INGEST_MODE = os.environ.get("ESP32_INGEST_MODE", "sync")
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 10000))
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 500))
+INGEST_FLUSH_INTERVAL = float(os.environ.get("INGEST_FLUSH_INTERVAL", 1.0))
+# Upper bound on the number of readings accepted by /api/esp32/batch
+MAX_BATCH_READINGS = int(os.environ.get("MAX_BATCH_READINGS", 5000))
+
+log = get_logger("ingest")
+
+
+class IngestQueueFull(Exception):
+    """Raised when the write queue is full; the client should retry later"""
+
+
+class BatchWriter:
+    """Queue of documents written to a collection in batches by a daemon thread"""
+
+    def __init__(self, collection, max_queue=INGEST_QUEUE_SIZE, batch_size=INGEST_BATCH_SIZE,
+                 flush_interval=INGEST_FLUSH_INTERVAL):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = {"accepted": 0, "rejected": 0, "written": 0, "failed": 0, "batches": 0}
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        """Start the writer thread in this process (again after a fork)"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._stopping.clear()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="sensor-batch-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, doc):
+        """Queue a document for writing; raises IngestQueueFull instead of blocking"""
+        self.ensure_started()
+        try:
+            self.queue.put_nowait(doc)
+        except queue.Full:
+            self.stats["rejected"] += 1
+            raise IngestQueueFull()
+        self.stats["accepted"] += 1
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def _take_batch(self, wait=True):
+        """
+        Collect the next batch: wait for a first document, then keep collecting
+        until batch_size is reached or flush_interval has passed since it arrived.
+        With wait=False, only take what is already queued.
+        """
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=self.flush_interval) if wait else self.queue.get_nowait())
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if wait and remaining > 0 and not self._stopping.is_set():
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            # Unordered, so one bad document does not stop the rest of the batch
+            self.collection.insert_many(batch, ordered=False)
+            self.stats["written"] += len(batch)
+        except Exception as e:
+            written = (getattr(e, "details", None) or {}).get("nInserted", 0)
+            self.stats["written"] += written
+            self.stats["failed"] += len(batch) - written
+            log.error("Error writing sensor batch", size=len(batch), error=str(e))
+        self.stats["batches"] += 1
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+        # Drain whatever is left on shutdown
+        self.flush()
+
+    def flush(self):
+        """Write everything currently queued, in batches, on the calling thread"""
+        while True:
+            batch = self._take_batch(wait=False)
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self, timeout=10):
+        """Stop the writer thread after it has flushed the queue"""
+        self._stopping.set()
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+
+def parse_device_timestamp(value):
+    """
+    Turn a device timestamp into a naive local datetime, like datetime.now().
+    Accepts epoch seconds (or milliseconds) and ISO 8601 strings; None means now.
+    Raises ValueError for anything else, including times out of datetime's range.
+    """
+    if value is None or value == "":
+        return datetime.now()
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone().replace(tzinfo=None)
+            return parsed
+    value = float(value)
+    if value > 1e11:
+        # Milliseconds since the epoch
+        value /= 1000
+    try:
+        return datetime.fromtimestamp(value)
+    except (OverflowError, OSError):
+        # OSError from the platform's localtime() for years it cannot represent
+        raise ValueError(f"Timestamp out of range: {value}")
+
+
+def decode_readings(payload=None, csv_text=None):
+    """
+    Readings from a /api/esp32/batch body, as a list of dicts.
+
+    - {"readings": [{...}, ...]}: one object per reading
+    - {"columns": {"temperature": [...], "ph": [...], ...}}: parallel arrays
+    - csv_text: a header line of field names, then one reading per line
+    Empty values are dropped so that defaults apply.
+    """
+    if csv_text is not None:
+        reader = csv.DictReader(io.StringIO(csv_text))
+        return [{k.strip(): v.strip() for k, v in row.items() if k and v not in (None, "")} for row in reader]
+    if "columns" in payload:
+        columns = payload["columns"]
+        if not isinstance(columns, dict):
+            raise ValueError("'columns' must be an object of parallel arrays")
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("All columns must have the same length")
+        count = lengths.pop() if lengths else 0
+        return [{field: values[i] for field, values in columns.items() if values[i] is not None}
+                for i in range(count)]
+    readings = payload.get("readings")
+    if not isinstance(readings, list):
+        raise ValueError("Expected 'readings' or 'columns'")
+    return readings
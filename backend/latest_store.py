@@ -0,0 +1,255 @@
+"""
+Latest sensor reading per device, shared by all gunicorn workers.
+
+LATEST_STORE_BACKEND picks the backend:
+    memory  - a dict in this process (single-worker setups and tests)
+    shm     - a fixed-size hash table in a memory-mapped file (LATEST_STORE_PATH),
+              shared by every worker on the host, sized for LATEST_STORE_DEVICES
+              devices at no more than LATEST_STORE_MAX_LOAD of its slots
+    redis   - any Redis-compatible server (LATEST_STORE_URL), needs the redis package
+
+All backends store readings as {field: float, ..., "timestamp": datetime} and only
+replace a device's reading with a newer one.
+"""
+import fcntl
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from logs import get_logger
+
+LATEST_STORE_BACKEND = os.environ.get("LATEST_STORE_BACKEND", "shm")
+# Devices the shm table must hold; devices beyond that are not stored (and logged)
+LATEST_STORE_DEVICES = int(os.environ.get("LATEST_STORE_DEVICES", 10000))
+# Highest fraction of slots in use, which keeps linear probe sequences short
+LATEST_STORE_MAX_LOAD = float(os.environ.get("LATEST_STORE_MAX_LOAD", 0.5))
+LATEST_STORE_SLOTS = math.ceil(LATEST_STORE_DEVICES / LATEST_STORE_MAX_LOAD)
+# All workers must agree on the slot count, so it is part of the default file name
+LATEST_STORE_PATH = os.environ.get(
+    "LATEST_STORE_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+                 f"terradetect-latest-{LATEST_STORE_SLOTS}"))
+LATEST_STORE_URL = os.environ.get("LATEST_STORE_URL", "redis://localhost:6379/0")
+
+READING_FIELDS = ["temperature", "ph", "humidity", "ec", "N", "P", "K", "moisture"]
+
+log = get_logger("latest_store")
+
+
+def _is_newer(reading, current):
+    return current is None or current.get("timestamp") is None or reading["timestamp"] >= current["timestamp"]
+
+
+class MemoryLatestStore:
+    """Per-process dict; other workers do not see these readings"""
+
+    def __init__(self):
+        self._readings = {}
+        self._lock = threading.Lock()
+
+    def get(self, device_id):
+        reading = self._readings.get(device_id)
+        return dict(reading) if reading else None
+
+    def update(self, device_id, reading):
+        with self._lock:
+            if _is_newer(reading, self._readings.get(device_id)):
+                self._readings[device_id] = dict(reading)
+                return True
+        return False
+
+
+class SharedMemoryLatestStore:
+    """
+    Open-addressing hash table in a shared memory-mapped file.
+
+    The file starts with the number of slots in use (uint64, padded to
+    TABLE_HEADER_SIZE bytes), followed by the slots. Slot layout: device_id
+    (32 bytes, utf-8, NUL padded), sequence number (uint64), timestamp (float64
+    epoch seconds), then one float64 per READING_FIELDS entry. Writers take an
+    flock on the file and bump the sequence number to odd while writing; readers
+    retry until they see the same even number before and after.
+
+    Slots are never freed. Once max_load of them are in use, readings of devices
+    not in the table yet are refused: update() returns False (callers fall back
+    to Mongo for those devices) and an error is logged.
+    """
+
+    KEY_SIZE = 32
+    TABLE_HEADER_SIZE = 64
+    USED = struct.Struct("<Q")
+    HEADER = struct.Struct("<32sQ")
+    VALUES = struct.Struct("<d" + "d" * len(READING_FIELDS))
+    SLOT_SIZE = HEADER.size + VALUES.size
+    # Seconds between "table full" errors
+    FULL_LOG_INTERVAL = 60
+
+    def __init__(self, path=LATEST_STORE_PATH, slots=LATEST_STORE_SLOTS, max_load=LATEST_STORE_MAX_LOAD):
+        self.path = path
+        self.slots = slots
+        self.capacity = max(1, min(int(slots * max_load), slots - 1))
+        self.refused = 0
+        self._logged_full_at = None
+        self._pid = None
+        self._file = None
+        self._map = None
+
+    def _ensure_open(self):
+        # Reopen after fork: flock is per open file, so workers need their own
+        if self._pid == os.getpid():
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._file = os.fdopen(fd, "r+b")
+        size = self.TABLE_HEADER_SIZE + self.slots * self.SLOT_SIZE
+        if os.fstat(fd).st_size < size:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self._pid = os.getpid()
+
+    def _key(self, device_id):
+        key = str(device_id).encode()
+        return key if len(key) <= self.KEY_SIZE else None
+
+    def _probe(self, key):
+        """Yield slot offsets to try for key, starting at its hash position"""
+        start = zlib.crc32(key) % self.slots
+        for i in range(self.slots):
+            yield self.TABLE_HEADER_SIZE + ((start + i) % self.slots) * self.SLOT_SIZE
+
+    def _read_slot(self, offset):
+        """Consistent (key, seq, values) snapshot of one slot"""
+        for _ in range(1000):
+            key, seq = self.HEADER.unpack_from(self._map, offset)
+            values = self.VALUES.unpack_from(self._map, offset + self.HEADER.size)
+            if seq % 2 == 0 and self.HEADER.unpack_from(self._map, offset)[1] == seq:
+                break
+        # After too many retries the writer died mid-write; the next write repairs the slot
+        return key.rstrip(b"\0"), seq - seq % 2, values
+
+    def get(self, device_id):
+        key = self._key(device_id)
+        if key is None:
+            return None
+        self._ensure_open()
+        for offset in self._probe(key):
+            slot_key, seq, values = self._read_slot(offset)
+            if not slot_key:
+                return None
+            if slot_key == key:
+                reading = dict(zip(READING_FIELDS, values[1:]))
+                reading["timestamp"] = datetime.fromtimestamp(values[0])
+                return reading
+        return None
+
+    def update(self, device_id, reading):
+        key = self._key(device_id)
+        if key is None:
+            return False
+        self._ensure_open()
+        fd = self._file.fileno()
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            for offset in self._probe(key):
+                slot_key, seq, values = self._read_slot(offset)
+                if slot_key and slot_key != key:
+                    continue
+                timestamp = reading["timestamp"].timestamp()
+                if slot_key and values[0] > timestamp:
+                    return False
+                if not slot_key:
+                    used = self.USED.unpack_from(self._map, 0)[0]
+                    if used >= self.capacity:
+                        self._refuse(device_id)
+                        return False
+                    self.USED.pack_into(self._map, 0, used + 1)
+                self.HEADER.pack_into(self._map, offset, key, seq + 1)
+                self.VALUES.pack_into(self._map, offset + self.HEADER.size, timestamp,
+                                      *[float(reading.get(field, 0) or 0) for field in READING_FIELDS])
+                self.HEADER.pack_into(self._map, offset, key, seq + 2)
+                return True
+            return False
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _refuse(self, device_id):
+        self.refused += 1
+        now = time.monotonic()
+        if self._logged_full_at is None or now - self._logged_full_at >= self.FULL_LOG_INTERVAL:
+            self._logged_full_at = now
+            log.error("Latest-reading table full, device not stored; raise LATEST_STORE_DEVICES",
+                      device_id=device_id, capacity=self.capacity, slots=self.slots, path=self.path,
+                      refused=self.refused)
+
+    def used(self):
+        """Slots in use, by every process sharing the file"""
+        self._ensure_open()
+        return self.USED.unpack_from(self._map, 0)[0]
+
+
+class RedisLatestStore:
+    """
+    Readings as JSON strings under latest:<device_id> in a Redis-compatible server.
+
+    update() compares timestamps and sets the key in a WATCH/MULTI transaction,
+    so an older reading from another worker can never overwrite a newer one.
+    """
+
+    def __init__(self, client, prefix="latest:"):
+        # A redis-py client, or anything with the same get() and pipeline() API
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url=LATEST_STORE_URL):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    @staticmethod
+    def _decode(raw):
+        if raw is None:
+            return None
+        reading = json.loads(raw)
+        reading["timestamp"] = datetime.fromisoformat(reading["timestamp"])
+        return reading
+
+    def get(self, device_id):
+        return self._decode(self.client.get(self.prefix + str(device_id)))
+
+    def update(self, device_id, reading):
+        from redis import WatchError
+
+        key = self.prefix + str(device_id)
+        value = json.dumps(dict(reading, timestamp=reading["timestamp"].isoformat()))
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    if not _is_newer(reading, self._decode(pipe.get(key))):
+                        return False
+                    pipe.multi()
+                    pipe.set(key, value)
+                    pipe.execute()
+                    return True
+                except WatchError:
+                    # Another worker wrote the key in between: compare again
+                    continue
+
+
+def create_latest_store(backend=LATEST_STORE_BACKEND):
+    if backend == "memory":
+        return MemoryLatestStore()
+    if backend == "redis":
+        return RedisLatestStore.from_url()
+    return SharedMemoryLatestStore()
@@ -0,0 +1,142 @@
+"""
+Leveled, rate-limited structured logging.
+
+    log = get_logger("ingest")
+    log.error("Sensor batch write failed", size=len(batch), error=str(e))
+
+Each record is one line on stdout: JSON by default (LOG_FORMAT=json), or
+"level logger message key=value ..." with LOG_FORMAT=text. Fields are only
+formatted when the level is enabled, so debug calls in request handlers cost
+one level check when LOG_LEVEL is INFO or higher.
+
+Every message is limited to LOG_RATE_LIMIT records per LOG_RATE_WINDOW seconds
+per process; the next record let through carries a "suppressed" count.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# 0 disables rate limiting
+LOG_RATE_LIMIT = int(os.environ.get("LOG_RATE_LIMIT", 20))
+LOG_RATE_WINDOW = float(os.environ.get("LOG_RATE_WINDOW", 10))
+
+ROOT_LOGGER = "terradetect"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = getattr(record, "fields", None) or {}
+        line = f"{record.levelname} {record.name} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class RateLimitFilter(logging.Filter):
+    """Let at most `limit` records per (logger, message) through per window"""
+
+    def __init__(self, limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._windows = {}  # (logger, msg) -> [window start, emitted, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.limit <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                if len(self._windows) > 10000:
+                    self._windows.clear()
+                self._windows[key] = [now, 1, 0]
+            elif state[1] < self.limit:
+                state[1] += 1
+                suppressed = 0
+            else:
+                state[2] += 1
+                return False
+        if suppressed:
+            record.fields = dict(getattr(record, "fields", None) or {}, suppressed=suppressed)
+        return True
+
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure():
+    """Attach the stdout handler to the "terradetect" logger (once)"""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+        handler.addFilter(RateLimitFilter())
+        root = logging.getLogger(ROOT_LOGGER)
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+        _configured = True
+
+
+class StructuredLogger:
+    """logging.Logger with keyword fields: log.info("message", key=value, ...)"""
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def enabled(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def _log(self, level, msg, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, msg, **fields):
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields)
+
+    def exception(self, msg, **fields):
+        """Error with the current exception's traceback"""
+        self._log(logging.ERROR, msg, fields, exc_info=True)
+
+
+def get_logger(name):
+    configure()
+    return StructuredLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
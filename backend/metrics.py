@@ -0,0 +1,209 @@
+"""
+In-process metrics in the Prometheus text format, served on /metrics.
+
+    REQUEST_SECONDS.observe(0.012, route="/predict", method="POST", status="200")
+    with time_block(INFERENCE_SECONDS, model="crop"):
+        ...
+
+Histograms and counters are kept per process: with several gunicorn workers,
+each scrape sees the worker that served it (the "pid" label tells them apart).
+Point-in-time values (queue depths, cache sizes) are read from callbacks at
+scrape time. METRICS_ENABLED=0 turns recording and the endpoint off.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+
+# Seconds; fine-grained at the low end for in-process timers
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        # Index of the first bucket the value fits in (len(buckets) is +Inf)
+        slot = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                slot = i
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[slot] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []  # (prefix, help, callback returning {name: number})
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix, help, callback):
+        """Expose each numeric value of callback() as the gauge <prefix>_<key>"""
+        self.collectors.append((prefix, help, callback))
+
+    def render(self):
+        pid = os.getpid()
+        lines = ["# HELP terradetect_process_info Worker process serving this scrape",
+                 "# TYPE terradetect_process_info gauge",
+                 f'terradetect_process_info{{pid="{pid}"}} 1']
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, help, callback in self.collectors:
+            try:
+                stats = callback()
+            except Exception as e:
+                stats = {}
+                lines.append(f"# {prefix}: collection failed: {e}")
+            for key, value in sorted(stats.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "terradetect_http_request_duration_seconds", "Time to produce a response, by route",
+    labels=("route", "method", "status"))
+REQUEST_ERRORS = registry.counter(
+    "terradetect_http_errors_total", "Responses with status >= 500, by route",
+    labels=("route", "status"))
+INFERENCE_SECONDS = registry.histogram(
+    "terradetect_model_inference_seconds", "Model calls, by model (one call may cover a batch)",
+    labels=("model",))
+SUITABILITY_SECONDS = registry.histogram(
+    "terradetect_suitability_seconds", "Suitability scoring, by kind", labels=("kind",))
+MONGO_SECONDS = registry.histogram(
+    "terradetect_mongo_command_seconds", "MongoDB commands as reported by the driver",
+    labels=("command",))
+MONGO_FAILURES = registry.counter(
+    "terradetect_mongo_command_failures_total", "MongoDB commands that failed", labels=("command",))
+JSON_SECONDS = registry.histogram(
+    "terradetect_json_serialization_seconds", "Encoding JSON response bodies")
+UNKNOWN_CATEGORIES = registry.counter(
+    "terradetect_fertilizer_unknown_categories_total",
+    "Fertilizer inputs with a category the model does not know (encoded as its first class), by column",
+    labels=("column",))
+LOG_RECORDS = registry.counter(
+    "terradetect_log_records_total", "Log records emitted, by level and logger (before rate limiting)",
+    labels=("level", "logger"))
+
+
+@contextmanager
+def time_block(histogram, **labels):
+    """Observe the wall time of the with-block"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Pass as MongoClient(event_listeners=[...]) to time every command"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+        MONGO_FAILURES.inc(command=event.command_name)
+
+
+class LogCounter(logging.Handler):
+    """Counts records per level; attach to the "terradetect" logger"""
+
+    def emit(self, record):
+        LOG_RECORDS.inc(level=record.levelname.lower(), logger=record.name)
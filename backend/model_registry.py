@@ -0,0 +1,250 @@
+"""
+Versioned model registry: reload the models without restarting gunicorn.
+
+A model set's version is a fingerprint (size and mtime) of the files it was loaded
+from. A reload loads a complete new set in a background thread, validates it on a
+fixed slice of crop-data.csv and fertilizer-data.csv, and only then swaps the
+registry's reference to it. Requests pin the set that was active when they
+started, so in-flight requests finish on the old version.
+
+Reloads are triggered by POST /api/admin/models/reload (this worker) or, with
+MODEL_WATCH_INTERVAL > 0, by every worker noticing the files changed. Each worker
+holds its own copy of a reloaded set: the copy-on-write sharing from the gunicorn
+master only covers the set loaded at startup.
+"""
+import hashlib
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from inference import FERTILIZER_COLUMNS
+from logs import get_logger
+from model_store import (ARTIFACTS, BASE_DIR, CROP_DATA_CSV, CROP_MODEL_PICKLE, FERTILIZER_MODEL_PICKLE,
+                         LazyModels, artifact_path)
+from suitability import CROP_FEATURES
+
+# Seconds between checks of the model files for changes; 0 turns the watch off
+MODEL_WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", 0))
+# Rows of each dataset a new model set is checked against
+MODEL_VALIDATION_ROWS = int(os.environ.get("MODEL_VALIDATION_ROWS", 500))
+# A new set is rejected below this accuracy, or this far below the active set
+MODEL_MIN_ACCURACY = float(os.environ.get("MODEL_MIN_ACCURACY", 0.5))
+MODEL_MAX_ACCURACY_DROP = float(os.environ.get("MODEL_MAX_ACCURACY_DROP", 0.05))
+
+FERTILIZER_DATA_CSV = os.path.join(BASE_DIR, "fertilizer-data.csv")
+
+log = get_logger("model_registry")
+
+# Files a model set is loaded from (the artifacts are used when present and current)
+MODEL_SOURCES = [CROP_MODEL_PICKLE, FERTILIZER_MODEL_PICKLE, CROP_DATA_CSV] + [
+    artifact_path(name) for name in ARTIFACTS]
+
+
+def source_fingerprint(paths=MODEL_SOURCES):
+    """Short version string that changes whenever one of the files is replaced"""
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            st = os.stat(path)
+            digest.update(f"{path}:{st.st_size}:{st.st_mtime_ns};".encode())
+        except OSError:
+            digest.update(f"{path}:missing;".encode())
+    return digest.hexdigest()[:12]
+
+
+def validation_slice(frame, rows=MODEL_VALIDATION_ROWS):
+    """Evenly spaced rows, so every label in a label-sorted file is represented"""
+    step = max(1, len(frame) // max(1, rows))
+    return frame.iloc[::step].head(rows)
+
+
+def validate_models(models, baseline=None):
+    """
+    Accuracy of a model set on the validation slices. Returns a report dict with
+    "ok", "errors" and per-model accuracies; baseline is the active set's report.
+    """
+    report = {"ok": True, "errors": []}
+    try:
+        if models.get('crop_inference') is None:
+            report["errors"].append("crop model did not load")
+        else:
+            crops = validation_slice(pd.read_csv(CROP_DATA_CSV))
+            labels, _, _ = models['crop_inference'].predict(crops[CROP_FEATURES].values.astype(float))
+            report["crop_accuracy"] = round(float(np.mean(np.asarray(labels) == crops["label"].values)), 4)
+
+        if models.get('fertilizer_model') is None or models.get('fertilizer_encoder') is None:
+            report["errors"].append("fertilizer model did not load")
+        else:
+            fertilizers = validation_slice(pd.read_csv(FERTILIZER_DATA_CSV))
+            features = models['fertilizer_encoder'].encode(fertilizers[FERTILIZER_COLUMNS].to_dict("records"))
+            # Through the compiled forest when it is enabled, so it is validated too
+            predictor = models.get('fertilizer_predictor') or models['fertilizer_model']
+            predicted = predictor.predict(features)
+            report["fertilizer_accuracy"] = round(float(np.mean(predicted == fertilizers["Fertilizer"].values)), 4)
+    except Exception as e:
+        report["errors"].append(f"validation failed: {e}")
+
+    for key in ("crop_accuracy", "fertilizer_accuracy"):
+        if key not in report:
+            continue
+        if report[key] < MODEL_MIN_ACCURACY:
+            report["errors"].append(f"{key} {report[key]} is below {MODEL_MIN_ACCURACY}")
+        elif baseline and baseline.get(key) is not None and report[key] < baseline[key] - MODEL_MAX_ACCURACY_DROP:
+            report["errors"].append(f"{key} {report[key]} is more than {MODEL_MAX_ACCURACY_DROP} "
+                                    f"below the active version's {baseline[key]}")
+    report["ok"] = not report["errors"]
+    return report
+
+
+class ModelRegistry:
+    """Holds the active model set and replaces it with validated new versions"""
+
+    def __init__(self, loader, validator=validate_models, sources=None, lazy=False,
+                 watch_interval=MODEL_WATCH_INTERVAL):
+        self.loader = loader
+        self.validator = validator
+        self.sources = sources or MODEL_SOURCES
+        self.watch_interval = watch_interval
+        self._swap_hooks = []
+        self._lock = threading.Lock()
+        self._reloading = None
+        self._watcher = None
+        self._watcher_pid = None
+        # Fingerprint of a set that failed validation; the watch does not retry it
+        self._rejected = None
+        self.history = deque(maxlen=20)
+        self.last_result = None
+        self._current = LazyModels(self._load) if lazy else self._load()
+
+    def _load(self):
+        version = source_fingerprint(self.sources)
+        models = self.loader()
+        models['version'] = version
+        models['loaded_at'] = datetime.now().isoformat()
+        return models
+
+    def current(self):
+        """The active model set; callers keep this reference for the whole request"""
+        return self._current
+
+    def on_swap(self, hook):
+        """Call hook(models) after a new set becomes active"""
+        self._swap_hooks.append(hook)
+
+    def reload(self, force=False, wait=False):
+        """
+        Start a background reload unless one is already running. Without force,
+        nothing is loaded if the files still match the active version.
+        Returns the result when wait is set, else {"status": "started" | "in_progress"}.
+        """
+        with self._lock:
+            if self._reloading is not None and self._reloading.is_alive():
+                started = False
+            else:
+                self._reloading = threading.Thread(target=self._reload, args=(force,),
+                                                   name="model-reload", daemon=True)
+                self._reloading.start()
+                started = True
+            thread = self._reloading
+        if wait:
+            thread.join()
+            return self.last_result
+        return {"status": "started" if started else "in_progress"}
+
+    def _reload(self, force=False):
+        current = self._current
+        version = source_fingerprint(self.sources)
+        result = {"version": version, "previous": current.get('version'), "at": datetime.now().isoformat()}
+        if not force and version == current.get('version'):
+            result["status"] = "unchanged"
+        else:
+            try:
+                models = self._load()
+                if 'validation' not in current:
+                    current['validation'] = self.validator(current)
+                report = self.validator(models, current['validation'])
+                models['validation'] = report
+                result["version"] = models['version']
+                result["validation"] = report
+                if report["ok"]:
+                    # Requests that already pinned the old set keep using it
+                    self._current = models
+                    self._rejected = None
+                    for hook in self._swap_hooks:
+                        hook(models)
+                    result["status"] = "swapped"
+                    log.info("Models reloaded", previous=result["previous"], version=models["version"])
+                else:
+                    self._rejected = models['version']
+                    result["status"] = "rejected"
+                    log.warning("Rejected model version", version=models["version"], errors=report["errors"])
+            except Exception as e:
+                result["status"] = "failed"
+                result["error"] = str(e)
+                log.exception("Error reloading models", error=str(e))
+        self.last_result = result
+        self.history.appendleft(result)
+        return result
+
+    def ensure_watching(self):
+        """Start the file watch in this process (again after a fork), if enabled"""
+        if self.watch_interval <= 0 or self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid != os.getpid():
+                self._watcher_pid = os.getpid()
+                self._watcher = threading.Thread(target=self._watch, name="model-watch", daemon=True)
+                self._watcher.start()
+
+    def _watch(self):
+        stop = threading.Event()
+        while not stop.wait(self.watch_interval):
+            version = source_fingerprint(self.sources)
+            if version != self._current.get('version') and version != self._rejected:
+                self.reload(wait=True)
+
+    def snapshot(self):
+        current = self._current
+        loaded = getattr(current, "loaded", True)
+        return {
+            "version": current.get('version') if loaded else None,
+            "loaded_at": current.get('loaded_at') if loaded else None,
+            "validation": current.get('validation') if loaded else None,
+            "watch_interval": self.watch_interval,
+            "history": list(self.history),
+        }
+
+
+class ModelsView:
+    """
+    Read-only dict view of the active model set. pinned() returns the set a
+    request started with (or None outside a request), so one request never mixes
+    versions even if a reload swaps the set while it runs.
+    """
+
+    def __init__(self, registry, pinned=lambda: None):
+        self.registry = registry
+        self.pinned = pinned
+
+    def _models(self):
+        models = self.pinned()
+        return models if models is not None else self.registry.current()
+
+    def __getitem__(self, key):
+        return self._models()[key]
+
+    def get(self, key, default=None):
+        return self._models().get(key, default)
+
+    def __contains__(self, key):
+        return key in self._models()
+
+    def ensure_loaded(self):
+        models = self.registry.current()
+        if hasattr(models, "ensure_loaded"):
+            models.ensure_loaded()
+        return self
@@ -0,0 +1,123 @@
+"""
+Model storage: the legacy pickles, or joblib artifacts whose NumPy arrays can be
+memory-mapped. Export the artifacts once after training:
+
+    python model_store.py export
+
+load_models() uses the artifacts when they exist and are not older than the
+pickles they were made from. Otherwise it falls back to the pickles.
+"""
+import os
+import pickle
+import sys
+import threading
+
+import joblib
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARTIFACT_DIR = os.environ.get("MODEL_ARTIFACT_DIR", os.path.join(BASE_DIR, "model-artifacts"))
+# "r" maps arrays read-only from the page cache; set MODEL_MMAP_MODE="" to read into memory
+MMAP_MODE = os.environ.get("MODEL_MMAP_MODE", "r") or None
+# Load models on first use instead of at import time
+LAZY_MODEL_LOADING = os.environ.get("LAZY_MODEL_LOADING", "0") == "1"
+
+CROP_MODEL_PICKLE = os.path.join(BASE_DIR, "crop-model.pkl")
+FERTILIZER_MODEL_PICKLE = os.path.join(BASE_DIR, "fertilizer-model.pkl")
+CROP_DATA_CSV = os.path.join(BASE_DIR, "crop-data.csv")
+
+# artifact name -> the source file it is exported from
+ARTIFACTS = {
+    "crop-model.joblib": CROP_MODEL_PICKLE,
+    "fertilizer-model.joblib": FERTILIZER_MODEL_PICKLE,
+    "crop-data.joblib": CROP_DATA_CSV,
+}
+
+
+def artifact_path(name, artifact_dir=None):
+    return os.path.join(artifact_dir or ARTIFACT_DIR, name)
+
+
+def use_artifact(name, artifact_dir=None):
+    """True if the artifact exists and is at least as new as its source file"""
+    path = artifact_path(name, artifact_dir)
+    if not os.path.exists(path):
+        return False
+    source = ARTIFACTS[name]
+    return not os.path.exists(source) or os.path.getmtime(path) >= os.path.getmtime(source)
+
+
+def _read_pickle(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def load_crop_model(artifact_dir=None):
+    if use_artifact("crop-model.joblib", artifact_dir):
+        return joblib.load(artifact_path("crop-model.joblib", artifact_dir), mmap_mode=MMAP_MODE)
+    return _read_pickle(CROP_MODEL_PICKLE)
+
+
+def load_fertilizer_bundle(artifact_dir=None):
+    """The dict stored in fertilizer-model.pkl (model, label_encoders, fertilizer_details, ...)"""
+    if use_artifact("fertilizer-model.joblib", artifact_dir):
+        return joblib.load(artifact_path("fertilizer-model.joblib", artifact_dir), mmap_mode=MMAP_MODE)
+    return _read_pickle(FERTILIZER_MODEL_PICKLE)
+
+
+def load_crop_data(artifact_dir=None):
+    if use_artifact("crop-data.joblib", artifact_dir):
+        columns = joblib.load(artifact_path("crop-data.joblib", artifact_dir), mmap_mode=MMAP_MODE)
+        return pd.DataFrame(columns)
+    return pd.read_csv(CROP_DATA_CSV)
+
+
+def export_artifacts(artifact_dir=None):
+    """Write joblib artifacts for the current pickles and crop-data.csv"""
+    artifact_dir = artifact_dir or ARTIFACT_DIR
+    os.makedirs(artifact_dir, exist_ok=True)
+    crop_data = pd.read_csv(CROP_DATA_CSV)
+    # Uncompressed, so the numeric arrays can be memory-mapped on load
+    joblib.dump(_read_pickle(CROP_MODEL_PICKLE), artifact_path("crop-model.joblib", artifact_dir))
+    joblib.dump(_read_pickle(FERTILIZER_MODEL_PICKLE), artifact_path("fertilizer-model.joblib", artifact_dir))
+    joblib.dump({col: crop_data[col].to_numpy() for col in crop_data.columns},
+                artifact_path("crop-data.joblib", artifact_dir))
+    return [artifact_path(name, artifact_dir) for name in ARTIFACTS]
+
+
+class LazyModels(dict):
+    """The models dict, filled by a loader on first access (thread-safe)"""
+
+    def __init__(self, loader):
+        super().__init__()
+        self._loader = loader
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    super().update(self._loader())
+                    self.loaded = True
+        return self
+
+    def __getitem__(self, key):
+        self.ensure_loaded()
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.ensure_loaded()
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self.ensure_loaded()
+        return super().__contains__(key)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["export"]:
+        print("usage: python model_store.py export")
+        sys.exit(1)
+    for path in export_artifacts():
+        print(f"Wrote {path}")
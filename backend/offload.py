@@ -0,0 +1,60 @@
+"""
+Bounded pool for CPU-bound work (model inference, password hashing) in async mode.
+
+With SERVER_MODE=async, gunicorn runs gevent workers: one event loop per worker
+serves many connections, and Mongo calls yield to other requests instead of
+blocking. A prediction or a password hash does not yield, so it would stall
+every connection on that worker. CpuPool.run sends such calls to a fixed set of
+OS threads and parks only the calling request until they finish. numpy,
+scikit-learn and hashlib release the GIL for most of that work.
+
+In sync mode (no gevent monkey-patching) run() calls the function inline, since
+each request already has a thread of its own.
+"""
+import contextvars
+import os
+import sys
+import threading
+
+# OS threads per worker process for offloaded calls; excess calls wait their turn
+CPU_POOL_SIZE = int(os.environ.get("CPU_POOL_SIZE", os.cpu_count() or 2))
+
+
+def cooperative():
+    """True when gevent has patched this process (gunicorn's gevent worker, or SERVER_MODE=async)"""
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("socket")
+
+
+class CpuPool:
+    def __init__(self, size=CPU_POOL_SIZE):
+        self.size = size
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.stats = {"offloaded": 0, "inline": 0}
+
+    def _get_pool(self):
+        # Threads do not survive a fork: each worker starts its own pool
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    from gevent.threadpool import ThreadPool
+                    self._pool = ThreadPool(self.size)
+                    self._pid = os.getpid()
+        return self._pool
+
+    def run(self, fn, *args, **kwargs):
+        """fn(*args, **kwargs), on the pool when running under gevent"""
+        if not cooperative():
+            self.stats["inline"] += 1
+            return fn(*args, **kwargs)
+        self.stats["offloaded"] += 1
+        # Carry the request's context (Flask's g, the pinned model set) into the pool thread
+        context = contextvars.copy_context()
+        return self._get_pool().apply(context.run, (fn,) + args, kwargs)
+
+    def snapshot(self):
+        pool = self._pool if self._pid == os.getpid() else None
+        return dict(self.stats, size=self.size, mode="async" if cooperative() else "sync",
+                    busy=len(pool) if pool is not None else 0)
@@ -0,0 +1,126 @@
+"""
+Bounded LRU cache of /predict results, keyed on the inputs.
+
+The models always run on the inputs as sent; only the cache key is built from
+key_values(). By default that is the exact values, so a cached response is
+identical to an uncached one. PREDICT_CACHE_PRECISION (e.g. "ph=2,rainfall=0")
+rounds the given fields in the key only, trading that exactness for hit rate:
+inputs that round the same share whichever result was computed first. Keys are
+the full (mode, model version, crop, soil, values...) tuples, never hashes of
+them, so inputs with different keys can never share a result.
+
+clear() is called when a new model version is swapped in; it drops the old
+version's entries and stops results still being computed on it from being stored.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+# 0 disables the cache
+PREDICT_CACHE_SIZE = int(os.environ.get("PREDICT_CACHE_SIZE", 4096))
+
+# Decimals per field in cache keys; fields not listed are keyed on their exact value
+DEFAULT_PRECISION = {}
+# Field order of the 7-parameter model input
+PARAMETER_FIELDS = ["N", "P", "K", "temperature", "humidity", "ph", "rainfall"]
+
+
+def parse_precision(value):
+    """"ph=1,rainfall=0" -> DEFAULT_PRECISION with those fields added or overridden"""
+    precision = dict(DEFAULT_PRECISION)
+    for part in (value or "").split(","):
+        if "=" in part:
+            field, digits = part.split("=", 1)
+            precision[field.strip()] = int(digits)
+    return precision
+
+
+PREDICT_CACHE_PRECISION = parse_precision(os.environ.get("PREDICT_CACHE_PRECISION"))
+
+
+class PredictionCache:
+    def __init__(self, max_size=PREDICT_CACHE_SIZE, precision=PREDICT_CACHE_PRECISION):
+        self.max_size = max_size
+        self.precision = precision
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def key_values(self, values, fields=PARAMETER_FIELDS):
+        """
+        Tuple of values (in fields order) for a cache key, rounded where a
+        precision is configured. Only for keys: never pass it to the models.
+        """
+        precision = self.precision
+        if not precision:
+            return tuple(values)
+        return tuple(round(float(value), precision[field]) if field in precision and value is not None else value
+                     for value, field in zip(values, fields))
+
+    def get_many(self, keys, compute):
+        """
+        Results for keys, in order. compute(indices) is called once with the
+        positions of all misses and must return their results in that order.
+        Results containing "error" are returned but not stored.
+        Cached results are shared between requests: treat them as read-only.
+        """
+        if not self.enabled:
+            return compute(list(range(len(keys))))
+        keys = list(keys)
+        results = [None] * len(keys)
+        missing = []
+        with self._lock:
+            generation = self.generation
+            for i, key in enumerate(keys):
+                try:
+                    result = self._entries.get(key)
+                except TypeError:
+                    # Unhashable input (e.g. a list sent as soil type): computed, never stored
+                    keys[i] = None
+                    result = None
+                if result is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    results[i] = result
+            self.stats["hits"] += len(keys) - len(missing)
+            self.stats["misses"] += len(missing)
+        if not missing:
+            return results
+        computed = compute(missing)
+        with self._lock:
+            for i, result in zip(missing, computed):
+                results[i] = result
+                # Skip results of models that were replaced while computing
+                if keys[i] is None or generation != self.generation or "error" in result:
+                    continue
+                self._entries[keys[i]] = result
+                self._entries.move_to_end(keys[i])
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return results
+
+    def get(self, key, compute):
+        """Single-key get_many(); compute() takes no arguments"""
+        return self.get_many([key], lambda missing: [compute()])[0]
+
+    def clear(self):
+        """Drop every entry, e.g. because the models were (re)loaded"""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+            self.stats["invalidations"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0.0
+        return dict(self.stats, size=size, max_size=self.max_size, generation=self.generation,
+                    hit_rate=round(hit_rate, 4))
@@ -0,0 +1,313 @@
+"""
+Per-device hourly and daily summaries of sensor readings.
+
+Each rollup document holds, for one device, resolution and bucket:
+    count, and per sensor field: sum, sumsq, min, max (and n, the readings that had it)
+so mean and standard deviation can be derived without touching raw readings.
+
+With ROLLUP_MODE=buffered (default), ingestion merges readings into in-process
+accumulators that a background thread flushes every ROLLUP_FLUSH_INTERVAL seconds
+as $inc/$min/$max upserts. Increments from several workers add up. ROLLUP_MODE=inline
+upserts on every reading, and ROLLUP_MODE=off disables rollups.
+
+Rebuild rollups from raw history:
+    python rollups.py backfill [--device ID] [--chunk 5000]
+
+A backfill owns every bucket before its cutoff (the start of the current day):
+it records the cutoff in the rollup_state collection, waits until every worker
+has seen it, then $sets those buckets from one scan of the readings before the
+cutoff. From then on the live path only applies readings at or after the cutoff,
+so no reading is counted by both. Readings that arrive later with timestamps
+before the cutoff are only counted by the next backfill.
+"""
+import argparse
+import math
+import os
+import threading
+import time
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from aggregates import SENSOR_FIELDS, bucket_start
+from logs import get_logger
+
+ROLLUP_MODE = os.environ.get("ROLLUP_MODE", "buffered")
+ROLLUP_FLUSH_INTERVAL = float(os.environ.get("ROLLUP_FLUSH_INTERVAL", 5))
+ROLLUP_RESOLUTIONS = ["hour", "day"]
+
+ROLLUP_INDEX = [("device_id", 1), ("resolution", 1), ("bucket", 1)]
+# Cutoff document for a backfill of all devices; per-device ones use the device_id
+ALL_DEVICES = "*"
+
+log = get_logger("rollups")
+
+
+class RollupCutoffs:
+    """
+    Backfill cutoffs from the rollup_state collection, {_id: device_id or "*", cutoff}.
+    Buckets before a device's cutoff belong to the backfill, not the live path.
+    """
+
+    def __init__(self, collection, ttl=ROLLUP_FLUSH_INTERVAL):
+        self.collection = collection
+        self.ttl = ttl
+        self._cutoffs = {}
+        self._loaded_at = None
+
+    def refresh(self, force=False):
+        """Reload the cutoffs (at most every ttl seconds unless forced); keeps the old ones on error"""
+        if not force and self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return self._cutoffs
+        try:
+            self._cutoffs = {doc["_id"]: doc["cutoff"] for doc in self.collection.find({}, {"cutoff": 1})}
+            self._loaded_at = time.monotonic()
+        except Exception as e:
+            log.error("Error loading rollup cutoffs", error=str(e))
+        return self._cutoffs
+
+    def get(self, device_id):
+        """Readings of device_id before this time are left to the backfill (None: no cutoff)"""
+        cutoffs = [self._cutoffs.get(ALL_DEVICES), self._cutoffs.get(device_id)]
+        cutoffs = [cutoff for cutoff in cutoffs if cutoff is not None]
+        return max(cutoffs) if cutoffs else None
+
+    def publish(self, device_id, cutoff):
+        """Record a backfill's cutoff; never moves an existing one back"""
+        self.collection.update_one({"_id": device_id or ALL_DEVICES}, {"$max": {"cutoff": cutoff}}, upsert=True)
+
+
+class RollupAccumulator:
+    """Pending rollup increments, keyed by (device_id, resolution, bucket)"""
+
+    def __init__(self, collection, flush_interval=ROLLUP_FLUSH_INTERVAL, cutoffs=None):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        # Backfill cutoffs; buckets before them are dropped at flush time
+        self.cutoffs = cutoffs
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.stats = {"readings": 0, "flushes": 0, "upserts": 0, "failed": 0, "backfill_skipped": 0}
+
+    def add(self, doc):
+        """Merge one sensor_data document into the pending summaries"""
+        with self._lock:
+            for resolution in ROLLUP_RESOLUTIONS:
+                key = (doc["device_id"], resolution, bucket_start(doc["timestamp"], resolution))
+                acc = self._pending.get(key)
+                if acc is None:
+                    acc = self._pending[key] = {"count": 0, "fields": {}}
+                acc["count"] += 1
+                for field in SENSOR_FIELDS:
+                    value = doc.get(field)
+                    if value is None:
+                        continue
+                    stats = acc["fields"].get(field)
+                    if stats is None:
+                        acc["fields"][field] = [1, value, value * value, value, value]
+                    else:
+                        stats[0] += 1
+                        stats[1] += value
+                        stats[2] += value * value
+                        if value < stats[3]:
+                            stats[3] = value
+                        if value > stats[4]:
+                            stats[4] = value
+            self.stats["readings"] += 1
+
+    def _take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    @staticmethod
+    def update_for(key, acc):
+        device_id, resolution, bucket = key
+        inc = {"count": acc["count"]}
+        mins = {}
+        maxs = {}
+        for field, (n, total, total_sq, low, high) in acc["fields"].items():
+            inc[f"n.{field}"] = n
+            inc[f"sum.{field}"] = total
+            inc[f"sumsq.{field}"] = total_sq
+            mins[f"min.{field}"] = low
+            maxs[f"max.{field}"] = high
+        update = {"$inc": inc}
+        if mins:
+            update["$min"] = mins
+            update["$max"] = maxs
+        return UpdateOne({"device_id": device_id, "resolution": resolution, "bucket": bucket}, update, upsert=True)
+
+    def _drop_backfilled(self, pending, force):
+        """Leave out buckets before their device's backfill cutoff (cutoffs are day-aligned)"""
+        self.cutoffs.refresh(force)
+        kept = {}
+        for key, acc in pending.items():
+            cutoff = self.cutoffs.get(key[0])
+            if cutoff is not None and key[2] < cutoff:
+                # Already in sensor_data, so the backfill's scan counts these readings
+                self.stats["backfill_skipped"] += 1
+                continue
+            kept[key] = acc
+        return kept
+
+    def flush(self, refresh_cutoffs=True):
+        """Write all pending increments with one unordered bulk_write"""
+        pending = self._take_pending()
+        if pending and self.cutoffs is not None:
+            pending = self._drop_backfilled(pending, refresh_cutoffs)
+        if not pending:
+            return 0
+        try:
+            self.collection.bulk_write([self.update_for(key, acc) for key, acc in pending.items()], ordered=False)
+            self.stats["upserts"] += len(pending)
+        except Exception as e:
+            self.stats["failed"] += len(pending)
+            log.error("Error flushing rollups", count=len(pending), error=str(e))
+        self.stats["flushes"] += 1
+        return len(pending)
+
+    def ensure_started(self):
+        """Start the periodic flush thread in this process (again after a fork)"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._stopping.clear()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="rollup-flusher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+
+class Rollups:
+    """Ingestion hook and read path for the rollup collection"""
+
+    def __init__(self, collection, state_collection, mode=ROLLUP_MODE):
+        self.collection = collection
+        self.mode = mode
+        self.cutoffs = RollupCutoffs(state_collection)
+        self.accumulator = RollupAccumulator(collection, cutoffs=self.cutoffs)
+
+    def record(self, docs):
+        """Account for newly ingested sensor_data documents"""
+        if self.mode == "off":
+            return
+        if self.mode == "inline":
+            acc = RollupAccumulator(self.collection, cutoffs=self.cutoffs)
+            for doc in docs:
+                acc.add(doc)
+            # Cutoffs reloaded at most every ROLLUP_FLUSH_INTERVAL, not per request
+            acc.flush(refresh_cutoffs=False)
+            return
+        self.accumulator.ensure_started()
+        for doc in docs:
+            self.accumulator.add(doc)
+
+    def stop(self):
+        self.accumulator.stop()
+
+    def buckets(self, device_id, start, end, resolution, fields):
+        """Rows like aggregates.aggregate_buckets(), read from the rollup documents"""
+        projection = {"_id": 0, "bucket": 1, "count": 1}
+        for part in ("n", "sum", "sumsq", "min", "max"):
+            for field in fields:
+                projection[f"{part}.{field}"] = 1
+        cursor = self.collection.find(
+            {"device_id": device_id, "resolution": resolution,
+             "bucket": {"$gte": bucket_start(start, resolution), "$lt": end}},
+            projection, sort=[("bucket", 1)])
+        rows = []
+        for doc in cursor:
+            row = {"timestamp": doc["bucket"], "count": doc["count"], "std": {}}
+            for field in fields:
+                n = doc.get("n", {}).get(field)
+                if not n:
+                    row[field] = (None, None, None)
+                    row["std"][field] = None
+                    continue
+                mean = doc["sum"][field] / n
+                row[field] = (doc["min"][field], mean, doc["max"][field])
+                row["std"][field] = math.sqrt(max(0.0, doc["sumsq"][field] / n - mean * mean))
+            rows.append(row)
+        return rows
+
+
+def set_for(key, acc, run):
+    """Upsert replacing a rollup document's summaries with acc (a backfill's own count)"""
+    device_id, resolution, bucket = key
+    fields = {"count": acc["count"], "backfill": run, "n": {}, "sum": {}, "sumsq": {}, "min": {}, "max": {}}
+    for field, (n, total, total_sq, low, high) in acc["fields"].items():
+        fields["n"][field] = n
+        fields["sum"][field] = total
+        fields["sumsq"][field] = total_sq
+        fields["min"][field] = low
+        fields["max"][field] = high
+    return UpdateOne({"device_id": device_id, "resolution": resolution, "bucket": bucket},
+                     {"$set": fields}, upsert=True)
+
+
+def backfill(sensor_store, rollups_col, state_col, device_id=None, chunk=5000, cutoff=None,
+             wait=2 * ROLLUP_FLUSH_INTERVAL + 1):
+    """
+    Rebuild the rollups before cutoff (default: the start of today) from raw readings.
+
+    Publishes the cutoff first and waits wait seconds, so every worker has
+    flushed what it held and drops those buckets from then on. Then each device's
+    readings are read once in time order and its buckets $set (chunk per write);
+    buckets in scope the scan did not produce are deleted at the end.
+    """
+    # Day-aligned, so no hour or day bucket has readings on both sides of it
+    cutoff = bucket_start(cutoff or datetime.now(), "day")
+    RollupCutoffs(state_col).publish(device_id, cutoff)
+    print(f"Cutoff {cutoff.isoformat()} published, waiting {wait:g}s for the workers")
+    time.sleep(wait)
+
+    run = datetime.now()
+    projection = {field: 1 for field in SENSOR_FIELDS}
+    projection.update({"_id": 0, "timestamp": 1})
+    seen = 0
+    for device in ([device_id] if device_id else sensor_store.devices()):
+        acc = RollupAccumulator(rollups_col)
+        for doc in sensor_store.readings(device, {"$lt": cutoff}, projection, batch_size=chunk):
+            doc["device_id"] = device
+            acc.add(doc)
+            seen += 1
+        pending = list(acc._take_pending().items())
+        for i in range(0, len(pending), chunk):
+            rollups_col.bulk_write([set_for(key, value, run) for key, value in pending[i:i + chunk]], ordered=False)
+        print(f"Backfilled {device}: {seen} readings so far")
+    scope = {"device_id": device_id} if device_id else {}
+    rollups_col.delete_many(dict(scope, bucket={"$lt": cutoff}, backfill={"$ne": run}))
+    print(f"Backfill done: {seen} readings")
+    return seen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild sensor rollups from raw history")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--device", help="only this device_id")
+    parser.add_argument("--chunk", type=int, default=5000, help="rollup documents per write")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    from sensor_store import create_sensor_store
+
+    load_dotenv()
+    db = MongoClient(os.environ.get("MONGO_URI"))["terradetect"]
+    db["sensor_rollups"].create_index(ROLLUP_INDEX, unique=True)
+    backfill(create_sensor_store(db), db["sensor_rollups"], db["rollup_state"], args.device, args.chunk)
@@ -0,0 +1,352 @@
+"""
+Storage layouts for sensor readings, chosen with SENSOR_STORAGE:
+
+    documents   one document per reading in sensor_data (default)
+    buckets     one document per device and hour in sensor_buckets, with the
+                readings as parallel arrays:
+                {device_id, start, count, timestamp: [...], temperature: [...], ...}
+    timeseries  one document per reading in sensor_timeseries, a native MongoDB
+                time-series collection (5.0+) that buckets readings server-side
+
+With buckets (or time-series), device_id and the field names are stored once
+per bucket rather than once per reading, and there is one index entry per
+bucket. A bucket takes at most SENSOR_BUCKET_MAX_READINGS readings. When it is
+full, more readings for that hour open another bucket.
+
+All stores have the same methods and return one dict per reading whatever the
+layout, so the endpoints do not depend on it. Rows unpacked from a bucket get
+a string _id "<bucket id>-<index>" for the history cursors.
+
+Copy the existing sensor_data readings into the configured layout. The copy
+streams in batches and resumes from a checkpoint, so run it once before
+switching SENSOR_STORAGE and again afterwards to pick up the readings written
+in between:
+    python sensor_store.py migrate [--to buckets|timeseries] [--device ID] [--batch 5000]
+"""
+import argparse
+import operator
+import os
+from datetime import datetime
+from itertools import islice
+
+from pymongo import UpdateOne
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+from aggregates import SENSOR_FIELDS, aggregate_buckets, bucket_start, summarize
+from history import SENSOR_HISTORY_INDEX, keyset_query
+from logs import get_logger
+
+SENSOR_STORAGE = os.environ.get("SENSOR_STORAGE", "documents")
+SENSOR_BUCKET_MAX_READINGS = int(os.environ.get("SENSOR_BUCKET_MAX_READINGS", 1000))
+MIGRATION_BATCH_SIZE = int(os.environ.get("MIGRATION_BATCH_SIZE", 5000))
+
+SENSOR_COLLECTIONS = {
+    "documents": "sensor_data",
+    "buckets": "sensor_buckets",
+    "timeseries": "sensor_timeseries",
+}
+BUCKET_INDEX = [("device_id", 1), ("start", -1)]
+# Time-series collections index the metaField and timeField; _id is not indexable there
+TIMESERIES_INDEX = [("device_id", 1), ("timestamp", -1)]
+
+log = get_logger("sensor_store")
+
+_COMPARE = {"$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+
+
+def _in_range(timestamp, time_range):
+    return all(_COMPARE[op](timestamp, bound) for op, bound in time_range.items())
+
+
+def _bucket_range(time_range):
+    """Filter on bucket start for buckets that can hold readings within time_range"""
+    query = {}
+    for op, bound in time_range.items():
+        if op in ("$gt", "$gte"):
+            query["$gte"] = bucket_start(bound, "hour")
+        else:
+            query[op] = bound
+    return query
+
+
+def _projected_fields(projection):
+    if projection is None:
+        return SENSOR_FIELDS
+    return [field for field in SENSOR_FIELDS if projection.get(field)]
+
+
+class DocumentStore:
+    """One document per reading: the sensor_data layout"""
+
+    layout = "documents"
+    index = SENSOR_HISTORY_INDEX
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        self.collection.create_index(self.index)
+
+    def insert_one(self, doc):
+        self.collection.insert_one(doc)
+
+    def insert_many(self, docs, ordered=False):
+        self.collection.insert_many(docs, ordered=ordered)
+
+    def latest(self, device_id):
+        return self.collection.find_one({'device_id': device_id}, sort=[('timestamp', -1)])
+
+    def page(self, device_id, projection, limit, position=None, skip=0):
+        """
+        Up to limit readings newest first, skipping skip; or the readings after
+        position, a decoded history cursor (timestamp, _id, direction). Pages in
+        the "prev" direction come back oldest first.
+        """
+        if position is not None:
+            query, sort = keyset_query(device_id, *position)
+            return list(self.collection.find(query, projection, sort=sort).limit(limit))
+        return list(self.collection.find({'device_id': device_id}, projection,
+                                         sort=[('timestamp', -1), ('_id', -1)]).skip(skip).limit(limit))
+
+    def readings(self, device_id, time_range=None, projection=None, limit=0, batch_size=0):
+        """Iterable of readings oldest first, within time_range such as {"$gte": start, "$lt": end}"""
+        query = {'device_id': device_id}
+        if time_range:
+            query['timestamp'] = time_range
+        return self.collection.find(query, projection, sort=[('timestamp', 1)], limit=limit, batch_size=batch_size)
+
+    def scan(self, device_id=None, time_range=None, projection=None, batch_size=0):
+        """Readings of one or all devices, with device_id, in no particular order"""
+        query = {'device_id': device_id} if device_id else {}
+        if time_range:
+            query['timestamp'] = time_range
+        return self.collection.find(query, projection, batch_size=batch_size)
+
+    def count(self, device_id):
+        return self.collection.count_documents({'device_id': device_id})
+
+    def devices(self):
+        """Every device_id with stored readings"""
+        return self.collection.distinct('device_id')
+
+    def aggregate(self, device_id, start, end, bucket, fields):
+        """(rows, source) for /api/sensor/aggregate"""
+        return aggregate_buckets(self.collection, device_id, start, end, bucket, fields)
+
+
+class TimeSeriesStore(DocumentStore):
+    """Readings in a MongoDB time-series collection; queried like plain documents"""
+
+    layout = "timeseries"
+    index = TIMESERIES_INDEX
+
+    def __init__(self, db, name=SENSOR_COLLECTIONS["timeseries"]):
+        super().__init__(db[name])
+        self.db = db
+
+    def ensure_indexes(self):
+        try:
+            self.db.create_collection(self.collection.name, timeseries={
+                "timeField": "timestamp", "metaField": "device_id", "granularity": "minutes"})
+        except CollectionInvalid:
+            pass  # Already exists
+        except OperationFailure as e:
+            # Older server: inserts create a regular collection with the same documents
+            log.warning("Time-series collections are not available, using a regular collection",
+                        collection=self.collection.name, error=str(e))
+        super().ensure_indexes()
+
+
+class BucketStore:
+    """Readings packed into per-device, per-hour bucket documents of column arrays"""
+
+    layout = "buckets"
+
+    def __init__(self, collection, max_readings=SENSOR_BUCKET_MAX_READINGS):
+        self.collection = collection
+        self.max_readings = max_readings
+
+    def ensure_indexes(self):
+        self.collection.create_index(BUCKET_INDEX)
+
+    def insert_one(self, doc):
+        self.insert_many([doc])
+
+    def insert_many(self, docs, ordered=False):
+        """Append readings to their hour's bucket, one upsert per bucket touched"""
+        groups = {}
+        for doc in docs:
+            key = (doc['device_id'], bucket_start(doc['timestamp'], "hour"))
+            groups.setdefault(key, []).append(doc)
+        ops = []
+        for (device_id, start), group in groups.items():
+            for i in range(0, len(group), self.max_readings):
+                chunk = group[i:i + self.max_readings]
+                push = {'timestamp': {'$each': [doc['timestamp'] for doc in chunk]}}
+                for field in SENSOR_FIELDS:
+                    push[field] = {'$each': [doc.get(field) for doc in chunk]}
+                # Matches a bucket with room for the whole chunk; otherwise a new one is inserted
+                ops.append(UpdateOne(
+                    {'device_id': device_id, 'start': start, 'count': {'$lte': self.max_readings - len(chunk)}},
+                    {'$push': push, '$inc': {'count': len(chunk)}},
+                    upsert=True))
+        if ops:
+            self.collection.bulk_write(ops, ordered=ordered)
+
+    def _unpack(self, bucket, fields, device_id=None):
+        bucket_id = str(bucket['_id'])
+        columns = [(field, bucket[field]) for field in fields if field in bucket]
+        for i, timestamp in enumerate(bucket['timestamp']):
+            row = {'_id': f"{bucket_id}-{i:06d}", 'timestamp': timestamp}
+            if device_id is not None:
+                row['device_id'] = device_id
+            for field, values in columns:
+                row[field] = values[i]
+            yield row
+
+    def _rows(self, device_id, time_range, descending, projection, bucket_batch=2):
+        """
+        Readings in (timestamp, _id) order. Buckets are read hour by hour; the
+        buckets of one hour can overlap in time, so each hour is sorted as a whole.
+        """
+        fields = _projected_fields(projection)
+        keep_id = projection is None or projection.get('_id', 1)
+        query = {'device_id': device_id}
+        if time_range:
+            query['start'] = _bucket_range(time_range)
+        bucket_projection = {field: 1 for field in fields}
+        bucket_projection.update({'start': 1, 'timestamp': 1})
+        cursor = self.collection.find(query, bucket_projection, sort=[('start', -1 if descending else 1)],
+                                      batch_size=bucket_batch)
+        try:
+            hour, rows = None, []
+            for bucket in cursor:
+                if bucket['start'] != hour:
+                    yield from self._sorted(rows, time_range, descending, keep_id)
+                    hour, rows = bucket['start'], []
+                rows.extend(self._unpack(bucket, fields))
+            yield from self._sorted(rows, time_range, descending, keep_id)
+        finally:
+            cursor.close()
+
+    def _sorted(self, rows, time_range, descending, keep_id):
+        rows.sort(key=lambda row: (row['timestamp'], row['_id']), reverse=descending)
+        for row in rows:
+            if time_range and not _in_range(row['timestamp'], time_range):
+                continue
+            if not keep_id:
+                del row['_id']
+            yield row
+
+    def latest(self, device_id):
+        rows = self.page(device_id, None, 1)
+        return rows[0] if rows else None
+
+    def page(self, device_id, projection, limit, position=None, skip=0):
+        """Same as DocumentStore.page"""
+        if position is None:
+            return list(islice(self._rows(device_id, None, True, projection), skip, skip + limit))
+        timestamp, doc_id, direction = position
+        key = (timestamp, str(doc_id))
+        if direction == "next":
+            rows = self._rows(device_id, {'$lte': timestamp}, True, projection)
+            rows = (row for row in rows if (row['timestamp'], row['_id']) < key)
+        else:
+            rows = self._rows(device_id, {'$gte': timestamp}, False, projection)
+            rows = (row for row in rows if (row['timestamp'], row['_id']) > key)
+        return list(islice(rows, limit))
+
+    def readings(self, device_id, time_range=None, projection=None, limit=0, batch_size=0):
+        """Same as DocumentStore.readings; batch_size counts readings, not buckets"""
+        rows = self._rows(device_id, time_range, False, projection,
+                          bucket_batch=max(2, batch_size // self.max_readings))
+        return islice(rows, limit) if limit else rows
+
+    def scan(self, device_id=None, time_range=None, projection=None, batch_size=0):
+        """Same as DocumentStore.scan"""
+        fields = _projected_fields(projection)
+        query = {'device_id': device_id} if device_id else {}
+        if time_range:
+            query['start'] = _bucket_range(time_range)
+        bucket_projection = {field: 1 for field in fields}
+        bucket_projection.update({'device_id': 1, 'timestamp': 1})
+        for bucket in self.collection.find(query, bucket_projection,
+                                           batch_size=max(2, batch_size // self.max_readings)):
+            for row in self._unpack(bucket, fields, bucket['device_id']):
+                if not time_range or _in_range(row['timestamp'], time_range):
+                    yield row
+
+    def count(self, device_id):
+        return sum(bucket['count'] for bucket in self.collection.find({'device_id': device_id}, {'count': 1, '_id': 0}))
+
+    def devices(self):
+        """Same as DocumentStore.devices"""
+        return self.collection.distinct('device_id')
+
+    def aggregate(self, device_id, start, end, bucket, fields):
+        """Same as DocumentStore.aggregate, always computed in Python"""
+        projection = {field: 1 for field in fields}
+        projection['_id'] = 0
+        readings = self.readings(device_id, {'$gte': start, '$lt': end}, projection)
+        return summarize(readings, bucket, fields), "python"
+
+
+def create_sensor_store(db, layout=SENSOR_STORAGE):
+    if layout == "buckets":
+        return BucketStore(db[SENSOR_COLLECTIONS["buckets"]])
+    if layout == "timeseries":
+        return TimeSeriesStore(db)
+    return DocumentStore(db[SENSOR_COLLECTIONS["documents"]])
+
+
+def migrate(source, target, checkpoints, device_id=None, batch=MIGRATION_BATCH_SIZE):
+    """
+    Copy readings from the source collection (sensor_data documents) into the
+    target store in _id order, batch readings per insert. The last copied _id is
+    saved in checkpoints after every batch, so a rerun continues from there; a
+    crash between a batch and its checkpoint can copy that batch twice.
+    """
+    key = f"{target.layout}:{device_id or '*'}"
+    state = checkpoints.find_one({'_id': key}) or {}
+    copied = state.get('copied', 0)
+    query = {'device_id': device_id} if device_id else {}
+    if state.get('last_id') is not None:
+        query['_id'] = {'$gt': state['last_id']}
+
+    def flush(docs):
+        target.insert_many(docs)
+        checkpoints.update_one({'_id': key}, {'$set': {
+            'last_id': docs[-1]['_id'], 'copied': copied, 'updated_at': datetime.now()}}, upsert=True)
+        print(f"Migrated {copied} readings")
+
+    docs = []
+    for doc in source.find(query, sort=[('_id', 1)], batch_size=batch):
+        docs.append(doc)
+        if len(docs) >= batch:
+            copied += len(docs)
+            flush(docs)
+            docs = []
+    if docs:
+        copied += len(docs)
+        flush(docs)
+    print(f"Migration to {target.layout} done: {copied} readings")
+    return copied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy sensor_data readings into another storage layout")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--to", choices=["buckets", "timeseries"],
+                        default=SENSOR_STORAGE if SENSOR_STORAGE != "documents" else "buckets")
+    parser.add_argument("--device", help="only this device_id")
+    parser.add_argument("--batch", type=int, default=MIGRATION_BATCH_SIZE, help="readings per insert")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    db = MongoClient(os.environ.get("MONGO_URI"))["terradetect"]
+    store = create_sensor_store(db, args.to)
+    store.ensure_indexes()
+    migrate(db[SENSOR_COLLECTIONS["documents"]], store, db["sensor_migrations"], args.device, args.batch)
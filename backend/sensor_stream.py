@@ -0,0 +1,269 @@
+"""
+Server-Sent Events fan-out for /api/sensor/stream.
+
+A SensorHub keeps one channel per device, not per client: readings accepted by
+this process are published straight into the channel, and readings accepted by
+other workers are picked up by a single poller per channel that watches the
+shared latest-reading store (no Mongo queries while streaming). Each client gets
+a bounded queue; a client that falls SSE_CLIENT_QUEUE_SIZE events behind is
+dropped and resumes from Last-Event-ID when its browser reconnects.
+
+Event ids are reading timestamps in epoch milliseconds, so they mean the same
+thing in every worker and a reconnect can land on any of them.
+
+Blocking is done with threading primitives only, so this works with gunicorn's
+gthread workers and with gevent workers (which patch threading).
+"""
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from logs import get_logger
+from offload import cooperative
+
+# How often a channel's poller checks the shared store for readings from other workers
+SSE_POLL_INTERVAL = float(os.environ.get("SSE_POLL_INTERVAL", 1))
+# Seconds of silence before a heartbeat comment is sent
+SSE_HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT", 15))
+# Streams are closed after this long so threads are recycled; browsers reconnect
+SSE_MAX_DURATION = float(os.environ.get("SSE_MAX_DURATION", 300))
+SSE_CLIENT_QUEUE_SIZE = int(os.environ.get("SSE_CLIENT_QUEUE_SIZE", 32))
+# Recent events kept per device for Last-Event-ID resume
+SSE_REPLAY_SIZE = int(os.environ.get("SSE_REPLAY_SIZE", 64))
+# Open streams per process; each one holds a worker thread (or greenlet) for up to
+# SSE_MAX_DURATION. Unset: see default_max_clients()
+SSE_MAX_CLIENTS = int(os.environ["SSE_MAX_CLIENTS"]) if os.environ.get("SSE_MAX_CLIENTS") else None
+# gthread workers: threads per worker kept free of streams for ingestion and predictions
+SSE_RESERVED_THREADS = int(os.environ.get("SSE_RESERVED_THREADS", 4))
+# gevent workers: a stream is a greenlet, not one of a few threads
+SSE_GREENLET_CLIENTS = 50
+# Reconnect delay suggested to the browser, in milliseconds
+SSE_RETRY_MS = int(os.environ.get("SSE_RETRY_MS", 3000))
+
+log = get_logger("sensor_stream")
+
+
+def default_max_clients():
+    """
+    Streams this process may hold open. Under gevent that is SSE_GREENLET_CLIENTS.
+    Otherwise each stream occupies one of the worker's GUNICORN_THREADS threads
+    (gunicorn.conf.py), so SSE_RESERVED_THREADS of them are kept for everything
+    else; with a single thread no streams are served at all.
+    """
+    if cooperative():
+        return SSE_GREENLET_CLIENTS
+    return max(0, int(os.environ.get("GUNICORN_THREADS", 16)) - SSE_RESERVED_THREADS)
+
+
+class TooManyClients(Exception):
+    """Raised by SensorHub.subscribe when the maximum number of streams is already open"""
+
+
+def event_id(timestamp):
+    return int(round(timestamp.timestamp() * 1000))
+
+
+def parse_event_id(value):
+    """Last-Event-ID header -> int, or None when missing, malformed or not a representable time"""
+    try:
+        if not value:
+            return None
+        eid = int(value)
+        event_time(eid)
+        return eid
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+def event_time(eid):
+    """Event id (epoch milliseconds) -> datetime; raises ValueError, OverflowError or OSError when out of range"""
+    return datetime.fromtimestamp(eid / 1000)
+
+
+def format_event(event):
+    """One SSE frame for an (id, reading) event"""
+    eid, reading = event
+    body = {
+        "data": {k: v for k, v in reading.items() if k != "timestamp"},
+        "timestamp": reading["timestamp"].isoformat(),
+        "source": "esp32",
+    }
+    return f"id: {eid}\nevent: reading\ndata: {json.dumps(body)}\n\n"
+
+
+class Subscription:
+    def __init__(self, device_id, queue_size):
+        self.device_id = device_id
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = False
+
+
+class _Channel:
+    def __init__(self, replay_size):
+        self.subscribers = set()
+        self.replay = deque(maxlen=replay_size)  # (id, reading), oldest first
+        self.last_id = None
+        self.poller = None
+
+
+class SensorHub:
+    """
+    poll(device_id) returns the device's latest reading from the shared store (or None).
+    backlog(device_id, since, limit) returns up to limit readings newer than the
+    datetime since, oldest first; with since=None it returns just the latest reading.
+    """
+
+    def __init__(self, poll, backlog, poll_interval=SSE_POLL_INTERVAL, queue_size=SSE_CLIENT_QUEUE_SIZE,
+                 replay_size=SSE_REPLAY_SIZE, max_clients=SSE_MAX_CLIENTS):
+        self.poll = poll
+        self.backlog = backlog
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.replay_size = replay_size
+        self.max_clients = max_clients
+        self._channels = {}  # device_id -> _Channel, only while it has subscribers
+        self._lock = threading.Lock()
+        self.stats = {"clients": 0, "connects": 0, "published": 0, "dropped": 0, "rejected": 0,
+                      "replayed": 0, "backlog_queries": 0}
+
+    def publish(self, device_id, reading):
+        """Fan a newly accepted reading out to the device's subscribers, if any"""
+        if device_id not in self._channels:
+            return
+        eid = event_id(reading["timestamp"])
+        with self._lock:
+            channel = self._channels.get(device_id)
+            # Older or already-seen readings (e.g. the poller finding our own write) are skipped
+            if channel is None or (channel.last_id is not None and eid <= channel.last_id):
+                return
+            channel.last_id = eid
+            event = (eid, dict(reading))
+            channel.replay.append(event)
+            self.stats["published"] += 1
+            for sub in list(channel.subscribers):
+                try:
+                    sub.queue.put_nowait(event)
+                except queue.Full:
+                    # Slow consumer: cut it loose rather than buffer without bound
+                    sub.dropped = True
+                    channel.subscribers.discard(sub)
+                    self.stats["clients"] -= 1
+                    self.stats["dropped"] += 1
+
+    def subscribe(self, device_id, last_event_id=None):
+        """
+        Register a client. Returns (subscription, initial events): the events after
+        last_event_id, or the current reading for a fresh connection.
+        """
+        # A bad id is a fresh connect; checked before registering, so it cannot leak a subscriber
+        try:
+            since = event_time(last_event_id) if last_event_id is not None else None
+        except (ValueError, OverflowError, OSError):
+            last_event_id = since = None
+        # Resolved per call: gevent may patch the process after the hub is created
+        max_clients = self.max_clients if self.max_clients is not None else default_max_clients()
+        with self._lock:
+            if self.stats["clients"] >= max_clients:
+                self.stats["rejected"] += 1
+                raise TooManyClients()
+            channel = self._channels.get(device_id)
+            if channel is None:
+                channel = self._channels[device_id] = _Channel(self.replay_size)
+            sub = Subscription(device_id, self.queue_size)
+            channel.subscribers.add(sub)
+            self.stats["clients"] += 1
+            self.stats["connects"] += 1
+            replay = list(channel.replay)
+            if channel.poller is None or not channel.poller.is_alive():
+                channel.poller = threading.Thread(target=self._poll_channel, args=(device_id, channel),
+                                                  name=f"sse-poll-{device_id}", daemon=True)
+                channel.poller.start()
+        try:
+            initial = self._initial_events(device_id, last_event_id, since, replay)
+        except BaseException:
+            # stream() never runs, so nothing else would unsubscribe it
+            self.unsubscribe(sub)
+            raise
+        return sub, initial
+
+    def _initial_events(self, device_id, last_event_id, since, replay):
+        if last_event_id is not None and replay and replay[0][0] <= last_event_id:
+            # Everything after last_event_id that this process saw is still buffered
+            events = [event for event in replay if event[0] > last_event_id]
+            self.stats["replayed"] += len(events)
+            return events
+        # Fresh connection, or a resume this process cannot serve from memory
+        self.stats["backlog_queries"] += 1
+        try:
+            readings = self.backlog(device_id, since, self.replay_size)
+        except Exception as e:
+            log.error("Error loading stream backlog", device_id=device_id, error=str(e))
+            return []
+        events = []
+        for reading in readings:
+            eid = event_id(reading["timestamp"])
+            if last_event_id is None or eid > last_event_id:
+                events.append((eid, reading))
+        if last_event_id is not None:
+            self.stats["replayed"] += len(events)
+        return events
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            channel = self._channels.get(sub.device_id)
+            if channel is not None and sub in channel.subscribers:
+                channel.subscribers.discard(sub)
+                self.stats["clients"] -= 1
+            if channel is not None and not channel.subscribers:
+                # The poller notices and exits
+                del self._channels[sub.device_id]
+
+    def _poll_channel(self, device_id, channel):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if self._channels.get(device_id) is not channel:
+                    return
+            try:
+                reading = self.poll(device_id)
+            except Exception as e:
+                log.error("Error polling latest reading", device_id=device_id, error=str(e))
+                continue
+            if reading is not None and reading.get("timestamp") is not None:
+                self.publish(device_id, reading)
+
+    def stream(self, sub, initial, heartbeat=SSE_HEARTBEAT, max_duration=SSE_MAX_DURATION):
+        """Generator of SSE frames for one client; unsubscribes when the client goes away"""
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            sent = None
+            for event in initial:
+                sent = event[0]
+                yield format_event(event)
+            deadline = time.monotonic() + max_duration
+            while not sub.dropped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = sub.queue.get(timeout=min(heartbeat, remaining))
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                # The backlog may already have covered events published while subscribing
+                if sent is not None and event[0] <= sent:
+                    continue
+                sent = event[0]
+                yield format_event(event)
+        finally:
+            self.unsubscribe(sub)
+
+    def snapshot(self):
+        with self._lock:
+            devices = len(self._channels)
+        return dict(self.stats, devices=devices,
+                    max_clients=self.max_clients if self.max_clients is not None else default_max_clients())
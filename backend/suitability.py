@@ -0,0 +1,141 @@
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Column order used everywhere for the 7-parameter input vector
+CROP_FEATURES = ["N", "P", "K", "temperature", "humidity", "ph", "rainfall"]
+
+# Similar crops returned by the "neighbors" engine when the request does not ask for top_k
+NEIGHBOR_TOP_K = int(os.environ.get("NEIGHBOR_TOP_K", 5))
+# Dataset rows fetched per query before grouping them by crop
+NEIGHBOR_POOL = int(os.environ.get("NEIGHBOR_POOL", 64))
+
+
+class CropProfileIndex:
+    """Per-crop ideal values from crop-data.csv, laid out as a crops x 7 matrix"""
+
+    def __init__(self, labels, ideal_values):
+        self.labels = list(labels)
+        self.ideal_values = np.asarray(ideal_values, dtype=float)
+        self.row_of = {label: i for i, label in enumerate(self.labels)}
+        # 20% deviation tolerance, same as calculate_suitability()
+        self.max_deviation = self.ideal_values * 0.2
+
+    @classmethod
+    def from_dataframe(cls, crop_data):
+        """Build the index from the crop dataset (first row per crop is its ideal)"""
+        first_rows = crop_data.drop_duplicates(subset="label", keep="first")
+        return cls(first_rows["label"].tolist(), first_rows[CROP_FEATURES].values.astype(float))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, crop_name):
+        return crop_name in self.row_of
+
+    def ideal_for(self, crop_name):
+        """Return the ideal value row for a crop, or None if it is unknown"""
+        row = self.row_of.get(crop_name)
+        if row is None:
+            return None
+        return self.ideal_values[row]
+
+    def score_matrix(self, user_inputs):
+        """
+        Score-only path: suitability of every crop for every input row.
+        Accepts a single 7-value input or an (n, 7) array and returns an
+        (n, crops) array of scores rounded to 2 decimals.
+        """
+        user_values = np.atleast_2d(np.asarray(user_inputs, dtype=float))
+        deviation = np.abs(user_values[:, None, :] - self.ideal_values[None, :, :])
+        raw = np.abs(100 - (np.sum(deviation / self.max_deviation, axis=2) * 100 / len(CROP_FEATURES)))
+        # np.where rather than np.maximum so NaN falls back to 0 like max(0, nan)
+        scores = np.where(raw > 0, raw, 0.0) % 100
+        return np.round(scores, 2)
+
+    def score_all(self, user_input):
+        """Suitability score of every crop for one input, in label order"""
+        return self.score_matrix(user_input)[0]
+
+    def best_crop(self, user_input):
+        """Return (crop, score) with the highest suitability for one input"""
+        if not self.labels:
+            return None, 0
+        scores = self.score_all(user_input)
+        best = int(np.argmax(scores))
+        return self.labels[best], scores[best]
+
+
+class CropNeighborIndex:
+    """
+    KD-tree over every row of crop-data.csv, z-score normalized per feature.
+
+    A crop's distance to an input is the distance to its closest sample, so crops
+    with many rows (Wheat) do not crowd out the rest, and no single row has to
+    stand in for the crop's "ideal". Scores are 100 / (1 + distance).
+    """
+
+    def __init__(self, features, labels, pool=NEIGHBOR_POOL):
+        features = np.asarray(features, dtype=float)
+        labels = np.asarray(labels)
+        self.mean = features.mean(axis=0)
+        self.scale = features.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        # Rows grouped by crop, so exact per-crop minimums are one reduceat
+        order = np.argsort(labels, kind="stable")
+        self.points = (features[order] - self.mean) / self.scale
+        self.labels, self.row_labels = np.unique(labels[order], return_inverse=True)
+        self.labels = self.labels.tolist()
+        self.crop_starts = np.flatnonzero(np.r_[True, self.row_labels[1:] != self.row_labels[:-1]])
+        self.tree = cKDTree(self.points)
+        self.pool = min(pool, len(self.points))
+
+    @classmethod
+    def from_dataframe(cls, crop_data):
+        return cls(crop_data[CROP_FEATURES].values, crop_data["label"].values)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _pooled(self, distances, indices, k):
+        """(crop index, distance) pairs from one tree query, nearest first, one per crop"""
+        seen = {}
+        for distance, row in zip(distances, indices):
+            crop = self.row_labels[row]
+            if crop not in seen:
+                seen[crop] = distance
+                if len(seen) == k:
+                    break
+        return list(seen.items())
+
+    def _exhaustive(self, point, k):
+        """Exact per-crop distances against every row"""
+        distances = np.sqrt(np.minimum.reduceat(((self.points - point) ** 2).sum(axis=1), self.crop_starts))
+        nearest = np.argsort(distances, kind="stable")[:k]
+        return [(crop, distances[crop]) for crop in nearest]
+
+    def nearest_crops(self, user_inputs, k=NEIGHBOR_TOP_K):
+        """
+        Top-k most similar crops per input: a list (one per input row) of
+        [(crop, score, distance), ...], most similar first.
+        """
+        points = (np.atleast_2d(np.asarray(user_inputs, dtype=float)) - self.mean) / self.scale
+        # NaN inputs cannot be placed in the tree; they get no similar crops
+        valid = ~np.isnan(points).any(axis=1)
+        k = max(1, min(k, len(self.labels)))
+        results = [[] for _ in range(len(points))]
+        if not valid.any():
+            return results
+        rows = np.flatnonzero(valid)
+        distances, indices = self.tree.query(points[rows], k=self.pool)
+        distances = distances.reshape(len(rows), -1)
+        indices = indices.reshape(len(rows), -1)
+        for row, row_distances, row_indices in zip(rows, distances, indices):
+            crops = self._pooled(row_distances, row_indices, k)
+            if len(crops) < k:
+                # The nearest rows were all from a few crops (usually Wheat)
+                crops = self._exhaustive(points[row], k)
+            results[row] = [(self.labels[crop], round(100.0 / (1.0 + float(distance)), 2), round(float(distance), 4))
+                            for crop, distance in crops]
+        return results
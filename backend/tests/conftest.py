@@ -0,0 +1,32 @@
+"""
+Imports app.py against an in-memory Mongo (mongomock), so the tests need no
+database server. Run from the backend directory:
+    pip install -r requirements-test.txt
+    python -m pytest -q
+"""
+import os
+import sys
+
+import mongomock
+import pymongo
+import pytest
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("LATEST_STORE_BACKEND", "memory")
+
+
+@pytest.fixture(scope="session")
+def appmod():
+    pymongo.MongoClient = mongomock.MongoClient
+    # The model and CSV paths are relative to the backend directory
+    os.chdir(BACKEND_DIR)
+    import app
+    return app
+
+
+@pytest.fixture
+def client(appmod):
+    return appmod.app.test_client()
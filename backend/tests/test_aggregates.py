@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from aggregates import lttb
+
+
+@pytest.mark.parametrize("threshold, expected", [(0, []), (1, [0]), (2, [0, 9]), (10, list(range(10)))])
+def test_lttb_small_thresholds(threshold, expected):
+    x = np.arange(10)
+    assert lttb(x, np.sin(x), threshold).tolist() == expected
+
+
+def test_lttb_keeps_first_last_and_peak():
+    x = np.arange(100)
+    y = np.zeros(100)
+    y[40] = 10
+    selected = lttb(x, y, 5).tolist()
+    assert len(selected) == 5 and selected[0] == 0 and selected[-1] == 99 and 40 in selected
+
+
+@pytest.mark.parametrize("max_points", ["1", "2", "-4"])
+def test_aggregate_rejects_max_points_below_three(client, max_points):
+    with client.session_transaction() as session:
+        session["device_id"] = "AGG1"
+    response = client.get(f"/api/sensor/aggregate?max_points={max_points}")
+    assert response.status_code == 400
+    assert "max_points" in response.get_json()["error"]
+
+
+def test_aggregate_accepts_max_points_of_three(client):
+    with client.session_transaction() as session:
+        session["device_id"] = "AGG1"
+    assert client.get("/api/sensor/aggregate?max_points=3").status_code == 200
@@ -0,0 +1,98 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from inference import FERTILIZER_COLUMNS, FertilizerEncoder, FlatForest, ForestPredictor, pin_n_jobs
+from model_registry import FERTILIZER_DATA_CSV
+from model_store import CROP_DATA_CSV, load_crop_model, load_fertilizer_bundle
+from suitability import CROP_FEATURES
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+@pytest.fixture(scope="module")
+def bundle():
+    return load_fertilizer_bundle()
+
+
+def test_fertilizer_encoder_leaves_the_model_untouched(bundle):
+    model = bundle["model"]
+    names = list(model.feature_names_in_)
+    encoder = FertilizerEncoder(model, bundle["label_encoders"])
+    assert list(model.feature_names_in_) == names == encoder.columns
+
+
+def test_sklearn_predictions_from_encoded_arrays(bundle):
+    model = bundle["model"]
+    rows = pd.read_csv(FERTILIZER_DATA_CSV)[FERTILIZER_COLUMNS].head(50)
+    features = FertilizerEncoder(model, bundle["label_encoders"]).encode(rows.to_dict("records"))
+    predicted = ForestPredictor(model, "fertilizer", enabled=False).predict(features)
+    named = pd.DataFrame(features, columns=model.feature_names_in_)
+    assert np.array_equal(predicted, model.predict(named))
+
+
+def test_no_feature_name_warning_for_encoded_arrays():
+    # In a fresh interpreter: pytest resets warning filters around every test
+    script = (
+        "import pandas as pd\n"
+        "from inference import FERTILIZER_COLUMNS, FertilizerEncoder, ForestPredictor\n"
+        "from model_registry import FERTILIZER_DATA_CSV\n"
+        "from model_store import load_fertilizer_bundle\n"
+        "bundle = load_fertilizer_bundle()\n"
+        "rows = pd.read_csv(FERTILIZER_DATA_CSV)[FERTILIZER_COLUMNS].head(50).to_dict('records')\n"
+        "features = FertilizerEncoder(bundle['model'], bundle['label_encoders']).encode(rows)\n"
+        "ForestPredictor(bundle['model'], 'fertilizer', enabled=False).predict(features)\n"
+    )
+    subprocess.run([sys.executable, "-W", "error::UserWarning", "-c", script], cwd=BACKEND_DIR, check=True,
+                   capture_output=True)
+
+
+@pytest.fixture(scope="module")
+def forests(bundle):
+    """[(name, sklearn model, feature matrix of its whole CSV)]"""
+    crop_model = pin_n_jobs(load_crop_model())
+    crops = pd.read_csv(CROP_DATA_CSV)[CROP_FEATURES].values.astype(float)
+    fertilizer_model = pin_n_jobs(bundle["model"])
+    encoder = FertilizerEncoder(fertilizer_model, bundle["label_encoders"])
+    fertilizers = encoder.encode(pd.read_csv(FERTILIZER_DATA_CSV)[FERTILIZER_COLUMNS].to_dict("records"))
+    return [("crop", crop_model, crops), ("fertilizer", fertilizer_model, fertilizers)]
+
+
+def test_flat_forest_matches_sklearn_on_every_csv_row(forests):
+    for name, model, X in forests:
+        flat = FlatForest.from_forest(model)
+        assert np.array_equal(flat.predict_proba(X), model.predict_proba(X)), name
+        assert np.array_equal(flat.predict(X), model.predict(X)), name
+
+
+def test_forest_predictor_uses_sklearn_above_max_rows(forests):
+    name, model, X = forests[0]
+    predictor = ForestPredictor(model, name, enabled=True, max_rows=10)
+    assert predictor.compiled
+    flat_rows = []
+    flat_proba = predictor.flat.predict_proba
+    predictor.flat.predict_proba = lambda features: flat_rows.append(len(features)) or flat_proba(features)
+
+    assert np.array_equal(predictor.predict_proba(X[:10]), model.predict_proba(X[:10]))
+    assert np.array_equal(predictor.predict_proba(X[:11]), model.predict_proba(X[:11]))
+    with_nan = X[:2].copy()
+    with_nan[0, 0] = np.nan
+    predictor.predict_proba(with_nan)
+    # Only the batch within max_rows and without NaN went through the compiled forest
+    assert flat_rows == [10]
+
+
+def test_unknown_categories_are_counted(appmod, client):
+    encoder = appmod.models["fertilizer_encoder"]
+    before = encoder.unknown_counts["Soil"]
+    response = client.post("/predict", json={"mode": "fertilizer", "N": 40, "P": 30, "K": 20, "temperature": 25,
+                                              "humidity": 60, "moisture": 40, "soil": "Moon dust",
+                                              "crop_name": "Wheat"})
+    assert response.status_code == 200
+    status = client.get("/api/status").get_json()
+    assert status["models"]["fertilizer_unknown_categories"]["Soil"] == before + 1
+    assert 'terradetect_fertilizer_unknown_categories_total{column="Soil"}' in client.get("/metrics").get_data(True)
@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+import mongomock
+import pytest
+
+from ingest import BatchWriter, IngestQueueFull, parse_device_timestamp
+from logs import ROOT_LOGGER
+
+READING = {"temperature": 25.0, "humidity": 80.0, "ph": 6.5, "N": 80, "P": 40, "K": 40}
+
+
+@pytest.fixture
+def device(appmod):
+    appmod.devices_col.insert_one({"device_id": "INGEST1", "api_key": "secret", "registered": True})
+    appmod.device_cache.clear()
+    yield "INGEST1"
+    appmod.devices_col.delete_many({"device_id": "INGEST1"})
+    appmod.device_cache.clear()
+
+
+@pytest.mark.parametrize("value", [1e20, -1e20, "1e20", "not a time"])
+def test_out_of_range_timestamps_are_a_value_error(value):
+    with pytest.raises(ValueError):
+        parse_device_timestamp(value)
+
+
+def test_device_timestamps():
+    assert parse_device_timestamp(1767268800) == datetime.fromtimestamp(1767268800)
+    assert parse_device_timestamp(1767268800500) == datetime.fromtimestamp(1767268800.5)
+
+
+def test_batch_rejects_only_the_out_of_range_reading(client, device):
+    response = client.post("/api/esp32/batch", headers={"x-api-key": "secret"}, json={
+        "device_id": device, "readings": [dict(READING, timestamp=1e20), dict(READING, timestamp=1767268800)]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["accepted"] == 1
+    assert [rejected["index"] for rejected in body["rejected"]] == [0]
+
+
+class RecordingCollection:
+    """Stands in for sensor_data: keeps every insert_many batch; fails the first `failures` calls"""
+
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+        self.written = threading.Event()
+
+    def insert_many(self, docs, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database unavailable")
+        self.batches.append(list(docs))
+        self.written.set()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_writer_flushes_a_full_batch_without_waiting_for_the_interval():
+    collection = RecordingCollection()
+    writer = BatchWriter(collection, batch_size=3, flush_interval=30)
+    for i in range(3):
+        writer.submit({"i": i})
+    assert collection.written.wait(5)
+    assert collection.batches == [[{"i": 0}, {"i": 1}, {"i": 2}]]
+    writer.stop(timeout=0)
+
+
+def test_writer_flushes_a_partial_batch_after_the_interval():
+    collection = RecordingCollection()
+    writer = BatchWriter(collection, batch_size=100, flush_interval=0.1)
+    writer.submit({"i": 0})
+    writer.submit({"i": 1})
+    assert collection.written.wait(5)
+    assert collection.batches == [[{"i": 0}, {"i": 1}]]
+    writer.stop()
+
+
+def test_writer_rejects_documents_when_the_queue_is_full():
+    writer = BatchWriter(RecordingCollection(), max_queue=2)
+    # No writer thread, so nothing drains the queue
+    writer.ensure_started = lambda: None
+    writer.submit({"i": 0})
+    writer.submit({"i": 1})
+    with pytest.raises(IngestQueueFull):
+        writer.submit({"i": 2})
+    assert writer.stats["accepted"] == 2 and writer.stats["rejected"] == 1
+    assert writer.depth() == 2
+
+
+def test_stop_writes_everything_still_queued():
+    collection = RecordingCollection()
+    writer = BatchWriter(collection, batch_size=4, flush_interval=0.2)
+    for i in range(10):
+        writer.submit({"i": i})
+    writer.stop()
+    assert [doc["i"] for batch in collection.batches for doc in batch] == list(range(10))
+    assert writer.depth() == 0
+    assert writer.stats["written"] == 10
+
+
+def test_failed_batches_are_counted_and_logged(caplog):
+    collection = RecordingCollection(failures=1)
+    writer = BatchWriter(collection, batch_size=2, flush_interval=0.05)
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.addHandler(caplog.handler)
+    try:
+        for i in range(4):
+            writer.submit({"i": i})
+        wait_for(lambda: writer.stats["written"] + writer.stats["failed"] == 4)
+    finally:
+        logger.removeHandler(caplog.handler)
+        writer.stop()
+    # The lost batch is accounted for and the writer keeps going
+    assert writer.stats["failed"] == 2 and writer.stats["written"] == 2
+    assert [record.fields for record in caplog.records if record.getMessage() == "Error writing sensor batch"] == [
+        {"size": 2, "error": "database unavailable"}]
+
+
+def test_partially_written_batches_count_what_was_inserted():
+    collection = mongomock.MongoClient().db.sensor_data
+    collection.insert_one({"_id": "duplicate"})
+    writer = BatchWriter(collection)
+    writer._write([{"_id": "a"}, {"_id": "duplicate"}, {"_id": "b"}])
+    assert writer.stats["written"] == 2 and writer.stats["failed"] == 1
+    assert collection.count_documents({}) == 3
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+import fakeredis
+
+from latest_store import RedisLatestStore, SharedMemoryLatestStore
+
+T0 = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def reading(seconds, temperature=25.0):
+    return {"temperature": temperature, "timestamp": T0 + timedelta(seconds=seconds)}
+
+
+def test_shm_keeps_the_newest_reading(tmp_path):
+    store = SharedMemoryLatestStore(str(tmp_path / "latest"), slots=16)
+    assert store.update("ABC123", reading(10, 25.0))
+    assert not store.update("ABC123", reading(5, 30.0))
+    assert store.update("ABC123", reading(20, 26.0))
+    assert store.get("ABC123")["temperature"] == 26.0
+    assert store.get("ABC123")["timestamp"] == T0 + timedelta(seconds=20)
+    assert store.get("DEF456") is None
+
+
+def test_shm_refuses_new_devices_beyond_the_load_factor(tmp_path):
+    path = str(tmp_path / "latest")
+    store = SharedMemoryLatestStore(path, slots=8, max_load=0.5)
+    assert all(store.update(f"DEV{i}", reading(i)) for i in range(4))
+    assert not store.update("DEV4", reading(4))
+    assert store.get("DEV4") is None
+    assert store.refused == 1
+    # Devices already in the table keep updating, and other processes see the same count
+    assert store.update("DEV0", reading(100))
+    assert SharedMemoryLatestStore(path, slots=8, max_load=0.5).used() == 4
+
+
+def test_redis_update_is_compare_and_set():
+    store = RedisLatestStore(fakeredis.FakeRedis())
+    assert store.update("ABC123", reading(10, 25.0))
+    assert not store.update("ABC123", reading(5, 30.0))
+    assert store.update("ABC123", reading(20, 26.0))
+    assert store.get("ABC123")["temperature"] == 26.0
@@ -0,0 +1,37 @@
+import pytest
+
+PARAMETERS = {"N": 90, "P": 42, "K": 43, "temperature": 20.9, "humidity": 82.0, "ph": 6.5, "rainfall": 202.9}
+
+
+@pytest.mark.parametrize("top_k", ["three", [3], {"k": 3}, 1e400, True])
+def test_invalid_top_k_is_a_400(client, top_k):
+    response = client.post("/predict", json=dict(PARAMETERS, mode="crop", top_k=top_k))
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid top_k (expected an integer)"}
+
+
+def test_invalid_top_k_in_a_batch_fails_only_that_input(client):
+    response = client.post("/predict/batch", json=[dict(PARAMETERS, top_k="three"), dict(PARAMETERS, top_k="3")])
+    assert response.status_code == 200
+    invalid, valid = response.get_json()["results"]
+    assert invalid == {"error": "Invalid top_k (expected an integer)"}
+    assert len(valid["top-crops"]) == 3
+
+
+@pytest.mark.parametrize("top_k, expected", [(None, 0), (0, 0), ("2", 2), (-1, 0)])
+def test_top_k(appmod, top_k, expected):
+    assert appmod.parse_top_k({"top_k": top_k}) == expected
+
+
+def test_batch_suitability_matches_single_predictions(appmod, client):
+    crops = list(appmod.models["crop_profiles"].labels)[:5] + ["Not a crop", "", ["Rice"]]
+    inputs = [dict(PARAMETERS, mode="suitability", crop_name=crop, N=PARAMETERS["N"] + i)
+              for i, crop in enumerate(crops * 3)]
+    single = []
+    for data in inputs:
+        result = client.post("/predict", json=data).get_json()
+        result.pop("model_version", None)
+        single.append(result)
+    assert client.post("/predict/batch", json=inputs).get_json()["results"] == single
+    assert single[5] == {"error": "Crop not found in dataset."}
+    assert single[6] == {"error": "Crop name is required"}
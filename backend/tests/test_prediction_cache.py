@@ -0,0 +1,67 @@
+import random
+
+from prediction_cache import PredictionCache
+
+MODES = ["crop", "suitability", "fertilizer"]
+
+
+def predict_inputs(crops, count=60, seed=0):
+    """/predict inputs, each followed by a repeat and by one that differs in the third decimal"""
+    rng = random.Random(seed)
+    inputs = []
+    for _ in range(count):
+        data = {field: round(rng.uniform(0, 120), 3) for field in ["N", "P", "K", "rainfall"]}
+        data.update(temperature=round(rng.uniform(10, 40), 3), humidity=round(rng.uniform(20, 90), 3),
+                    ph=round(rng.uniform(4, 8), 3), moisture=round(rng.uniform(10, 60), 3),
+                    mode=rng.choice(MODES), crop_name=rng.choice(crops),
+                    soil=rng.choice(["Black", "Red", "Sandy"]), top_k=rng.choice([0, 3]))
+        inputs += [data, dict(data), dict(data, ph=round(data["ph"] + 0.004, 3))]
+    return inputs
+
+
+def responses(client, inputs):
+    results = []
+    for data in inputs:
+        response = client.post("/predict", json=data)
+        assert response.status_code == 200
+        results.append({k: v for k, v in response.get_json().items() if k != "model_version"})
+    return results
+
+
+def test_cached_responses_match_uncached(appmod, client):
+    cache = appmod.prediction_cache
+    inputs = predict_inputs(list(appmod.models["crop_profiles"].labels))
+    max_size = cache.max_size
+    try:
+        cache.max_size = 0
+        uncached = responses(client, inputs)
+        cache.max_size = 4096
+        cache.clear()
+        hits = cache.stats["hits"]
+        cached = responses(client, inputs)
+        assert cache.stats["hits"] > hits
+    finally:
+        cache.max_size = max_size
+        cache.clear()
+    assert cached == uncached
+    assert client.post("/predict/batch", json=inputs).get_json()["results"] == uncached
+
+
+def test_precision_rounds_the_key_only():
+    cache = PredictionCache(max_size=10, precision={"ph": 1})
+    assert cache.key_values([1.234, 6.54], ["N", "ph"]) == (1.234, 6.5)
+    computed = []
+
+    def compute(values):
+        computed.append(values)
+        return {"value": values}
+
+    assert cache.get(("k",) + cache.key_values([6.54], ["ph"]), lambda: compute(6.54)) == {"value": 6.54}
+    # Same key: the first result is shared, and the models only ever saw raw values
+    assert cache.get(("k",) + cache.key_values([6.51], ["ph"]), lambda: compute(6.51)) == {"value": 6.54}
+    assert computed == [6.54]
+
+
+def test_default_keys_are_exact():
+    cache = PredictionCache(max_size=10)
+    assert cache.key_values([6.54, 6.541]) == (6.54, 6.541)
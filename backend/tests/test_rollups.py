@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+from aggregates import bucket_start
+from rollups import Rollups, backfill
+from sensor_store import BucketStore, DocumentStore
+
+TODAY = bucket_start(datetime.now(), "day")
+YESTERDAY = TODAY - timedelta(days=1)
+
+
+def reading(timestamp, temperature=25.0):
+    return {"device_id": "ROLL1", "timestamp": timestamp, "temperature": temperature, "humidity": 80.0}
+
+
+@pytest.fixture(params=[DocumentStore, BucketStore])
+def setup(request):
+    db = mongomock.MongoClient().db
+    store = request.param(db["sensor_data"])
+    rollups = Rollups(db["sensor_rollups"], db["rollup_state"], mode="buffered")
+    yield store, rollups, db
+    rollups.accumulator._stopping.set()
+
+
+def ingest(store, rollups, docs):
+    """What /api/esp32/batch does: insert, then record for the rollups"""
+    store.insert_many([dict(doc) for doc in docs])
+    for doc in docs:
+        rollups.accumulator.add(doc)
+
+
+def counts(db, resolution="hour"):
+    return {doc["bucket"]: doc["count"] for doc in db["sensor_rollups"].find({"resolution": resolution})}
+
+
+def test_backfill_does_not_double_count_readings_still_in_the_accumulator(setup):
+    store, rollups, db = setup
+    # Flushed before the backfill, and still pending when it runs
+    ingest(store, rollups, [reading(YESTERDAY + timedelta(hours=1, minutes=i)) for i in range(3)])
+    rollups.accumulator.flush()
+    ingest(store, rollups, [reading(YESTERDAY + timedelta(hours=1, minutes=10 + i)) for i in range(2)])
+    ingest(store, rollups, [reading(TODAY + timedelta(minutes=i)) for i in range(4)])
+
+    backfill(store, db["sensor_rollups"], db["rollup_state"], wait=0)
+    rollups.accumulator.flush()
+
+    assert counts(db) == {YESTERDAY + timedelta(hours=1): 5, TODAY: 4}
+    assert counts(db, "day") == {YESTERDAY: 5, TODAY: 4}
+    assert rollups.accumulator.stats["backfill_skipped"] == 2
+
+
+def test_replayed_readings_before_the_cutoff_are_left_to_the_next_backfill(setup):
+    store, rollups, db = setup
+    ingest(store, rollups, [reading(YESTERDAY + timedelta(hours=2))])
+    backfill(store, db["sensor_rollups"], db["rollup_state"], wait=0)
+    rollups.accumulator.flush()
+
+    ingest(store, rollups, [reading(YESTERDAY + timedelta(hours=2, minutes=5), temperature=30.0)])
+    rollups.accumulator.flush()
+    assert counts(db) == {YESTERDAY + timedelta(hours=2): 1}
+
+    backfill(store, db["sensor_rollups"], db["rollup_state"], wait=0)
+    doc = db["sensor_rollups"].find_one({"resolution": "hour"})
+    assert doc["count"] == 2
+    assert doc["sum"]["temperature"] == 55.0 and doc["max"]["temperature"] == 30.0
+
+
+def test_backfill_removes_buckets_without_readings(setup):
+    store, rollups, db = setup
+    db["sensor_rollups"].insert_one({"device_id": "ROLL1", "resolution": "hour",
+                                     "bucket": YESTERDAY - timedelta(days=3), "count": 7})
+    ingest(store, rollups, [reading(YESTERDAY)])
+    rollups.accumulator.flush()
+    backfill(store, db["sensor_rollups"], db["rollup_state"], wait=0)
+    assert counts(db) == {YESTERDAY: 1}
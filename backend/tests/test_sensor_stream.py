@@ -0,0 +1,45 @@
+from datetime import datetime
+
+import pytest
+
+from sensor_stream import SensorHub, parse_event_id
+
+READING = {"temperature": 25.0, "timestamp": datetime(2026, 1, 1, 12, 0, 0)}
+
+
+def hub(backlog=None, **kwargs):
+    return SensorHub(lambda device_id: None, backlog or (lambda device_id, since, limit: [READING]),
+                     poll_interval=0.01, max_clients=2, **kwargs)
+
+
+@pytest.mark.parametrize("value", [None, "", "abc", "100000000000000000000", "-100000000000000000000"])
+def test_bad_event_ids_are_a_fresh_connect(value):
+    assert parse_event_id(value) is None
+
+
+def test_huge_last_event_id_does_not_leak_a_subscriber():
+    sensor_hub = hub()
+    for _ in range(5):
+        sub, initial = sensor_hub.subscribe("ABC123", 10 ** 20)
+        assert [reading for _, reading in initial] == [READING]
+        sensor_hub.unsubscribe(sub)
+    assert sensor_hub.stats["clients"] == 0
+
+
+def test_failed_subscribe_unsubscribes():
+    sensor_hub = hub()
+    sensor_hub._initial_events = lambda *args: 1 / 0
+    with pytest.raises(ZeroDivisionError):
+        sensor_hub.subscribe("ABC123")
+    assert sensor_hub.stats["clients"] == 0
+    assert "ABC123" not in sensor_hub._channels
+
+
+def test_stream_endpoint_with_huge_last_event_id(appmod, client):
+    with client.session_transaction() as session:
+        session["device_id"] = "ABC123"
+    clients = appmod.sensor_hub.stats["clients"]
+    response = client.get("/api/sensor/stream", headers={"Last-Event-ID": "100000000000000000000"})
+    assert response.status_code == 200
+    response.close()
+    assert appmod.sensor_hub.stats["clients"] == clients
@@ -21,6 +21,7 @@ document.addEventListener("DOMContentLoaded", function () {
     weatherSource: "manual",
     isLoading: false,
     sensorData: {},
+    sensorStream: null,
   };
 
   // Initialize the application
@@ -115,13 +116,53 @@ document.addEventListener("DOMContentLoaded", function () {
 
   function setWeatherSource(source) {
     state.weatherSource = source;
+    if (source !== "sensor") closeSensorStream();
 
     if (source === "api") {
       fetchWeatherAPI();
     } else if (source === "sensor") {
       showLoading(true);
       showMessage("Fetching latest sensor data from device...");
-      fetchSensorData();
+      if (window.EventSource) {
+        openSensorStream();
+      } else {
+        fetchSensorData();
+      }
+    }
+  }
+
+  // Live readings pushed by the server; the browser reconnects (with Last-Event-ID) on its own
+  function openSensorStream() {
+    closeSensorStream();
+    elements.sensorDataSection.style.display = "none";
+    const stream = new EventSource("/api/sensor/stream");
+    let received = false;
+
+    stream.onopen = () => showLoading(false);
+
+    stream.addEventListener("reading", (event) => {
+      const result = JSON.parse(event.data);
+      received = true;
+      showLoading(false);
+      showSensorData(result.data);
+    });
+
+    stream.onerror = () => {
+      // A closed stream means the server refused it (e.g. no device linked):
+      // fall back to a single request, which reports the error
+      if (stream.readyState === EventSource.CLOSED) {
+        closeSensorStream();
+        if (!received) fetchSensorData();
+      }
+    };
+
+    state.sensorStream = stream;
+  }
+
+  function closeSensorStream() {
+    if (state.sensorStream) {
+      state.sensorStream.close();
+      state.sensorStream = null;
     }
   }
 
@@ -142,28 +183,7 @@ document.addEventListener("DOMContentLoaded", function () {
         throw new Error(result.error);
       }
 
-      // Store the sensor data
-      state.sensorData = result.data;
-
-      // Display sensor data in sidebar
-      document.getElementById("sensorTempDisplay").textContent =
-        result.data.temperature?.toFixed(1) || "--";
-      document.getElementById("sensorHumidityDisplay").textContent =
-        result.data.humidity?.toFixed(1) || "--";
-      document.getElementById("sensorPhDisplay").textContent =
-        result.data.ph?.toFixed(1) || "--";
-      document.getElementById("sensorNDisplay").textContent =
-        result.data.N?.toFixed(1) || "--";
-      document.getElementById("sensorPDisplay").textContent =
-        result.data.P?.toFixed(1) || "--";
-      document.getElementById("sensorKDisplay").textContent =
-        result.data.K?.toFixed(1) || "--";
-      document.getElementById("sensorMoistureDisplay").textContent =
-        result.data.moisture?.toFixed(1) || "--";
-      document.getElementById("sensorECDisplay").textContent =
-        result.data.ec?.toFixed(1) || "--";
-
-      elements.sensorDataSection.style.display = "block";
+      showSensorData(result.data);
     } catch (error) {
       showError("Could not fetch sensor data: " + error.message);
     } finally {
@@ -171,6 +191,31 @@ document.addEventListener("DOMContentLoaded", function () {
     }
   }
 
+  function showSensorData(data) {
+    // Store the sensor data
+    state.sensorData = data;
+
+    // Display sensor data in sidebar
+    document.getElementById("sensorTempDisplay").textContent =
+      data.temperature?.toFixed(1) || "--";
+    document.getElementById("sensorHumidityDisplay").textContent =
+      data.humidity?.toFixed(1) || "--";
+    document.getElementById("sensorPhDisplay").textContent =
+      data.ph?.toFixed(1) || "--";
+    document.getElementById("sensorNDisplay").textContent =
+      data.N?.toFixed(1) || "--";
+    document.getElementById("sensorPDisplay").textContent =
+      data.P?.toFixed(1) || "--";
+    document.getElementById("sensorKDisplay").textContent =
+      data.K?.toFixed(1) || "--";
+    document.getElementById("sensorMoistureDisplay").textContent =
+      data.moisture?.toFixed(1) || "--";
+    document.getElementById("sensorECDisplay").textContent =
+      data.ec?.toFixed(1) || "--";
+
+    elements.sensorDataSection.style.display = "block";
+  }
+
   function useSensorData() {
     if (Object.keys(state.sensorData).length === 0) {
       showError("No sensor data available. Please fetch sensor data first.");